@@ -8,11 +8,14 @@ import os
 import warnings
 import numpy as np
 from mpl_toolkits.mplot3d import Axes3D
-from matplotlib.animation import FuncAnimation, PillowWriter
+from render_parallel import render_animation
 
 # --- CONFIGURATION (CYBERPUNK MODE) ---
 LOG_FILE = 'chat_qa_log.txt'
 OUTPUT_DIR = 'analytics_cyberpunk_report'
+# Кадры вращения рисуются параллельно (render_parallel.py): None — по числу ядер, 1 — в одном процессе
+RENDER_WORKERS = None
+RENDER_ENCODER = 'auto'  # ffmpeg, если есть в PATH, иначе pillow
 
 # ЧЕРНЫЙ СПИСОК (Михаил, Захар, Егор)
 EXCLUDED_IDS = {'6753772275', '814358254', '1270577551'}
@@ -83,33 +86,11 @@ def parse_log_file(filepath):
         
     return df
 
-def generate_3d_report():
-    if not os.path.exists(OUTPUT_DIR): os.makedirs(OUTPUT_DIR)
-    
-    df = parse_log_file(LOG_FILE)
-    if df.empty: return
-
-    df_time = df.dropna(subset=['datetime']).copy()
-    print(f"PROCESSING {len(df_time)} DATA POINTS...")
-
-    # Подготовка данных для 3D
-    df_time['hour'] = df_time['datetime'].dt.hour
-    df_time['weekday_num'] = df_time['datetime'].dt.weekday  # 0=Mon, 6=Sun
-    df_time['msg_len'] = df_time['question'].str.len()
-    
-    # 1. 3D SCATTER ANIMATION (Вращающийся куб)
-    # Оси: День недели (X), Час (Y), Длина сообщения (Z)
-    print("RENDERING 3D HOLOGRAPHIC CUBE (GIF)... PLEASE WAIT...")
-    
+def setup_activity_cube(x, y, z, colors):
+    """Вращающийся 3D-куб: кадр — азимут камеры в градусах."""
     fig = plt.figure(figsize=(10, 10))
     ax = fig.add_subplot(111, projection='3d')
     
-    # Данные
-    x = df_time['weekday_num'] + np.random.normal(0, 0.1, size=len(df_time)) # Джиттер
-    y = df_time['hour'] + np.random.normal(0, 0.1, size=len(df_time))
-    z = df_time['msg_len']
-    colors = df_time['hour']
-    
     scatter = ax.scatter(x, y, z, c=colors, cmap='plasma', s=40, alpha=0.8, edgecolors='w', linewidth=0.2)
     
     ax.set_xlabel('Day of Week (0-6)', color='cyan')
@@ -128,16 +109,43 @@ def generate_3d_report():
         ax.view_init(elev=20, azim=frame)
         return scatter,
 
+    return fig, update
+
+def generate_3d_report():
+    if not os.path.exists(OUTPUT_DIR): os.makedirs(OUTPUT_DIR)
+    
+    df = parse_log_file(LOG_FILE)
+    if df.empty: return
+
+    df_time = df.dropna(subset=['datetime']).copy()
+    print(f"PROCESSING {len(df_time)} DATA POINTS...")
+
+    # Подготовка данных для 3D
+    df_time['hour'] = df_time['datetime'].dt.hour
+    df_time['weekday_num'] = df_time['datetime'].dt.weekday  # 0=Mon, 6=Sun
+    df_time['msg_len'] = df_time['question'].str.len()
+    
+    # 1. 3D SCATTER ANIMATION (Вращающийся куб)
+    # Оси: День недели (X), Час (Y), Длина сообщения (Z)
+    print("RENDERING 3D HOLOGRAPHIC CUBE (GIF)... PLEASE WAIT...")
+    
+    # Данные (джиттер считается здесь один раз: все процессы рендера рисуют одни и те же точки)
+    x = (df_time['weekday_num'] + np.random.normal(0, 0.1, size=len(df_time))).to_numpy() # Джиттер
+    y = (df_time['hour'] + np.random.normal(0, 0.1, size=len(df_time))).to_numpy()
+    z = df_time['msg_len'].to_numpy()
+    colors = df_time['hour'].to_numpy()
+    cube = (x, y, z, colors)
+
     # Создаем GIF (360 градусов, 1 кадр на 2 градуса = 180 кадров)
     try:
-        ani = FuncAnimation(fig, update, frames=np.arange(0, 360, 2), interval=50)
-        ani.save(f'{OUTPUT_DIR}/1_3d_activity_spin.gif', writer=PillowWriter(fps=20))
-        print("✅ 3D ANIMATION SAVED: 1_3d_activity_spin.gif")
+        stats = render_animation(setup_activity_cube, cube, np.arange(0, 360, 2), f'{OUTPUT_DIR}/1_3d_activity_spin.gif',
+                                 20, workers=RENDER_WORKERS, encoder=RENDER_ENCODER)
+        print(f"✅ 3D ANIMATION SAVED: 1_3d_activity_spin.gif ({stats['fps']} frames/s, workers: {stats['workers']})")
     except Exception as e:
         print(f"⚠️ Animation skipped (needs ffmpeg/pillow): {e}")
-        plt.savefig(f'{OUTPUT_DIR}/1_3d_static.png')
-
-    plt.close()
+        fig, _ = setup_activity_cube(*cube)
+        fig.savefig(f'{OUTPUT_DIR}/1_3d_static.png')
+        plt.close(fig)
 
     # 2. 3D SURFACE PLOT (Топография задержки)
     print("RENDERING LATENCY TOPOGRAPHY...")
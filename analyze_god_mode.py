@@ -2,7 +2,7 @@ import re
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.animation import FuncAnimation, PillowWriter
+from render_parallel import render_animation
 from datetime import datetime
 import os
 import warnings
@@ -12,6 +12,9 @@ LOG_FILE = 'chat_qa_log.txt'
 OUTPUT_DIR = 'analytics_god_mode'
 FPS = 20  # Высокая плавность
 DURATION_SEC = 10 # Длительность видео
+# Кадры рисуются параллельно (render_parallel.py): None — по числу ядер, 1 — в одном процессе
+RENDER_WORKERS = None
+RENDER_ENCODER = 'auto'  # ffmpeg, если есть в PATH, иначе pillow
 
 # ЧЕРНЫЙ СПИСОК (Удаляем шум)
 EXCLUDED_IDS = {'6753772275', '814358254', '1270577551'}
@@ -95,10 +98,19 @@ def generate_temporal_vortex(df):
     # Это создает эффект расширения спирали со временем
     df['r'] = (df['timestamp'] - first_date).dt.total_seconds() / 86400
     
-    # Цвет = Задержка (от Синего к Красному)
-    colors = df['latency']
-    sizes = df['question_len'].clip(lower=10, upper=100) # Размер точки зависит от длины вопроса
-    
+    # Логика анимации
+    total_frames = FPS * DURATION_SEC
+    chunk_size = len(df) // total_frames
+    if chunk_size < 1: chunk_size = 1
+
+    save_path = f'{OUTPUT_DIR}/GOD_MODE_VORTEX.gif'
+    columns = df[['timestamp', 'theta', 'r', 'latency', 'question_len']]
+    stats = render_animation(setup_temporal_vortex, (columns, chunk_size), range(total_frames), save_path, FPS,
+                             workers=RENDER_WORKERS, encoder=RENDER_ENCODER)
+    print(f"✅ ВИДЕО ГОТОВО: {save_path} ({stats['fps']} кадр/с, процессов: {stats['workers']})")
+
+def setup_temporal_vortex(df, chunk_size):
+    """Фигура вихря и функция кадра: кадр N показывает первые (N+1)·chunk_size событий."""
     # Настройка фигуры
     fig = plt.figure(figsize=(10, 10))
     ax = fig.add_subplot(111, projection='polar')
@@ -112,6 +124,8 @@ def generate_temporal_vortex(df):
     
     # Скатер плот
     scatter = ax.scatter([], [], c=[], s=[], cmap='cool', alpha=0.8, edgecolors='none')
+    # Шкала цвета по всем данным: иначе каждый процесс рендера подстроит её под свой первый кадр
+    scatter.set_clim(df['latency'].min(), df['latency'].max())
     
     # Текстовый счетчик
     info_text = fig.text(0.02, 0.95, "", color='white', fontsize=14, fontfamily='monospace')
@@ -119,12 +133,7 @@ def generate_temporal_vortex(df):
     # Пределы
     max_r = df['r'].max() + 1
     ax.set_ylim(0, max_r)
-    
-    # Логика анимации
-    total_frames = FPS * DURATION_SEC
-    chunk_size = len(df) // total_frames
-    if chunk_size < 1: chunk_size = 1
-    
+
     def update(frame):
         # Показываем данные накопленным итогом
         limit = (frame + 1) * chunk_size
@@ -145,12 +154,7 @@ def generate_temporal_vortex(df):
         
         return scatter, info_text
 
-    ani = FuncAnimation(fig, update, frames=total_frames, interval=1000/FPS, blit=False)
-    
-    save_path = f'{OUTPUT_DIR}/GOD_MODE_VORTEX.gif'
-    ani.save(save_path, writer=PillowWriter(fps=FPS))
-    print(f"✅ ВИДЕО ГОТОВО: {save_path}")
-    plt.close()
+    return fig, update
 
 def generate_ascii_dossier(df):
     """Генерирует секретное досье в текстовом виде."""
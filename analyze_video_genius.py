@@ -6,12 +6,15 @@ from datetime import datetime, timedelta
 import os
 import warnings
 import numpy as np
-from matplotlib.animation import FuncAnimation, PillowWriter
+from render_parallel import render_animation
 
 # --- КОНФИГУРАЦИЯ (GENIUS MODE) ---
 LOG_FILE = 'chat_qa_log.txt'
 OUTPUT_DIR = 'analytics_video_studio'
 FPS = 15  # Кадров в секунду (плавность)
+# Кадры рисуются параллельно (render_parallel.py): None — по числу ядер, 1 — в одном процессе
+RENDER_WORKERS = None
+RENDER_ENCODER = 'auto'  # ffmpeg, если есть в PATH, иначе pillow
 
 # ЧЕРНЫЙ СПИСОК (Жесткий бан)
 EXCLUDED_IDS = {'6753772275', '814358254', '1270577551'}
@@ -84,7 +87,16 @@ def generate_neural_pulse_video(df):
     
     # Если данных мало, уменьшаем шаг
     step = max(1, total_frames // 200) # Ограничиваем видео ~200 кадрами для скорости
-    
+
+    # Рендерим кадры параллельно
+    frames = range(0, total_frames, step)
+    save_path = f'{OUTPUT_DIR}/1_neural_pulse.gif'
+    stats = render_animation(setup_neural_pulse, (counts, window_size), frames, save_path, FPS,
+                             workers=RENDER_WORKERS, encoder=RENDER_ENCODER)
+    print(f"✅ ВИДЕО 1 ГОТОВО: {save_path} ({stats['fps']} кадр/с, процессов: {stats['workers']})")
+
+def setup_neural_pulse(counts, window_size):
+    """Фигура 'Neural Pulse' и функция кадра — в каждом процессе рендера своя."""
     fig, ax = plt.subplots(figsize=(10, 5))
     line, = ax.plot([], [], color='#00ff00', lw=2) # Хакерский зеленый
     
@@ -93,10 +105,6 @@ def generate_neural_pulse_video(df):
     
     ax.set_ylim(0, counts.max() * 1.2)
     ax.set_facecolor('#050505')
-    
-    def init():
-        line.set_data([], [])
-        return line, scanner
 
     def update(frame_idx):
         start = frame_idx
@@ -118,14 +126,7 @@ def generate_neural_pulse_video(df):
         
         return line, scanner
 
-    # Создаем анимацию
-    frames = range(0, total_frames, step)
-    ani = FuncAnimation(fig, update, frames=frames, init_func=init, blit=False)
-    
-    save_path = f'{OUTPUT_DIR}/1_neural_pulse.gif'
-    ani.save(save_path, writer=PillowWriter(fps=FPS))
-    print(f"✅ ВИДЕО 1 ГОТОВО: {save_path}")
-    plt.close()
+    return fig, update
 
 def generate_heatmap_evolution_video(df):
     """
@@ -136,7 +137,15 @@ def generate_heatmap_evolution_video(df):
     
     df['week'] = df['timestamp'].dt.to_period('W')
     weeks = df['week'].unique()
-    
+
+    save_path = f'{OUTPUT_DIR}/2_heatmap_evolution.gif'
+    # Медленнее FPS, чтобы успеть рассмотреть неделю
+    stats = render_animation(setup_heatmap_evolution, (df[['timestamp']],), list(weeks), save_path, 2,
+                             workers=RENDER_WORKERS, encoder=RENDER_ENCODER)
+    print(f"✅ ВИДЕО 2 ГОТОВО: {save_path} ({stats['fps']} кадр/с, процессов: {stats['workers']})")
+
+def setup_heatmap_evolution(df):
+    """Фигура 'Heatmap Evolution': кадр — неделя (pandas Period)."""
     fig, ax = plt.subplots(figsize=(10, 6))
     
     def update(week_val):
@@ -167,14 +176,8 @@ def generate_heatmap_evolution_video(df):
         ax.set_title(f'ACTIVITY SECTOR SCAN: Week of {week_val}', color='orange', fontsize=16)
         ax.set_xlabel('Hour (00-24)')
         ax.set_ylabel('')
-        
-    ani = FuncAnimation(fig, update, frames=weeks, repeat=True)
-    
-    save_path = f'{OUTPUT_DIR}/2_heatmap_evolution.gif'
-    # Медленнее FPS, чтобы успеть рассмотреть неделю
-    ani.save(save_path, writer=PillowWriter(fps=2)) 
-    print(f"✅ ВИДЕО 2 ГОТОВО: {save_path}")
-    plt.close()
+
+    return fig, update
 
 def main():
     if not os.path.exists(OUTPUT_DIR): os.makedirs(OUTPUT_DIR)
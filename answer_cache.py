@@ -0,0 +1,49 @@
+# coding: utf-8
+"""
+Кэш сгенерированных RAG-ответов.
+
+Генерации, не уложившиеся в бюджет задержки, дорабатывают в фоне и
+складывают результат сюда: когда тот же вопрос зададут снова, ответ
+отдаётся сразу. Ключ включает версию снимка базы, поэтому после
+перезагрузки индекса старые ответы не используются.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class AnswerCache:
+    """LRU с ограничением по времени жизни записей. Потокобезопасен."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: str):
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
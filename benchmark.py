@@ -0,0 +1,1028 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Офлайн-бенчмарк поиска и задержек RAG-бота.
+
+Прогоняет реальные вопросы из chat_qa_log.txt и варианты вопросов из
+data/opd_dataset_augmented.json через RAGChatBot. LLM заменяется
+детерминированной локальной заглушкой, поэтому результат воспроизводим
+и не зависит от Ollama.
+
+На выходе — JSON с задержками по этапам (p50/p95/p99), долей прямых
+ответов и hit@k по original_id. Два таких файла удобно сравнивать между
+прогонами (например, до и после изменения TOP_K или порогов).
+
+Пример:
+    python benchmark.py replay --limit 500 --output bench_before.json
+    python benchmark.py prefill --questions 50   # живая Ollama: экономия prefill
+    python benchmark.py schedule --scale 30000   # нечёткий поиск по ФИО с опечатками
+    python benchmark.py schedule_load            # память и импорт: DataFrame против schedule_store/
+    python benchmark.py lexical                  # ложные совпадения быстрого пути по триграммам
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import requests
+
+import rag_chatbot
+from context_builder import ContextBuilder
+from knowledge_store import JsonKnowledgeMap, KnowledgeStore, load_knowledge_map
+from embedding_cache import EmbeddingCache
+from executors import configure_executors, executor_stats, shutdown_executors
+from lexical_index import LexicalIndex, char_ngrams, dice, normalize_text
+from schedule_search import FioIndex
+from schedule_store import ScheduleStore
+from index_types import (INDEX_TYPES, POOLING_MODES, IndexParams, make_index, apply_search_params,
+                         index_size_bytes, pool_embeddings)
+
+PROJECT_ROOT = Path(__file__).parent
+LOG_PATH = PROJECT_ROOT / 'chat_qa_log.txt'
+DATASET_PATH = PROJECT_ROOT / 'data' / 'opd_dataset_augmented.json'
+HIT_AT_K = (1, 3, 5, 7)
+
+NOT_FOUND_PREFIX = "К сожалению, я не смог найти точный ответ"
+PREFILL_LAYOUTS = ('legacy', 'cached')
+
+
+# --- Источники вопросов ---
+
+def load_log_questions(log_path: Path) -> List[Dict[str, Any]]:
+    """Извлекает вопросы студентов из Q/A-лога (формат log_question_answer)."""
+    if not log_path.exists():
+        print(f"⚠️ Лог не найден: {log_path}")
+        return []
+    questions = []
+    q_buf: List[str] = []
+    state = 'META'
+    with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('----------'):
+                if q_buf:
+                    questions.append(" ".join(q_buf).strip())
+                q_buf, state = [], 'META'
+            elif line.startswith('Q:'):
+                state = 'Q'
+                if line[2:].strip():
+                    q_buf.append(line[2:].strip())
+            elif line.startswith('A:'):
+                state = 'A'
+            elif state == 'Q' and line:
+                q_buf.append(line)
+    if q_buf:
+        questions.append(" ".join(q_buf).strip())
+    # Команды и служебные сообщения не проходят через RAG
+    return [{"question": q, "original_id": None, "source": "log"}
+            for q in questions if q and not q.startswith('/')]
+
+
+def load_dataset_questions(dataset_path: Path) -> List[Dict[str, Any]]:
+    """Разворачивает варианты вопросов датасета; original_id служит эталоном для hit@k."""
+    if not dataset_path.exists():
+        print(f"⚠️ Датасет не найден: {dataset_path}")
+        return []
+    with open(dataset_path, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    questions = []
+    for item in raw:
+        oid = item.get('id') or item.get('original_id')
+        variants = item.get('questions') or [item.get('question') or item.get('question_variant')]
+        for q in variants:
+            if isinstance(q, str) and q.strip():
+                questions.append({"question": q.strip(), "original_id": oid, "source": "dataset"})
+    return questions
+
+
+# --- Детерминированная заглушка LLM ---
+
+def make_llm_stub(intent: str, delay: float):
+    """
+    Возвращает замену call_ollama_api. Классификатор всегда отвечает
+    заданным намерением, остальные промпты получают фиксированный текст.
+    delay имитирует время генерации (0 — без задержки).
+    """
+    def stub(prompt: str, temperature: float = 0.15, kind: str = 'generate', **kwargs) -> str:
+        if delay:
+            time.sleep(delay)
+        if kind == 'intent':
+            return intent
+        return "Тестовый ответ заглушки LLM."
+    return stub
+
+
+# --- Замер этапов ---
+
+class StageTimer:
+    """Копит длительности по именованным этапам."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def wrap(self, stage: str, func):
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.samples[stage].append(time.perf_counter() - t0)
+        return timed
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {stage: latency_stats(values) for stage, values in sorted(self.samples.items())}
+
+
+class _TimedIndex:
+    """Прокси FAISS-индекса, замеряющий каждый вызов search."""
+
+    def __init__(self, index, timer: StageTimer):
+        self._index = index
+        self.search = timer.wrap('search', index.search)
+
+    def __getattr__(self, name):
+        return getattr(self._index, name)
+
+
+def latency_stats(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    arr = np.array(values, dtype=np.float64) * 1000.0
+    return {
+        "count": int(arr.size),
+        "mean_ms": round(float(arr.mean()), 3),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p95_ms": round(float(np.percentile(arr, 95)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+        "max_ms": round(float(arr.max()), 3),
+    }
+
+
+def retrieved_ids(bot, encode, index, question: str, k: int) -> List[Any]:
+    """Уникальные original_id из top-k выдачи индекса в порядке ранга."""
+    qvec = np.array([encode(question)], dtype=np.float32)
+    _, indices = index.search(qvec, k)
+    ids: List[Any] = []
+    for idx in indices[0]:
+        if idx == -1:
+            continue
+        # В бинарном хранилище original_id — строка, в JSON может быть числом
+        oid = str(bot.data_map.original_id(int(idx)))
+        if oid not in ids:
+            ids.append(oid)
+    return ids
+
+
+# --- Прогон ---
+
+def run_replay(args) -> Dict[str, Any]:
+    # Настраиваемые параметры подменяются на уровне модуля — так же их читает сам бот
+    if args.top_k is not None:
+        rag_chatbot.TOP_K = args.top_k
+    if args.confidence_threshold is not None:
+        rag_chatbot.CONFIDENCE_THRESHOLD = args.confidence_threshold
+    if args.direct_threshold is not None:
+        rag_chatbot.DIRECT_ANSWER_THRESHOLD = args.direct_threshold
+    if args.model:
+        rag_chatbot.EMBEDDER_MODEL = args.model
+    if args.index_path:
+        rag_chatbot.INDEX_PATH = args.index_path
+    if args.map_path:
+        rag_chatbot.MAP_PATH = args.map_path
+    if args.store_dir:
+        rag_chatbot.STORE_PATH = args.store_dir
+    sizes = {stage: n for stage, n in (('cpu', args.cpu_workers), ('llm', args.llm_workers)) if n}
+    if sizes:
+        configure_executors(**sizes)
+
+    timer = StageTimer()
+    if args.llm_url:
+        # Настоящий HTTP-клиент бота против ollama_stub.py (или живой Ollama)
+        rag_chatbot.OLLAMA_HOST = args.llm_url.rstrip('/')
+        rag_chatbot.call_ollama_api = timer.wrap('llm', rag_chatbot.call_ollama_api)
+    else:
+        rag_chatbot.call_ollama_api = timer.wrap('llm', make_llm_stub(args.intent, args.llm_delay))
+
+    # Генерацию считаем по RAG-вызовам: классификация при раннем выходе может дорабатывать в фоне
+    rag_calls = [0]
+    llm = rag_chatbot.call_ollama_api
+
+    def counted_llm(prompt: str, *a, **kwargs):
+        if kwargs.get('kind') == 'rag':
+            rag_calls[0] += 1
+        return llm(prompt, *a, **kwargs)
+    rag_chatbot.call_ollama_api = counted_llm
+
+    t0 = time.perf_counter()
+    bot = rag_chatbot.RAGChatBot(debug=False)
+    init_seconds = time.perf_counter() - t0
+
+    # Оригиналы нужны для hit@k, чтобы его замеры не попадали в этапы ответа
+    raw_encode, raw_index = bot._encode, bot.index
+    bot._encode = timer.wrap('encode', raw_encode)
+    bot.index = _TimedIndex(raw_index, timer)
+
+    questions: List[Dict[str, Any]] = []
+    if args.source in ('log', 'all'):
+        questions += load_log_questions(args.log_path)
+    if args.source in ('dataset', 'all'):
+        questions += load_dataset_questions(args.dataset_path)
+    if not questions:
+        raise SystemExit("❌ Нет вопросов для прогона.")
+    rng = random.Random(args.seed)
+    if args.limit and len(questions) > args.limit:
+        questions = rng.sample(questions, args.limit)
+
+    # Прогрев: первые вызовы энкодера заметно медленнее остальных
+    for item in questions[:args.warmup]:
+        bot.answer_by_rag(item["question"])
+    timer.samples.clear()
+
+    # Ответ из кэша генераций — без вызова RAG и без пометки, его не отличить от прямого по тексту
+    cache_hits = [0]
+    cache_get = bot.answer_cache.get
+
+    def counted_cache_get(key):
+        value = cache_get(key)
+        if value is not None:
+            cache_hits[0] += 1
+        return value
+    bot.answer_cache.get = counted_cache_get
+
+    outcomes: Dict[str, int] = defaultdict(int)
+    hits = {k: 0 for k in HIT_AT_K}
+    labelled = 0
+    max_k = max(HIT_AT_K)
+
+    print(f"▶️ Прогон {len(questions)} вопросов ({args.pipeline})...")
+    replay_started = time.perf_counter()
+    for item in questions:
+        question = item["question"]
+        rag_calls_before, cache_hits_before = rag_calls[0], cache_hits[0]
+        t0 = time.perf_counter()
+        deadline = time.monotonic() + args.latency_budget if args.latency_budget else None
+        if args.pipeline == 'concurrent':
+            intent, retrieval = timer.wrap('classify_with_retrieval', bot.classify_with_retrieval)(question)
+            if intent is None:
+                answer = bot.direct_answer(retrieval)
+            else:
+                answer = timer.wrap('answer_by_rag', bot.answer_by_rag)(question, retrieval, deadline)
+        else:
+            timer.wrap('classify_intent', bot.classify_intent)(question)
+            answer = timer.wrap('answer_by_rag', bot.answer_by_rag)(question, None, deadline)
+        timer.samples['critical_path'].append(time.perf_counter() - t0)
+
+        if answer.startswith(rag_chatbot.FALLBACK_PREFIX):
+            outcomes['fallback'] += 1
+        elif answer.startswith(rag_chatbot.RETRIEVAL_ONLY_PREFIX):
+            outcomes['retrieval_only'] += 1
+        elif rag_calls[0] > rag_calls_before:
+            outcomes['generated'] += 1
+        elif cache_hits[0] > cache_hits_before:
+            outcomes['cached'] += 1
+        elif answer.startswith(NOT_FOUND_PREFIX):
+            outcomes['not_found'] += 1
+        else:
+            outcomes['direct'] += 1
+
+        if item["original_id"] is not None:
+            labelled += 1
+            ids = retrieved_ids(bot, raw_encode, raw_index, question, max_k)
+            for k in HIT_AT_K:
+                if str(item["original_id"]) in ids[:k]:
+                    hits[k] += 1
+
+    # Фоновые генерации после запасных ответов должны доработать, чтобы посчитать экономию
+    stats = executor_stats()
+    shutdown_executors(wait=True)
+    replay_seconds = time.perf_counter() - replay_started
+    for stage_stats in stats.values():
+        # Доля времени прогона, которую потоки пула были заняты
+        stage_stats['utilization'] = round(stage_stats['busy_seconds'] / (stage_stats['workers'] * replay_seconds), 4)
+
+    total = len(questions)
+    report = {
+        "config": {
+            "top_k": rag_chatbot.TOP_K,
+            "confidence_threshold": rag_chatbot.CONFIDENCE_THRESHOLD,
+            "direct_answer_threshold": rag_chatbot.DIRECT_ANSWER_THRESHOLD,
+            "embedder_model": rag_chatbot.EMBEDDER_MODEL,
+            "index_path": str(rag_chatbot.INDEX_PATH),
+            "index_type": type(raw_index).__name__,
+            "index_ntotal": int(raw_index.ntotal),
+            "source": args.source,
+            "seed": args.seed,
+            "llm_delay": args.llm_delay,
+            "llm_url": args.llm_url,
+            "pipeline": args.pipeline,
+            "latency_budget": args.latency_budget,
+            "executor_workers": {stage: item['workers'] for stage, item in stats.items()},
+        },
+        "questions": total,
+        "init_seconds": round(init_seconds, 3),
+        "stages": timer.summary(),
+        "executors": stats,
+        "outcomes": dict(outcomes),
+        "direct_answer_rate": round(outcomes['direct'] / total, 4),
+        "latency_fallback": {
+            "rate": round(outcomes['fallback'] / total, 4),
+            # На сколько раньше студент получил ответ, чем получил бы сгенерированный
+            "saved": latency_stats(list(bot.fallback_saved)),
+        },
+        "labelled_questions": labelled,
+        "hit_at_k": {str(k): round(hits[k] / labelled, 4) if labelled else None for k in HIT_AT_K},
+    }
+    return report
+
+
+# --- Сравнение форматов карты данных ---
+
+def _rss_bytes() -> int:
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _measure_map_load(kind: str, path: str, lookups: int) -> Dict[str, Any]:
+    """Выполняется в отдельном процессе, чтобы замеры памяти не влияли друг на друга."""
+    rss_before = _rss_bytes()
+    t0 = time.perf_counter()
+    if kind == 'json':
+        with open(path, 'r', encoding='utf-8') as f:
+            data_map = JsonKnowledgeMap(json.load(f))
+    else:
+        data_map = KnowledgeStore(Path(path))
+    load_seconds = time.perf_counter() - t0
+    rss_loaded = _rss_bytes()
+
+    # Типичный доступ answer_by_rag: вопрос, ответ и ключ дедупликации по номеру строки
+    rng = random.Random(0)
+    rows = [rng.randrange(len(data_map)) for _ in range(lookups)]
+    t0 = time.perf_counter()
+    for i in rows:
+        data_map.answer_slot(i)
+        data_map.question(i)
+        data_map.answer(i)
+    lookup_seconds = time.perf_counter() - t0
+    return {
+        "entries": len(data_map),
+        "load_ms": round(load_seconds * 1000, 3),
+        "rss_after_load_mb": round((rss_loaded - rss_before) / 2**20, 3),
+        "rss_after_lookups_mb": round((_rss_bytes() - rss_before) / 2**20, 3),
+        "lookup_us": round(lookup_seconds / max(1, lookups) * 1e6, 3),
+    }
+
+
+def _dir_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.iterdir()) if path.is_dir() else path.stat().st_size
+
+
+def run_store(args) -> Dict[str, Any]:
+    report: Dict[str, Any] = {}
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        for kind, path in (('json', args.map_path), ('store', args.store_dir)):
+            if not path.exists():
+                print(f"⚠️ Пропускаем {kind}: {path} не найден")
+                continue
+            result = pool.apply(_measure_map_load, (kind, str(path), args.lookups))
+            result["disk_mb"] = round(_dir_size(path) / 2**20, 3)
+            report[kind] = result
+    return report
+
+
+# --- Сравнение типов индексов ---
+
+def cached_encoder(args):
+    """Кодирование через кэш эмбеддингов; модель грузится только при промахе."""
+    encoder = None
+
+    def encode(texts: List[str]) -> np.ndarray:
+        nonlocal encoder
+        if encoder is None:
+            from sentence_transformers import SentenceTransformer
+            encoder = SentenceTransformer(args.model, device=args.device)
+        return np.array(encoder.encode(texts, normalize_embeddings=True, batch_size=64), dtype=np.float32)
+
+    cache = EmbeddingCache(args.cache_dir, args.model)
+    return lambda texts: cache.get_or_encode(texts, encode)
+
+
+def query_texts(questions: List[str]) -> List[str]:
+    # Запросы кодируются с тем же префиксом, что и в RAGChatBot._encode
+    return [f"query: {q.strip()}" for q in questions]
+
+
+def load_benchmark_embeddings(args):
+    """Эмбеддинги пассажей базы и выборки реальных запросов."""
+    data_map = load_knowledge_map(args.store_dir, args.map_path)
+    passages = [data_map.question(i) for i in range(len(data_map))]
+    queries = [q["question"] for q in load_log_questions(args.log_path) + load_dataset_questions(args.dataset_path)]
+    rng = random.Random(args.seed)
+    if args.queries and len(queries) > args.queries:
+        queries = rng.sample(queries, args.queries)
+    encode = cached_encoder(args)
+    return data_map, encode(passages), encode(query_texts(queries))
+
+
+def search_one_by_one(index, queries: np.ndarray, k: int):
+    """Поиск по одному запросу, как в боте; возвращает (индексы, задержки)."""
+    found = np.empty((len(queries), k), dtype=np.int64)
+    latencies = []
+    for i in range(len(queries)):
+        t0 = time.perf_counter()
+        _, idx = index.search(queries[i:i + 1], k)
+        latencies.append(time.perf_counter() - t0)
+        found[i] = idx[0]
+    return found, latencies
+
+
+def recall_at_k(found: np.ndarray, exact: np.ndarray) -> float:
+    k = exact.shape[1]
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found.tolist(), exact.tolist()))
+    return hits / (len(exact) * k)
+
+
+def run_index(args) -> Dict[str, Any]:
+    _, passages, queries = load_benchmark_embeddings(args)
+    k = args.k
+    exact_index = make_index(passages, IndexParams(index_type='flat'))
+    exact, _ = search_one_by_one(exact_index, queries, k)
+
+    results = []
+    for index_type in args.types:
+        base = IndexParams(index_type=index_type, hnsw_m=args.hnsw_m, ef_construction=args.ef_construction,
+                           nlist=args.nlist, pq_m=args.pq_m, pq_bits=args.pq_bits)
+        t0 = time.perf_counter()
+        try:
+            index = make_index(passages, base)
+        except ValueError as e:
+            print(f"⚠️ {index_type}: {e}")
+            results.append({"index_type": index_type, "error": str(e)})
+            continue
+        build_seconds = time.perf_counter() - t0
+        size = index_size_bytes(index)
+
+        # Для каждого типа перебираем его параметр поиска; у flat он один
+        if index_type == 'hnsw':
+            variants = [{"ef_search": v} for v in args.ef_search]
+        elif index_type.startswith('ivf'):
+            variants = [{"nprobe": v} for v in args.nprobe]
+        else:
+            variants = [{}]
+        for search_params in variants:
+            apply_search_params(index, IndexParams(**{**base.as_meta(), **search_params}))
+            found, latencies = search_one_by_one(index, queries, k)
+            results.append({
+                "index_type": index_type,
+                **search_params,
+                "build_seconds": round(build_seconds, 3),
+                "size_mb": round(size / 2**20, 3),
+                f"recall_at_{k}": round(recall_at_k(found, exact), 4),
+                "latency": latency_stats(latencies),
+            })
+            print(f"  {index_type} {search_params}: recall@{k}={results[-1][f'recall_at_{k}']}, "
+                  f"p50={results[-1]['latency']['p50_ms']} мс, {results[-1]['size_mb']} МБ")
+    return {"passages": int(passages.shape[0]), "queries": int(queries.shape[0]), "k": k, "results": results}
+
+
+# --- Индекс «вектор на ответ» против «вектор на вариант» ---
+
+def distinct_groups(rows: np.ndarray, groups: List[str]) -> List[str]:
+    result: List[str] = []
+    for row in rows:
+        if row != -1 and groups[row] not in result:
+            result.append(groups[row])
+    return result
+
+
+def run_pooled(args) -> Dict[str, Any]:
+    """
+    Часть вариантов откладывается как запросы (их в индексе нет), остальные
+    индексируются по-разному. hit@k считается по уникальным original_id в
+    top-k — ровно то, что остаётся у answer_by_rag после дедупликации.
+    """
+    data_map = load_knowledge_map(args.store_dir, args.map_path)
+    questions = [data_map.question(i) for i in range(len(data_map))]
+    groups = [str(data_map.original_id(i)) for i in range(len(data_map))]
+    rng = random.Random(args.seed)
+    rows = list(range(len(questions)))
+    rng.shuffle(rows)
+    n_queries = min(args.queries, int(len(rows) * args.holdout)) if args.queries else int(len(rows) * args.holdout)
+    query_rows, base_rows = rows[:n_queries], sorted(rows[n_queries:])
+
+    encode = cached_encoder(args)
+    passages = encode([questions[r] for r in base_rows])
+    base_groups = [groups[r] for r in base_rows]
+    queries = encode(query_texts([questions[r] for r in query_rows]))
+    truth = [groups[r] for r in query_rows]
+    k = args.k
+
+    results = []
+    for pooling in args.modes:
+        params = IndexParams(index_type=args.index_type, pooling=pooling, medoids=args.medoids)
+        t0 = time.perf_counter()
+        vectors, representatives = pool_embeddings(passages, base_groups, params)
+        index = make_index(vectors, params)
+        build_seconds = time.perf_counter() - t0
+        vector_groups = [base_groups[r] for r in representatives]
+
+        found, latencies = search_one_by_one(index, queries, k)
+        hits = {h: 0 for h in HIT_AT_K if h <= k}
+        distinct_total = 0
+        for expected, rows_found in zip(truth, found):
+            ids = distinct_groups(rows_found, vector_groups)
+            distinct_total += len(ids)
+            for h in hits:
+                if expected in ids[:h]:
+                    hits[h] += 1
+        results.append({
+            "pooling": pooling,
+            "vectors": int(index.ntotal),
+            "size_mb": round(index_size_bytes(index) / 2**20, 3),
+            "build_seconds": round(build_seconds, 3),
+            "latency": latency_stats(latencies),
+            "hit_at_k": {str(h): round(v / len(truth), 4) for h, v in hits.items()},
+            f"distinct_answers_in_top_{k}": round(distinct_total / len(truth), 3),
+        })
+        print(f"  {pooling}: {results[-1]['vectors']} векторов, hit@k={results[-1]['hit_at_k']}, "
+              f"p50={results[-1]['latency']['p50_ms']} мс")
+    return {"base_variants": len(base_rows), "queries": len(query_rows), "k": k,
+            "index_type": args.index_type, "results": results}
+
+
+# --- Prefill: старая раскладка промптов против system + keep_alive ---
+
+def prefill_payload(layout: str, prompt: str, system: str, temperature: float, num_predict: Optional[int]) -> dict:
+    if layout == 'legacy':
+        # Как call_ollama_api до разделения шаблонов: всё в prompt, temperature вне options, без keep_alive
+        return {"model": rag_chatbot.OLLAMA_MODEL, "prompt": system + prompt, "temperature": temperature, "stream": False}
+    return rag_chatbot.ollama_payload(prompt, system, temperature, num_predict)
+
+
+def unload_model(url: str):
+    """Выгружает модель, чтобы обе раскладки стартовали с холодного состояния."""
+    requests.post(f"{url}/api/generate", json={"model": rag_chatbot.OLLAMA_MODEL, "keep_alive": 0}, timeout=60)
+
+
+def run_prefill(args) -> Dict[str, Any]:
+    """
+    Шлёт в Ollama ту же последовательность запросов, что и бот на каждый
+    вопрос (классификатор, затем RAG), в старой и новой раскладке. Время
+    prefill и число пересчитанных токенов берутся из ответа Ollama:
+    токены, найденные в кэше слота, в prompt_eval_count не попадают.
+    """
+    url = args.llm_url.rstrip('/')
+    data_map = load_knowledge_map(args.store_dir, args.map_path)
+    rng = random.Random(args.seed)
+    rows = rng.sample(range(len(data_map)), min(args.questions, len(data_map)))
+    builder = ContextBuilder(rag_chatbot.CONTEXT_TOKEN_BUDGET)
+
+    requests_plan = []
+    for row in rows:
+        question = data_map.question(row)
+        # Контекст — ответ на вопрос плюс пара случайных соседей, как в выдаче FAISS
+        docs = [(1.0, row, question, data_map.answer(row))]
+        docs += [(0.6, other, data_map.question(other), data_map.answer(other))
+                 for other in rng.sample(range(len(data_map)), 2)]
+        context = builder.build(docs).text
+        requests_plan.append(('intent', rag_chatbot.INTENT_CLASSIFIER_PROMPT_TEMPLATE.format(question=question),
+                              rag_chatbot.INTENT_CLASSIFIER_SYSTEM_PROMPT, 0.0, rag_chatbot.INTENT_NUM_PREDICT))
+        requests_plan.append(('rag', rag_chatbot.PROMPT_TEMPLATE.format(context=context, question=question),
+                              rag_chatbot.RAG_SYSTEM_PROMPT, 0.15, None))
+
+    report: Dict[str, Any] = {"llm_url": url, "model": rag_chatbot.OLLAMA_MODEL, "questions": len(rows), "layouts": {}}
+    for layout in args.layouts:
+        if not args.no_unload:
+            unload_model(url)
+        samples: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+        for i, (kind, prompt, system, temperature, num_predict) in enumerate(requests_plan):
+            if args.idle and i and kind == 'intent':
+                time.sleep(args.idle)
+            t0 = time.perf_counter()
+            r = requests.post(f"{url}/api/generate", json=prefill_payload(layout, prompt, system, temperature, num_predict),
+                              timeout=350)
+            r.raise_for_status()
+            data = r.json()
+            wall = time.perf_counter() - t0
+            sample = samples[kind]
+            sample['wall'].append(wall)
+            # Ollama отдаёт длительности в наносекундах
+            for field in ('load_duration', 'prompt_eval_duration', 'eval_duration'):
+                sample[field].append((data.get(field) or 0) / 1e9)
+            sample['prompt_eval_count'].append(data.get('prompt_eval_count') or 0)
+            sample['eval_count'].append(data.get('eval_count') or 0)
+
+        layout_report = {}
+        for kind, sample in samples.items():
+            layout_report[kind] = {
+                "wall": latency_stats(sample['wall']),
+                "load": latency_stats(sample['load_duration']),
+                "prefill": latency_stats(sample['prompt_eval_duration']),
+                "generation": latency_stats(sample['eval_duration']),
+                "prompt_eval_count_mean": round(float(np.mean(sample['prompt_eval_count'])), 1),
+                "eval_count_mean": round(float(np.mean(sample['eval_count'])), 1),
+            }
+            print(f"  {layout}/{kind}: prefill p50={layout_report[kind]['prefill'].get('p50_ms')} мс, "
+                  f"токенов промпта ~{layout_report[kind]['prompt_eval_count_mean']}")
+        report["layouts"][layout] = layout_report
+
+    if set(PREFILL_LAYOUTS) <= set(report["layouts"]):
+        legacy, cached = report["layouts"]['legacy'], report["layouts"]['cached']
+        report["prefill_saving_ms"] = {
+            kind: round(legacy[kind]['prefill']['mean_ms'] - cached[kind]['prefill']['mean_ms'], 3)
+            for kind in legacy if kind in cached
+        }
+    return report
+
+
+# --- Поиск по ФИО в расписании ---
+
+FIO_TYPO_LETTERS = 'абвгдеёжзийклмнопрстуфхцчшщыьэюя'
+
+
+def typo_fio(fio: str, rng: random.Random) -> str:
+    """ФИО так, как его набирает студент: опечатка, е вместо ё, другой порядок слов или без отчества."""
+    words = fio.lower().replace('ё', 'е').split()
+    if len(words) > 2 and rng.random() < 0.3:
+        words = words[:2]
+    if len(words) > 1 and rng.random() < 0.3:
+        rng.shuffle(words)
+    i = rng.randrange(len(words))
+    word = words[i]
+    if len(word) > 3:
+        pos = rng.randrange(1, len(word) - 1)
+        kind = rng.choice(('delete', 'replace', 'swap', 'insert'))
+        if kind == 'delete':
+            word = word[:pos] + word[pos + 1:]
+        elif kind == 'replace':
+            word = word[:pos] + rng.choice(FIO_TYPO_LETTERS) + word[pos + 1:]
+        elif kind == 'swap':
+            word = word[:pos - 1] + word[pos] + word[pos - 1] + word[pos + 1:]
+        else:
+            word = word[:pos] + rng.choice(FIO_TYPO_LETTERS) + word[pos:]
+    words[i] = word
+    return '  '.join(words) if rng.random() < 0.2 else ' '.join(words)
+
+
+def run_schedule(args) -> Dict[str, Any]:
+    store = ScheduleStore(args.store_dir)
+    fios = [store.fio_normalized[i] for i in range(len(store))]
+    if not fios:
+        raise SystemExit(f"❌ В {args.store_dir} нет записей")
+    # Расписание потока — сотни студентов; для оценки на десятках тысяч ФИО размножаются с суффиксом
+    rng = random.Random(args.seed)
+    source = list(fios)
+    while len(fios) < args.scale:
+        fio = rng.choice(source).split()
+        fio[0] += rng.choice(FIO_TYPO_LETTERS) + rng.choice(FIO_TYPO_LETTERS)
+        fios.append(' '.join(fio))
+
+    t0 = time.perf_counter()
+    index = FioIndex(fios)
+    build_seconds = time.perf_counter() - t0
+
+    rows = [rng.randrange(len(fios)) for _ in range(args.queries)]
+    queries = [typo_fio(fios[row], rng) for row in rows]
+    report: Dict[str, Any] = {"records": len(fios), "queries": len(queries),
+                              "build_ms": round(build_seconds * 1000, 3)}
+
+    latencies, found, single = [], 0, 0
+    for row, query in zip(rows, queries):
+        t0 = time.perf_counter()
+        matches = index.search(query, limit=rag_chatbot.FIO_CONFIRM_LIMIT + 1)
+        latencies.append(time.perf_counter() - t0)
+        # Однофамильцы с тем же ФИО тоже засчитываются: студент выберет свою запись по группе
+        hit = [r for r, _ in matches if index.normalized[r] == index.normalized[row]]
+        found += bool(hit) and len(matches) <= rag_chatbot.FIO_CONFIRM_LIMIT
+        single += len(matches) == 1 and bool(hit)
+    report["fuzzy"] = {"latency": latency_stats(latencies), "found_rate": round(found / len(queries), 4),
+                       "single_match_rate": round(single / len(queries), 4)}
+
+    # Прежний поиск: все слова запроса должны дословно встретиться в ФИО
+    legacy_latencies, legacy_found = [], 0
+    for row, query in zip(rows[:args.legacy_queries], queries[:args.legacy_queries]):
+        t0 = time.perf_counter()
+        words = set(query.lower().split())
+        matches = [i for i, fio in enumerate(fios) if words.issubset(fio.split())]
+        legacy_latencies.append(time.perf_counter() - t0)
+        legacy_found += any(fios[i] == fios[row] for i in matches)
+    if legacy_latencies:
+        report["exact_words"] = {"latency": latency_stats(legacy_latencies),
+                                 "found_rate": round(legacy_found / len(legacy_latencies), 4)}
+    print(f"  нечёткий поиск: p95={report['fuzzy']['latency']['p95_ms']} мс, "
+          f"найдено {report['fuzzy']['found_rate']:.1%} запросов с опечатками")
+    return report
+
+
+# Замер в чистом интерпретаторе: иначе модули, уже загруженные бенчмарком, не попадут во время импорта
+SCHEDULE_LOAD_SCRIPT = '''
+import json, sys, time
+def rss():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+kind, source, lookups = sys.argv[1], sys.argv[2], int(sys.argv[3])
+rss_start = rss()
+t0 = time.perf_counter()
+if kind == 'dataframe':
+    import pandas as pd
+else:
+    sys.path.insert(0, sys.argv[4])
+    from schedule_store import ScheduleStore
+    from schedule_search import FioIndex
+t_import = time.perf_counter()
+if kind == 'dataframe':
+    df = pd.read_excel(source)
+    df['FIO_normalized'] = df['FIO'].str.lower()
+    n = len(df)
+    get = lambda i: df.iloc[i].to_dict()
+else:
+    store = ScheduleStore(source)
+    index = FioIndex(store.fio_normalized)
+    n = len(store)
+    get = store.row
+t_load = time.perf_counter()
+rss_loaded = rss()
+t1 = time.perf_counter()
+for i in range(lookups):
+    get(i % n)
+t_lookups = time.perf_counter() - t1
+print(json.dumps({"records": n, "import_ms": round((t_import - t0) * 1000, 3),
+                  "load_ms": round((t_load - t_import) * 1000, 3),
+                  "rss_start_mb": round(rss_start / 2**20, 3), "rss_loaded_mb": round(rss_loaded / 2**20, 3),
+                  "rss_growth_mb": round((rss() - rss_start) / 2**20, 3),
+                  "row_us": round(t_lookups / max(1, lookups) * 1e6, 3)}))
+'''
+
+
+def run_schedule_load(args) -> Dict[str, Any]:
+    """Прежнее расписание (pandas DataFrame из Excel) против снимка schedule_store/ с индексом ФИО."""
+    report: Dict[str, Any] = {}
+    for kind, source in (('dataframe', args.excel_path), ('store', args.store_dir)):
+        if not source.exists():
+            print(f"⚠️ Пропускаем {kind}: {source} не найден")
+            continue
+        command = [sys.executable, '-c', SCHEDULE_LOAD_SCRIPT, kind, str(source), str(args.lookups), str(PROJECT_ROOT)]
+        runs = []
+        for _ in range(args.repeat):
+            result = subprocess.run(command, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"❌ {kind}: {result.stderr.strip()}")
+                break
+            runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+        if runs:
+            # Лучший из повторов: первый прогон платит за холодный page cache
+            report[kind] = {key: min(run[key] for run in runs) for key in runs[0]}
+    if {'dataframe', 'store'} <= set(report):
+        report["saved"] = {key: round(report['dataframe'][key] - report['store'][key], 3)
+                           for key in ('import_ms', 'load_ms', 'rss_loaded_mb', 'rss_growth_mb')}
+    return report
+
+
+# --- Лексический быстрый путь: ложные совпадения на вариантах датасета ---
+
+# Слова, от которых зависит смысл вопроса, хотя по триграммам они почти незаметны
+NEGATION_WORDS = {'не', 'ни', 'нет', 'нельзя'}
+# Сколько вариантов с наибольшим числом общих триграмм оценивать по Дайсу
+LEXICAL_CANDIDATES = 20
+
+
+def contradict_question(norm: str, kind: str, rng: random.Random) -> Optional[str]:
+    """Вопрос с другим смыслом: убрано/добавлено отрицание или изменено число. None, если нечего менять."""
+    words = norm.split()
+    if kind == 'number':
+        numbers = [i for i, w in enumerate(words) if w.isdigit()]
+        if not numbers:
+            return None
+        i = rng.choice(numbers)
+        words[i] = str(int(words[i]) + 1)
+    else:
+        negations = [i for i, w in enumerate(words) if w in NEGATION_WORDS]
+        if negations:
+            del words[rng.choice(negations)]
+        else:
+            targets = [i for i, w in enumerate(words) if len(w) > 3]
+            if not targets:
+                return None
+            words.insert(rng.choice(targets), 'не')
+    return ' '.join(words)
+
+
+class NearestVariant:
+    """Ближайший по Дайсу вариант с другим текстом — то, что нашёл бы нечёткий поиск по триграммам."""
+
+    def __init__(self, norms: List[str]):
+        self.norms = norms
+        self.grams = [Counter(char_ngrams(norm)) for norm in norms]
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        for row, grams in enumerate(self.grams):
+            for gram in grams:
+                self.postings[gram].append(row)
+
+    def __call__(self, norm: str):
+        query = Counter(char_ngrams(norm))
+        shared: Counter = Counter()
+        for gram in query:
+            shared.update(self.postings.get(gram, ()))
+        best_row, best_score = None, 0.0
+        for row, _ in shared.most_common(LEXICAL_CANDIDATES + 1):
+            if self.norms[row] == norm:
+                continue
+            score = dice(query, self.grams[row])
+            if score > best_score:
+                best_row, best_score = row, score
+        return best_row, best_score
+
+
+def run_lexical(args) -> Dict[str, Any]:
+    questions = load_dataset_questions(args.dataset_path)
+    if not questions:
+        raise SystemExit(f"❌ В {args.dataset_path} нет вопросов")
+    ids = [q["original_id"] for q in questions]
+    norms = [normalize_text(q["question"]) for q in questions]
+    report: Dict[str, Any] = {"variants": len(questions), "answers": len(set(ids)), "thresholds": args.thresholds}
+
+    # Точный путь: ошибается, только если один и тот же текст записан под разными ответами
+    lexical = LexicalIndex([q["question"] for q in questions])
+    conflicts = sum(ids[lexical.lookup(q["question"])] != oid for q, oid in zip(questions, ids))
+    report["exact"] = {"conflicting_variants": conflicts, "false_positive_rate": round(conflicts / len(questions), 4)}
+
+    # Нечёткий путь: вариант без самого себя в базе — его ближайший сосед должен вести к тому же ответу
+    nearest = NearestVariant(norms)
+    rng = random.Random(args.seed)
+    sample = range(len(questions)) if not args.limit else rng.sample(range(len(questions)), min(args.limit, len(questions)))
+    neighbours = [(i, *nearest(norms[i])) for i in sample]
+    fuzzy = {}
+    for threshold in args.thresholds:
+        matched = [(i, row) for i, row, score in neighbours if row is not None and score >= threshold]
+        wrong = sum(ids[row] != ids[i] for i, row in matched)
+        fuzzy[str(threshold)] = {"matched_rate": round(len(matched) / len(neighbours), 4),
+                                 "false_positive_rate": round(wrong / len(neighbours), 4),
+                                 "precision": round(1 - wrong / len(matched), 4) if matched else None}
+    report["fuzzy_leave_one_out"] = fuzzy
+
+    # Вопросы с противоположным смыслом: любой ответ быстрого пути на них — ложное совпадение.
+    # Те, что сами есть в датасете («2 курса» рядом с «1 курса»), — настоящие вопросы, не в счёт;
+    # точный путь на остальные не отвечает по построению
+    contradictions = {}
+    for kind in ('negation', 'number'):
+        queries = [q for q in (contradict_question(norms[i], kind, rng) for i in sample)
+                   if q and lexical.lookup(q) is None]
+        if not queries:
+            continue
+        scores = [nearest(q)[1] for q in queries]
+        entry = {"queries": len(queries)}
+        for threshold in args.thresholds:
+            entry[f"fuzzy_matched_rate@{threshold}"] = round(sum(s >= threshold for s in scores) / len(queries), 4)
+        contradictions[kind] = entry
+    report["contradictions"] = contradictions
+
+    print(f"  точный путь: {conflicts} вариантов с конфликтующими ответами")
+    for threshold in args.thresholds:
+        print(f"  нечёткий путь @{threshold}: ложных совпадений {fuzzy[str(threshold)]['false_positive_rate']:.1%} вариантов, "
+              + ', '.join(f"{kind} {entry[f'fuzzy_matched_rate@{threshold}']:.1%}" for kind, entry in contradictions.items()))
+    return report
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Бенчмарки RAG-бота")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    replay = sub.add_parser('replay', help='Прогон реальных вопросов через RAGChatBot с заглушкой LLM')
+    replay.add_argument('--source', choices=['log', 'dataset', 'all'], default='all')
+    replay.add_argument('--log_path', type=Path, default=LOG_PATH)
+    replay.add_argument('--dataset_path', type=Path, default=DATASET_PATH)
+    replay.add_argument('--limit', type=int, default=0, help='Случайная выборка вопросов (0 — все)')
+    replay.add_argument('--seed', type=int, default=42)
+    replay.add_argument('--warmup', type=int, default=5)
+    replay.add_argument('--intent', type=str, default='rag_faq', help='Ответ заглушки классификатора')
+    replay.add_argument('--llm_delay', type=float, default=0.0, help='Имитация времени генерации, сек')
+    replay.add_argument('--llm_url', type=str, help='Адрес ollama_stub.py вместо встроенной заглушки')
+    replay.add_argument('--pipeline', choices=['sequential', 'concurrent'], default='concurrent',
+                        help='Классификация, затем поиск, или классификация параллельно с поиском')
+    replay.add_argument('--latency_budget', type=float, default=0.0,
+                        help='Бюджет задержки на вопрос, сек (0 — ждать генерацию без ограничения)')
+    replay.add_argument('--cpu_workers', type=int, help='Размер пула cpu (энкодер и FAISS)')
+    replay.add_argument('--llm_workers', type=int, help='Размер пула llm (запросы к Ollama)')
+    replay.add_argument('--top_k', type=int)
+    replay.add_argument('--confidence_threshold', type=float)
+    replay.add_argument('--direct_threshold', type=float)
+    replay.add_argument('--model', type=str)
+    replay.add_argument('--index_path', type=Path)
+    replay.add_argument('--map_path', type=Path)
+    replay.add_argument('--store_dir', type=Path)
+    replay.add_argument('--output', type=Path, default=Path('bench_results.json'))
+
+    store = sub.add_parser('store', help='Время загрузки и память: data_mapping.json против knowledge_store/')
+    store.add_argument('--map_path', type=Path, default=rag_chatbot.MAP_PATH)
+    store.add_argument('--store_dir', type=Path, default=rag_chatbot.STORE_PATH)
+    store.add_argument('--lookups', type=int, default=10000)
+    store.add_argument('--output', type=Path, default=Path('bench_store.json'))
+
+    index = sub.add_parser('index', help='Recall@k, задержка и размер для flat / HNSW / IVF-Flat / IVF-PQ')
+    index.add_argument('--types', nargs='+', choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    index.add_argument('--store_dir', type=Path, default=rag_chatbot.STORE_PATH)
+    index.add_argument('--map_path', type=Path, default=rag_chatbot.MAP_PATH)
+    index.add_argument('--log_path', type=Path, default=LOG_PATH)
+    index.add_argument('--dataset_path', type=Path, default=DATASET_PATH)
+    index.add_argument('--queries', type=int, default=1000)
+    index.add_argument('--seed', type=int, default=42)
+    index.add_argument('--k', type=int, default=rag_chatbot.TOP_K)
+    index.add_argument('--model', type=str, default=rag_chatbot.EMBEDDER_MODEL)
+    index.add_argument('--device', type=str, default='cpu')
+    index.add_argument('--cache_dir', type=Path, default=Path('.embedding_cache'))
+    index.add_argument('--hnsw_m', type=int, default=IndexParams.hnsw_m)
+    index.add_argument('--ef_construction', type=int, default=IndexParams.ef_construction)
+    index.add_argument('--ef_search', type=int, nargs='+', default=[16, 64, 128])
+    index.add_argument('--nlist', type=int, default=IndexParams.nlist)
+    index.add_argument('--nprobe', type=int, nargs='+', default=[4, 16, 64])
+    index.add_argument('--pq_m', type=int, default=IndexParams.pq_m)
+    index.add_argument('--pq_bits', type=int, default=IndexParams.pq_bits)
+    index.add_argument('--output', type=Path, default=Path('bench_index.json'))
+
+    pooled = sub.add_parser('pooled', help='Индекс с вектором на ответ (centroid/medoids) против вектора на вариант')
+    pooled.add_argument('--modes', nargs='+', choices=POOLING_MODES, default=list(POOLING_MODES))
+    pooled.add_argument('--medoids', type=int, default=IndexParams.medoids)
+    pooled.add_argument('--index_type', choices=INDEX_TYPES, default='flat')
+    pooled.add_argument('--store_dir', type=Path, default=rag_chatbot.STORE_PATH,
+                        help='Хранилище, собранное без пулинга (вектор на вариант)')
+    pooled.add_argument('--map_path', type=Path, default=rag_chatbot.MAP_PATH)
+    pooled.add_argument('--holdout', type=float, default=0.1, help='Доля вариантов, отложенных как запросы')
+    pooled.add_argument('--queries', type=int, default=2000)
+    pooled.add_argument('--seed', type=int, default=42)
+    pooled.add_argument('--k', type=int, default=rag_chatbot.TOP_K)
+    pooled.add_argument('--model', type=str, default=rag_chatbot.EMBEDDER_MODEL)
+    pooled.add_argument('--device', type=str, default='cpu')
+    pooled.add_argument('--cache_dir', type=Path, default=Path('.embedding_cache'))
+    pooled.add_argument('--output', type=Path, default=Path('bench_pooled.json'))
+
+    prefill = sub.add_parser('prefill', help='Время prefill в Ollama: старая раскладка промптов против system + keep_alive')
+    prefill.add_argument('--llm_url', type=str, default=rag_chatbot.OLLAMA_HOST)
+    prefill.add_argument('--layouts', nargs='+', choices=PREFILL_LAYOUTS, default=list(PREFILL_LAYOUTS))
+    prefill.add_argument('--questions', type=int, default=50)
+    prefill.add_argument('--idle', type=float, default=0.0, help='Пауза между вопросами, сек (проверка keep_alive)')
+    prefill.add_argument('--no_unload', action='store_true', help='Не выгружать модель перед каждой раскладкой')
+    prefill.add_argument('--store_dir', type=Path, default=rag_chatbot.STORE_PATH)
+    prefill.add_argument('--map_path', type=Path, default=rag_chatbot.MAP_PATH)
+    prefill.add_argument('--seed', type=int, default=42)
+    prefill.add_argument('--output', type=Path, default=Path('bench_prefill.json'))
+
+    schedule = sub.add_parser('schedule', help='Нечёткий поиск по ФИО: задержка и доля найденных при опечатках')
+    schedule.add_argument('--store_dir', type=Path, default=rag_chatbot.SCHEDULE_STORE_PATH)
+    schedule.add_argument('--scale', type=int, default=30000, help='Дополнить расписание до стольких записей')
+    schedule.add_argument('--queries', type=int, default=2000)
+    schedule.add_argument('--legacy_queries', type=int, default=200, help='Сколько запросов прогнать старым поиском')
+    schedule.add_argument('--seed', type=int, default=42)
+    schedule.add_argument('--output', type=Path, default=Path('bench_schedule.json'))
+
+    schedule_load = sub.add_parser('schedule_load', help='Память и время импорта: DataFrame из Excel против schedule_store/')
+    schedule_load.add_argument('--excel_path', type=Path, default=rag_chatbot.SCHEDULE_DATA_PATH)
+    schedule_load.add_argument('--store_dir', type=Path, default=rag_chatbot.SCHEDULE_STORE_PATH)
+    schedule_load.add_argument('--lookups', type=int, default=10000)
+    schedule_load.add_argument('--repeat', type=int, default=3)
+    schedule_load.add_argument('--output', type=Path, default=Path('bench_schedule_load.json'))
+
+    lexical = sub.add_parser('lexical', help='Ложные совпадения лексического быстрого пути на вариантах датасета')
+    lexical.add_argument('--dataset_path', type=Path, default=DATASET_PATH)
+    lexical.add_argument('--thresholds', type=float, nargs='+', default=[0.85, 0.9, 0.93, 0.95, 0.97])
+    lexical.add_argument('--limit', type=int, default=0, help='Случайная выборка вариантов (0 — все)')
+    lexical.add_argument('--seed', type=int, default=42)
+    lexical.add_argument('--output', type=Path, default=Path('bench_lexical.json'))
+
+    args = parser.parse_args(argv)
+    if args.command == 'replay':
+        report = run_replay(args)
+    elif args.command == 'store':
+        report = run_store(args)
+    elif args.command == 'index':
+        report = run_index(args)
+    elif args.command == 'pooled':
+        report = run_pooled(args)
+    elif args.command == 'prefill':
+        report = run_prefill(args)
+    elif args.command == 'schedule':
+        report = run_schedule(args)
+    elif args.command == 'schedule_load':
+        report = run_schedule_load(args)
+    elif args.command == 'lexical':
+        report = run_lexical(args)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True))
+    print(f"✅ Результаты сохранены: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
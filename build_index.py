@@ -8,14 +8,27 @@
 
 На выходе создаются:
  - knowledge_index.faiss
- - data_mapping.json (список записей в том же порядке, что и в индексе)
+ - knowledge_index.faiss.meta.json (модель, тип индекса и его параметры, число векторов)
+ - knowledge_store/ (нормализованное хранилище записей в том же порядке, что и в индексе)
+ - data_mapping.json — только с флагом --json_map (старый формат для отладки)
+
+Эмбеддинги кэшируются в --cache_dir, поэтому повторная сборка кодирует только
+новые или изменённые вопросы. Если к данным только добавились записи в конец,
+существующий индекс дополняется на месте без пересоздания.
+
+Тип индекса задаётся --index_type (flat, hnsw, ivf-flat, ivf-pq), см. index_types.py.
+Сравнить варианты по recall/задержке/размеру: python benchmark.py index
+
+--pooling centroid|medoids строит компактный индекс с одним (или несколькими)
+векторами на ответ вместо вектора на каждый вариант вопроса. Сравнение с
+обычной сборкой: python benchmark.py pooled
 """
 import argparse
 from pathlib import Path
 import json
 from collections import defaultdict
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 try:
     import faiss
@@ -27,6 +40,11 @@ except Exception as e:
 """)
     raise
 
+from embedding_cache import EmbeddingCache
+from knowledge_store import KnowledgeStore, load_knowledge_map, store_exists
+from index_types import (INDEX_TYPES, POOLING_MODES, IndexParams, make_index, apply_search_params,
+                         index_meta_path, load_index_meta, pool_embeddings)
+
 
 def load_and_normalize_data(data_path: Path) -> List[Dict[str, Any]]:
     """Загружает данные и приводит их к единому формату.
@@ -87,7 +105,32 @@ def load_and_normalize_data(data_path: Path) -> List[Dict[str, Any]]:
     return output
 
 
-def build_index(data_path: Path, index_path: Path, map_path: Path, model_name: str, use_cuda: bool):
+def incremental_start(index_path: Path, store_dir: Path, model_name: str, params: IndexParams,
+                      passages: List[str]) -> Optional[int]:
+    """
+    Если старый индекс построен той же моделью с теми же параметрами и его
+    вопросы — префикс новых, возвращает число уже проиндексированных пассажей.
+    Иначе None (нужна полная сборка).
+    """
+    meta = load_index_meta(index_path)
+    if not (index_path.exists() and store_exists(store_dir) and meta):
+        return None
+    # Пулинг пересчитывает центроиды/медоиды по всем вариантам — дописывать нечего
+    if params.pooling != 'none':
+        return None
+    if meta.get('model') != model_name or IndexParams.from_meta(meta) != params:
+        return None
+    old_map = load_knowledge_map(store_dir)
+    old_passages = [old_map.question(i) for i in range(len(old_map))]
+    if meta.get('ntotal') != len(old_passages) or passages[:len(old_passages)] != old_passages:
+        return None
+    return len(old_passages)
+
+
+def build_index(data_path: Path, index_path: Path, store_dir: Path, model_name: str, use_cuda: bool,
+                cache_dir: Optional[Path] = None, full_rebuild: bool = False, map_path: Optional[Path] = None,
+                params: Optional[IndexParams] = None):
+    params = params or IndexParams()
     data = load_and_normalize_data(data_path)
     print(f"✅ Подготовлено {len(data)} записей для индексирования.")
 
@@ -118,46 +161,101 @@ def build_index(data_path: Path, index_path: Path, map_path: Path, model_name: s
     if not passages:
         raise ValueError("Нет подходящих вопросов для индексирования.")
 
+    start = None if full_rebuild else incremental_start(index_path, store_dir, model_name, params, passages)
+    to_encode = passages if start is None else passages[start:]
+
     device = 'cuda' if use_cuda else 'cpu'
-    print(f"▶️ Загружаем модель эмбеддингов: {model_name} ({device})...")
-    encoder = SentenceTransformer(model_name, device=device)
-
-    print(f"▶️ Преобразуем {len(passages)} текстов в эмбеддинги...")
-    # sentence-transformers может вернуть list[list[float]] или np.ndarray
-    embeddings = encoder.encode(passages, normalize_embeddings=True, show_progress_bar=True)
-    embeddings = np.array(embeddings, dtype=np.float32)
-    if embeddings.ndim != 2:
+    encoder = None
+
+    def encode(texts: List[str]) -> np.ndarray:
+        # Модель загружается только если в кэше действительно чего-то не хватает
+        nonlocal encoder
+        if encoder is None:
+            print(f"▶️ Загружаем модель эмбеддингов: {model_name} ({device})...")
+            encoder = SentenceTransformer(model_name, device=device)
+        print(f"▶️ Преобразуем {len(texts)} текстов в эмбеддинги...")
+        # sentence-transformers может вернуть list[list[float]] или np.ndarray
+        return np.array(encoder.encode(texts, normalize_embeddings=True, show_progress_bar=True), dtype=np.float32)
+
+    if not to_encode:
+        embeddings = np.empty((0, 0), dtype=np.float32)
+    elif cache_dir is not None:
+        embeddings = EmbeddingCache(cache_dir, model_name).get_or_encode(to_encode, encode)
+    else:
+        embeddings = encode(to_encode)
+    if to_encode and embeddings.ndim != 2:
         raise ValueError(f"Эмбеддинги имеют некорректную форму: {embeddings.shape}")
-    print("✅ Эмбеддинги созданы.")
+    print("✅ Эмбеддинги готовы.")
 
-    # Используем IndexFlatIP + нормализованные векторы для косинус-похожести
-    dim = int(embeddings.shape[1])
-    index = faiss.IndexFlatIP(dim)
-    # faiss.IndexFlatIP.add принимает массив numpy с формой (n, dim)
-    index.add(embeddings)  # type: ignore[call-arg]
+    if start is not None:
+        index = faiss.read_index(str(index_path))
+        print(f"▶️ Инкрементальное обновление: в индексе {start} векторов, добавляем {len(to_encode)}.")
+        if len(to_encode):
+            # IVF-центроиды остаются от исходного обучения — для дописывания этого достаточно
+            index.add(embeddings)  # type: ignore[call-arg]
+        apply_search_params(index, params)
+    else:
+        if params.pooling != 'none':
+            embeddings, representatives = pool_embeddings(
+                embeddings, [entry["original_id"] for entry in new_map], params)
+            new_map = [new_map[row] for row in representatives]
+            print(f"▶️ Пулинг {params.pooling}: {len(passages)} вариантов -> {len(new_map)} векторов.")
+        # Нормализованные векторы + скалярное произведение = косинусная похожесть
+        print(f"▶️ Строим индекс типа {params.index_type}...")
+        index = make_index(embeddings, params)
 
-    faiss.write_index(index, str(index_path))
-    with open(map_path, 'w', encoding='utf-8') as f:
-        json.dump(new_map, f, ensure_ascii=False, indent=2)
+    # Запись через временный файл: бот с горячей перезагрузкой не прочитает недописанный индекс
+    tmp_index_path = index_path.with_name(index_path.name + '.tmp')
+    faiss.write_index(index, str(tmp_index_path))
+    tmp_index_path.replace(index_path)
+    KnowledgeStore.write(store_dir, new_map)
+    if map_path is not None:
+        with open(map_path, 'w', encoding='utf-8') as f:
+            json.dump(new_map, f, ensure_ascii=False, indent=2)
+        print(f"✅ Карта данных (JSON) сохранена: {map_path}")
+    with open(index_meta_path(index_path), 'w', encoding='utf-8') as f:
+        json.dump({"model": model_name, "ntotal": int(index.ntotal), **params.as_meta()}, f)
 
     print(f"✅ Индекс сохранён: {index_path}")
-    print(f"✅ Карта данных сохранена: {map_path}")
+    print(f"✅ Хранилище знаний сохранено: {store_dir}")
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--data_path', type=Path, default=Path('data/opd_dataset_augmented.json'))
     parser.add_argument('--index_path', type=Path, default=Path('knowledge_index.faiss'))
+    parser.add_argument('--store_dir', type=Path, default=Path('knowledge_store'))
     parser.add_argument('--map_path', type=Path, default=Path('data_mapping.json'))
+    parser.add_argument('--json_map', action='store_true', help='Дополнительно сохранить data_mapping.json')
     parser.add_argument('--model', type=str, default='BAAI/bge-m3')
     parser.add_argument('--use_cuda', action='store_true')
+    parser.add_argument('--cache_dir', type=Path, default=Path('.embedding_cache'))
+    parser.add_argument('--no_cache', action='store_true', help='Не использовать кэш эмбеддингов')
+    parser.add_argument('--full_rebuild', action='store_true', help='Пересобрать индекс, даже если возможно дополнение')
+    parser.add_argument('--index_type', choices=INDEX_TYPES, default='flat')
+    parser.add_argument('--hnsw_m', type=int, default=IndexParams.hnsw_m)
+    parser.add_argument('--ef_construction', type=int, default=IndexParams.ef_construction)
+    parser.add_argument('--ef_search', type=int, default=IndexParams.ef_search)
+    parser.add_argument('--nlist', type=int, default=IndexParams.nlist, help='0 — подобрать автоматически')
+    parser.add_argument('--nprobe', type=int, default=IndexParams.nprobe)
+    parser.add_argument('--pq_m', type=int, default=IndexParams.pq_m)
+    parser.add_argument('--pq_bits', type=int, default=IndexParams.pq_bits)
+    parser.add_argument('--pooling', choices=POOLING_MODES, default='none')
+    parser.add_argument('--medoids', type=int, default=IndexParams.medoids, help='Медоидов на ответ для --pooling medoids')
     args = parser.parse_args()
 
     if not args.data_path.exists():
         print(f"❌ Файл данных не найден: {args.data_path}")
         return
 
-    build_index(args.data_path, args.index_path, args.map_path, args.model, args.use_cuda)
+    cache_dir = None if args.no_cache else args.cache_dir
+    build_index(args.data_path, args.index_path, args.store_dir, args.model, args.use_cuda,
+                cache_dir=cache_dir, full_rebuild=args.full_rebuild,
+                map_path=args.map_path if args.json_map else None,
+                params=IndexParams(index_type=args.index_type, hnsw_m=args.hnsw_m,
+                                   ef_construction=args.ef_construction, ef_search=args.ef_search,
+                                   nlist=args.nlist, nprobe=args.nprobe, pq_m=args.pq_m, pq_bits=args.pq_bits,
+                                   pooling=args.pooling, medoids=args.medoids))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+# coding: utf-8
+"""
+Отмена генерации, которая больше никому не нужна.
+
+CancelToken заводится на каждое сообщение пользователя и кладётся в
+contextvars (как трасса в tracing.py), поэтому call_ollama_api видит его
+в потоках пулов этапов (executors.py), которые копируют контекст. При отмене токен
+вызывает зарегистрированные колбэки — call_ollama_api через них рвёт
+потоковое соединение с Ollama, и сервер прекращает генерацию.
+"""
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+# Сообщения, которыми пользователь останавливает генерацию или поиск по расписанию
+STOP_WORDS = frozenset({'стоп', 'stop', 'отмена'})
+
+
+class GenerationCancelled(Exception):
+    """Запрос к LLM прерван: пользователь написал «стоп» или прислал новое сообщение."""
+
+
+class CancelToken:
+    def __init__(self, parent: Optional['CancelToken'] = None):
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason: Optional[str] = None
+        if parent is not None:
+            # Отмена родителя (сообщения) отменяет и дочерние запросы (классификацию)
+            parent.on_cancel(lambda: self.cancel(parent.reason))
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str = 'cancelled'):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Регистрирует колбэк (сразу вызывает, если токен уже отменён). Возвращает функцию отписки."""
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        callback()
+        return lambda: None
+
+    def _discard(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        if self.reason is not None:
+            raise GenerationCancelled(self.reason)
+
+
+_current_token: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar('cancel_token', default=None)
+
+
+def current_cancel_token() -> Optional[CancelToken]:
+    return _current_token.get()
+
+
+@contextmanager
+def cancel_scope(token: CancelToken):
+    """Делает token текущим для кода внутри блока (и для задач пулов этапов, запущенных из него)."""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def run_with_token(token: CancelToken, func: Callable, *args, **kwargs):
+    """Для пулов потоков: вызывает func с token в качестве текущего."""
+    with cancel_scope(token):
+        return func(*args, **kwargs)
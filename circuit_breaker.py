@@ -0,0 +1,153 @@
+# coding: utf-8
+"""
+Предохранитель (circuit breaker) и фоновая проверка здоровья LLM-бэкенда.
+
+ - closed    — запросы идут как обычно; подряд failure_threshold ошибок
+               размыкают цепь;
+ - open      — запросы сразу получают LLMUnavailableError, не занимая
+               потоки ожиданием таймаута;
+ - half_open — после reset_timeout и удачной проверки здоровья пропускается
+               один пробный запрос: успех замыкает цепь, ошибка — снова размыкает;
+               следующая удачная проверка без пробного запроса тоже замыкает цепь.
+
+HealthProber периодически дёргает лёгкий эндпоинт (для Ollama — /api/version):
+замечает падение раньше пользователей и переводит открытую цепь в half_open.
+"""
+import threading
+import time
+from typing import Callable, Optional
+
+from tracing import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+metrics.describe('llm_circuit_state', 'Состояние предохранителя LLM: 0 — closed, 1 — half_open, 2 — open')
+metrics.describe('llm_circuit_rejected_total', 'Запросы к LLM, отклонённые без обращения к бэкенду')
+metrics.describe('llm_health_probe_total', 'Результаты фоновых проверок здоровья LLM')
+
+
+class LLMUnavailableError(Exception):
+    """LLM недоступна: предохранитель разомкнут или запрос завершился ошибкой."""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float,
+                 on_state_change: Optional[Callable[[str, str, str], None]] = None):
+        """on_state_change(старое состояние, новое состояние, причина) — вызывается вне блокировки."""
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = ''
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        metrics.set_gauge('llm_circuit_state', STATE_CODES[CLOSED], {'backend': name})
+
+    def _set_state(self, state: str, reason: str) -> Optional[tuple]:
+        # Вызывается под блокировкой; уведомление отправляется после её снятия
+        if state == self.state:
+            return None
+        previous, self.state = self.state, state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        metrics.set_gauge('llm_circuit_state', STATE_CODES[state], {'backend': self.name})
+        return previous, state, reason
+
+    def _notify(self, change: Optional[tuple]):
+        if change is None:
+            return
+        print(f"⚡ Предохранитель {self.name}: {change[0]} -> {change[1]} ({change[2]})")
+        if self.on_state_change is not None:
+            try:
+                self.on_state_change(*change)
+            except Exception as e:
+                print(f"⚠️ Не удалось сообщить о смене состояния предохранителя: {e}")
+
+    def allow(self) -> bool:
+        """Можно ли сейчас обращаться к бэкенду. В half_open пропускает один пробный запрос."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+        metrics.inc('llm_circuit_rejected_total', labels={'backend': self.name})
+        return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            change = self._set_state(CLOSED, 'запрос выполнен успешно')
+        self._notify(change)
+
+    def record_failure(self, error: str):
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            self._trial_in_flight = False
+            change = None
+            if self.state == HALF_OPEN:
+                change = self._set_state(OPEN, f'пробный запрос не прошёл: {error}')
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                change = self._set_state(OPEN, f'{self.failures} ошибок подряд: {error}')
+            elif self.state == OPEN:
+                # Бэкенд всё ещё лежит — откладываем следующую попытку
+                self.opened_at = time.monotonic()
+        self._notify(change)
+
+    def record_cancelled(self):
+        """Запрос отменён пользователем — ни успех, ни ошибка, но пробный слот освобождается."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_probe_success(self):
+        """
+        Проверка здоровья прошла. В closed сбрасывает счётчик ошибок: редкие неудачные
+        проверки без пользовательских запросов не размыкают цепь здорового бэкенда.
+        Открытая цепь после reset_timeout переходит в half_open, а half_open без
+        пробного запроса в работе замыкается — первый студент после сбоя не служит пробой.
+        """
+        with self._lock:
+            change = None
+            if self.state == CLOSED:
+                self.failures = 0
+            elif self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                change = self._set_state(HALF_OPEN, 'бэкенд снова отвечает на проверки')
+            elif self.state == HALF_OPEN and not self._trial_in_flight:
+                self.failures = 0
+                change = self._set_state(CLOSED, 'повторная проверка здоровья прошла')
+        self._notify(change)
+
+
+class HealthProber:
+    def __init__(self, breaker: CircuitBreaker, probe: Callable[[], None], interval: float):
+        """probe() бросает исключение, если бэкенд нездоров."""
+        self.breaker = breaker
+        self.probe = probe
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=f'health-{self.breaker.name}', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.probe()
+            except Exception as e:
+                metrics.inc('llm_health_probe_total', labels={'backend': self.breaker.name, 'result': 'fail'})
+                self.breaker.record_failure(f'проверка здоровья: {e}')
+            else:
+                metrics.inc('llm_health_probe_total', labels={'backend': self.breaker.name, 'result': 'ok'})
+                self.breaker.record_probe_success()
+            time.sleep(self.interval)
@@ -0,0 +1,163 @@
+# coding: utf-8
+"""
+Сборка контекста RAG-промпта в пределах бюджета токенов.
+
+Документы из выдачи FAISS берутся по убыванию сходства. Абзацы ответов,
+которые почти повторяют уже взятый текст (типично для соседних записей
+базы: одинаковые сроки, контакты, ссылки), выкидываются. Если документ
+не помещается целиком, он урезается по абзацам, затем по предложениям.
+Так размер промпта, а значит и время prefill в Ollama, не зависит от того,
+насколько длинные ответы попались.
+
+Токены считаются токенизатором модели, если он указан и доступен
+(transformers.AutoTokenizer), иначе — быстрой оценкой по символам.
+"""
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from lexical_index import normalize_text, char_ngrams, dice
+
+# Приблизительно столько символов кириллицы приходится на один токен у SentencePiece-моделей
+CHARS_PER_TOKEN = 3.5
+# Абзац с таким сходством (Дайс по триграммам) с уже взятым текстом считается повтором
+PARAGRAPH_OVERLAP_THRESHOLD = 0.8
+# Документ, от которого после урезания осталось меньше, не добавляем вовсе
+MIN_DOCUMENT_TOKENS = 24
+DOCUMENT_SEPARATOR = '\n\n---\n\n'
+
+_TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+_PARAGRAPH_RE = re.compile(r'\n\s*\n|\n(?=\s*(?:\d+[.)]|[-•*])\s)')
+_SENTENCE_RE = re.compile(r'(?<=[.!?…])\s+')
+
+TokenCounter = Callable[[str], int]
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов без токенизатора: слова режутся на куски по CHARS_PER_TOKEN, знаки — по одному."""
+    return sum(math.ceil(len(piece) / CHARS_PER_TOKEN) for piece in _TOKEN_RE.findall(text or ''))
+
+
+def make_token_counter(tokenizer_name: Optional[str] = None) -> TokenCounter:
+    """Счётчик токенов настоящим токенизатором модели; при любой ошибке — оценка по символам."""
+    if not tokenizer_name:
+        return estimate_tokens
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    except Exception as e:
+        print(f"⚠️ Токенизатор {tokenizer_name} недоступен ({e}), считаю токены приблизительно.")
+        return estimate_tokens
+    return lambda text: len(tokenizer.encode(text or '', add_special_tokens=False))
+
+
+@dataclass
+class BuiltContext:
+    text: str
+    tokens: int
+    documents_used: int
+    documents_dropped: int
+    paragraphs_dropped: int
+    truncated: bool
+    rows: List[int] = field(default_factory=list)
+
+    def log_fields(self) -> dict:
+        return {
+            'context_tokens': self.tokens,
+            'context_documents': self.documents_used,
+            'context_documents_dropped': self.documents_dropped,
+            'context_paragraphs_dropped': self.paragraphs_dropped,
+            'context_truncated': self.truncated,
+        }
+
+
+def split_paragraphs(text: str) -> List[str]:
+    return [p.strip() for p in _PARAGRAPH_RE.split(text or '') if p and p.strip()]
+
+
+def _fit(pieces: List[str], joiner: str, budget: int, count_tokens: TokenCounter) -> Tuple[List[str], bool]:
+    """Берёт куски по порядку, пока они помещаются в budget. Возвращает (взятые, урезано ли)."""
+    taken: List[str] = []
+    for piece in pieces:
+        if count_tokens(joiner.join(taken + [piece])) > budget:
+            return taken, True
+        taken.append(piece)
+    return taken, False
+
+
+class ContextBuilder:
+    def __init__(self, token_budget: int, count_tokens: TokenCounter = estimate_tokens,
+                 overlap_threshold: float = PARAGRAPH_OVERLAP_THRESHOLD):
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self.overlap_threshold = overlap_threshold
+
+    def _is_redundant(self, grams: Counter, seen: List[Counter]) -> bool:
+        return any(dice(grams, other) >= self.overlap_threshold for other in seen)
+
+    def build(self, documents: Sequence[Tuple[float, int, str, str]]) -> BuiltContext:
+        """
+        documents — (сходство, строка базы, вопрос, ответ) в любом порядке.
+        Возвращает контекст не длиннее token_budget токенов.
+        """
+        ranked = sorted(documents, key=lambda d: d[0], reverse=True)
+        seen: List[Counter] = []
+        parts: List[str] = []
+        rows: List[int] = []
+        paragraphs_dropped = 0
+        truncated = False
+        used_tokens = 0
+
+        for _, row, question, answer in ranked:
+            paragraphs = []
+            for paragraph in split_paragraphs(answer):
+                grams = Counter(char_ngrams(normalize_text(paragraph)))
+                if self._is_redundant(grams, seen):
+                    paragraphs_dropped += 1
+                    continue
+                paragraphs.append((paragraph, grams))
+            if not paragraphs:
+                continue
+
+            header = f"Вопрос из базы: {question or 'Вопрос не найден'}\nОтвет из базы: "
+            separator_tokens = self.count_tokens(DOCUMENT_SEPARATOR) if parts else 0
+            remaining = self.token_budget - used_tokens - separator_tokens - self.count_tokens(header)
+            if remaining < MIN_DOCUMENT_TOKENS:
+                truncated = True
+                break
+
+            texts = [p for p, _ in paragraphs]
+            taken, cut = _fit(texts, '\n\n', remaining, self.count_tokens)
+            if cut and len(taken) < len(texts):
+                # Следующий абзац не влез целиком — добираем из него предложения
+                head, _ = _fit(_SENTENCE_RE.split(texts[len(taken)]), ' ', remaining - self.count_tokens(
+                    '\n\n'.join(taken + [''])), self.count_tokens)
+                if head:
+                    taken.append(' '.join(head))
+            if not taken and not parts:
+                # Самый релевантный документ нужен всегда: режем по символам
+                taken = [texts[0][:int(remaining * CHARS_PER_TOKEN)]]
+            body = '\n\n'.join(taken)
+            if not taken or (cut and parts and self.count_tokens(body) < MIN_DOCUMENT_TOKENS):
+                truncated = True
+                break
+            truncated = truncated or cut
+
+            seen.extend(grams for _, grams in paragraphs[:len(taken)])
+            part = header + body
+            parts.append(part)
+            rows.append(row)
+            used_tokens += separator_tokens + self.count_tokens(part)
+
+        text = DOCUMENT_SEPARATOR.join(parts)
+        return BuiltContext(
+            text=text,
+            tokens=self.count_tokens(text),
+            documents_used=len(parts),
+            documents_dropped=len(ranked) - len(parts),
+            paragraphs_dropped=paragraphs_dropped,
+            truncated=truncated,
+            rows=rows,
+        )
@@ -0,0 +1,96 @@
+# coding: utf-8
+"""
+Персистентный кэш эмбеддингов для build_index.py.
+
+Ключ — sha1 от (имя модели, текст пассажа). Векторы лежат в одном файле
+float32 (читается через np.memmap), порядок строк задаёт индекс ключей
+keys.json. Новые векторы дописываются в конец, поэтому пересборка индекса
+кодирует только новые или изменённые тексты.
+"""
+import hashlib
+import json
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+VECTORS_FILE = 'embeddings.f32'
+KEYS_FILE = 'keys.json'
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    return hashlib.sha1(f"{model_name}\0{text}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir: Path, model_name: str):
+        self.cache_dir = Path(cache_dir)
+        self.model_name = model_name
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.cache_dir / VECTORS_FILE
+        self.keys_path = self.cache_dir / KEYS_FILE
+        self.dim: Optional[int] = None
+        self.rows: Dict[str, int] = {}
+        self._load_keys()
+
+    def _load_keys(self):
+        keys: List[str] = []
+        if self.keys_path.exists():
+            with open(self.keys_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.dim = meta.get('dim')
+            keys = meta.get('keys', [])
+        if self.dim and self.vectors_path.exists():
+            # После прерванной записи доверяем только строкам, описанным в обоих файлах
+            stored_rows = self.vectors_path.stat().st_size // (4 * self.dim)
+            keys = keys[:stored_rows]
+        else:
+            keys = []
+        if self.vectors_path.exists():
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(len(keys) * 4 * (self.dim or 0))
+        self.rows = {key: i for i, key in enumerate(keys)}
+
+    def _save_keys(self):
+        keys = [None] * len(self.rows)
+        for key, row in self.rows.items():
+            keys[row] = key
+        tmp_path = self.keys_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'keys': keys}, f)
+        tmp_path.replace(self.keys_path)
+
+    def _vectors(self) -> np.ndarray:
+        if not self.rows:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(self.rows), self.dim))
+
+    def get_or_encode(self, texts: Sequence[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Возвращает эмбеддинги для texts в том же порядке. Отсутствующие в кэше
+        тексты кодируются одним вызовом encode(list_of_texts) и дописываются.
+        """
+        keys = [embedding_key(self.model_name, t) for t in texts]
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in self.rows and key not in missing:
+                missing[key] = text
+
+        print(f"▶️ Кэш эмбеддингов: {len(texts) - sum(1 for k in keys if k in missing)} из {len(texts)} найдено, "
+              f"кодируем {len(missing)} новых.")
+        if missing:
+            new_vectors = np.asarray(encode(list(missing.values())), dtype=np.float32)
+            if new_vectors.ndim != 2:
+                raise ValueError(f"Эмбеддинги имеют некорректную форму: {new_vectors.shape}")
+            if self.dim is None:
+                self.dim = int(new_vectors.shape[1])
+            elif new_vectors.shape[1] != self.dim:
+                raise ValueError(f"Размерность модели ({new_vectors.shape[1]}) не совпадает с кэшем ({self.dim}).")
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.ascontiguousarray(new_vectors).tobytes())
+            for key in missing:
+                self.rows[key] = len(self.rows)
+            self._save_keys()
+
+        vectors = self._vectors()
+        return np.array(vectors[[self.rows[k] for k in keys]], dtype=np.float32)
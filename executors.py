@@ -0,0 +1,199 @@
+# coding: utf-8
+"""
+Отдельные пулы потоков для этапов обработки сообщения.
+
+Раньше всё шло через asyncio.to_thread, то есть через общий пул по числу
+ядер: кодирование вопроса, ожидание Ollama и запись логов занимали одни и
+те же потоки, и десяток висящих на LLM запросов задерживал поиск для новых.
+Теперь у каждого этапа свой пул:
+
+ - cpu — энкодер и FAISS, по числу ядер, с заданным числом потоков внутри
+         операций (torch/OpenMP), чтобы пулы не делили ядра ещё раз;
+ - handler — обработка сообщения целиком: она ждёт результатов пулов cpu
+             и llm, поэтому в них самих не живёт — иначе обработчики заняли бы
+             потоки, нужные их же классификации и генерации;
+ - llm — блокирующие запросы к Ollama (классификация, генерация, фоновые
+         генерации после запасного ответа), пул крупный — потоки просто спят;
+ - log — запись в файлы, один поток: записи не перемешиваются;
+ - state — SQLite-хранилище диалогов (лимит запросов, ожидание ФИО), один
+           поток: цикл событий не ждёт блокировок базы, а запросы к ней
+           выполняются в порядке поступления сообщений.
+
+Загрузка пулов видна в метриках executor_*.
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from tracing import metrics
+
+CPU_STAGE = 'cpu'
+HANDLER_STAGE = 'handler'
+LLM_STAGE = 'llm'
+LOG_STAGE = 'log'
+STATE_STAGE = 'state'
+
+# Потоков внутри одной операции энкодера/FAISS; CPU_WORKERS * INTRA_OP_THREADS ≈ числу ядер
+INTRA_OP_THREADS = 1
+CPU_WORKERS = max(1, (os.cpu_count() or 4) // INTRA_OP_THREADS)
+# Не меньше CONCURRENT_UPDATES бота: каждый обрабатываемый апдейт держит поток handler
+HANDLER_WORKERS = 48
+# На обработчик — классификация, генерация и до одной фоновой генерации после запасного ответа
+LLM_CALLS_PER_HANDLER = 3
+LLM_WORKERS = HANDLER_WORKERS * LLM_CALLS_PER_HANDLER
+LOG_WORKERS = 1
+# Больше одного нельзя: на порядке выполнения держится порядок сообщений пользователя в telegram_bot
+STATE_WORKERS = 1
+
+STAGE_WORKERS: Dict[str, int] = {CPU_STAGE: CPU_WORKERS, HANDLER_STAGE: HANDLER_WORKERS, LLM_STAGE: LLM_WORKERS,
+                                 LOG_STAGE: LOG_WORKERS, STATE_STAGE: STATE_WORKERS}
+
+metrics.describe('executor_workers', 'Размер пула потоков этапа')
+metrics.describe('executor_busy_workers', 'Потоки этапа, занятые задачей')
+metrics.describe('executor_queued_tasks', 'Задачи, ждущие свободного потока этапа')
+metrics.describe('executor_queue_wait_seconds', 'Ожидание свободного потока этапа')
+metrics.describe('executor_busy_seconds_total', 'Суммарное время работы потоков этапа (загрузка = rate / workers)')
+
+_local = threading.local()
+
+
+class StageExecutor:
+    """ThreadPoolExecutor этапа, который ведёт метрики загрузки и переносит contextvars в поток."""
+
+    def __init__(self, stage: str, max_workers: int):
+        self.stage = stage
+        self.max_workers = max_workers
+        self.tasks = 0
+        self.busy_seconds = 0.0
+        self._busy = 0
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'stage-{stage}')
+        metrics.set_gauge('executor_workers', max_workers, {'stage': stage})
+
+    def _update(self, queued: int = 0, busy: int = 0, busy_seconds: float = 0.0):
+        with self._lock:
+            self._queued += queued
+            self._busy += busy
+            self.busy_seconds += busy_seconds
+            if busy_seconds:
+                self.tasks += 1
+            labels = {'stage': self.stage}
+            metrics.set_gauge('executor_queued_tasks', self._queued, labels)
+            metrics.set_gauge('executor_busy_workers', self._busy, labels)
+        if busy_seconds:
+            metrics.inc('executor_busy_seconds_total', busy_seconds, {'stage': self.stage})
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """func выполняется в копии текущего контекста — трасса и токен отмены видны в потоке."""
+        ctx = contextvars.copy_context()
+        self._update(queued=1)
+        future = self._pool.submit(self._run, ctx, time.perf_counter(), func, args, kwargs)
+        # Отменённая до старта задача в _run не попадёт — убираем её из очереди здесь
+        future.add_done_callback(lambda f: self._update(queued=-1) if f.cancelled() else None)
+        return future
+
+    def _run(self, ctx: contextvars.Context, submitted: float, func: Callable, args, kwargs):
+        started = time.perf_counter()
+        metrics.observe('executor_queue_wait_seconds', started - submitted, {'stage': self.stage})
+        self._update(queued=-1, busy=1)
+        _local.stage = self.stage
+        try:
+            return ctx.run(func, *args, **kwargs)
+        finally:
+            _local.stage = None
+            self._update(busy=-1, busy_seconds=time.perf_counter() - started)
+
+    def run(self, func: Callable, *args, **kwargs):
+        """Выполнить в пуле этапа и дождаться. Из потока этого же пула — сразу на месте, без взаимоблокировки."""
+        if getattr(_local, 'stage', None) == self.stage:
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    async def run_async(self, func: Callable, *args, **kwargs):
+        """Замена asyncio.to_thread с выбором пула."""
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {'workers': self.max_workers, 'tasks': self.tasks,
+                    'busy_seconds': round(self.busy_seconds, 3), 'busy': self._busy, 'queued': self._queued}
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+_executors: Dict[str, StageExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def configure_executors(**workers: int):
+    """Меняет размеры пулов (cpu=8, llm=64, ...). Вызывать до первого обращения к пулам."""
+    with _executors_lock:
+        created = [stage for stage in workers if stage in _executors]
+        if created:
+            raise RuntimeError(f"Пулы уже созданы, размер не изменить: {', '.join(created)}")
+        unknown = [stage for stage in workers if stage not in STAGE_WORKERS]
+        if unknown:
+            raise ValueError(f"Неизвестные этапы: {', '.join(unknown)}")
+        STAGE_WORKERS.update(workers)
+
+
+def get_executor(stage: str) -> StageExecutor:
+    with _executors_lock:
+        executor = _executors.get(stage)
+        if executor is None:
+            executor = _executors[stage] = StageExecutor(stage, STAGE_WORKERS[stage])
+        return executor
+
+
+def executor_stats() -> Dict[str, Dict[str, float]]:
+    with _executors_lock:
+        executors = dict(_executors)
+    return {stage: executor.stats() for stage, executor in executors.items()}
+
+
+def shutdown_executors(wait: bool = True):
+    """Дожидается фоновых задач (например, генераций после запасного ответа) и закрывает пулы."""
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+def configure_handler_workers(concurrent: int):
+    """Пулы handler и llm не меньше, чем нужно concurrent одновременным обработчикам."""
+    sizes = {}
+    if concurrent > STAGE_WORKERS[HANDLER_STAGE]:
+        sizes[HANDLER_STAGE] = concurrent
+    if concurrent * LLM_CALLS_PER_HANDLER > STAGE_WORKERS[LLM_STAGE]:
+        sizes[LLM_STAGE] = concurrent * LLM_CALLS_PER_HANDLER
+    if sizes:
+        configure_executors(**sizes)
+
+
+def configure_intra_op_threads(threads: Optional[int] = None):
+    """
+    Ограничивает потоки внутри операций torch и FAISS, чтобы пул cpu не переподписывал ядра.
+    С одним потоком cpu делить ядра не с кем — остаются настройки библиотек по умолчанию.
+    torch настраивается, только если уже загружен: рабочему процессу с RemoteEncoder он не нужен.
+    """
+    if threads is None and STAGE_WORKERS[CPU_STAGE] == 1:
+        print(f"🧵 Один поток cpu: потоки энкодера/FAISS по умолчанию библиотек, пулы этапов: {STAGE_WORKERS}")
+        return
+    threads = threads or INTRA_OP_THREADS
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(threads)
+    try:
+        import faiss
+        faiss.omp_set_num_threads(threads)
+    except ImportError:
+        pass
+    print(f"🧵 Потоков внутри операций энкодера/FAISS: {threads}, пулы этапов: {STAGE_WORKERS}")
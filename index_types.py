@@ -0,0 +1,198 @@
+# coding: utf-8
+"""
+Типы FAISS-индексов для базы знаний и их параметры поиска.
+
+ - flat      — IndexFlatIP, точный поиск (по умолчанию);
+ - hnsw      — граф HNSW, параметры M / efConstruction / efSearch;
+ - ivf-flat  — инвертированные списки без сжатия, параметры nlist / nprobe;
+ - ivf-pq    — инвертированные списки + product quantization, nlist / pq_m / pq_bits / nprobe.
+
+Все варианты используют скалярное произведение (векторы нормализованы),
+поэтому оценки сходства сопоставимы с порогами в rag_chatbot.py.
+
+Пулинг (pooling) сжимает индекс до нескольких векторов на ответ:
+ - none      — вектор на каждый вариант вопроса (по умолчанию);
+ - centroid  — один нормализованный центроид вариантов на original_id;
+ - medoids   — до `medoids` вариантов-медоидов на original_id (k-medoids).
+Тогда top-k выдачи сразу состоит из разных ответов.
+"""
+import json
+import math
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+INDEX_TYPES = ('flat', 'hnsw', 'ivf-flat', 'ivf-pq')
+POOLING_MODES = ('none', 'centroid', 'medoids')
+MEDOID_ITERATIONS = 10
+
+# Минимум обучающих точек на центроид, при котором FAISS не ругается на k-means
+MIN_POINTS_PER_CENTROID = 39
+
+
+def import_faiss():
+    """
+    faiss импортируется при первом обращении к индексу (сотни мс и OpenMP):
+    скриптам и фронт-процессу, которым нужны только IndexParams, он не нужен.
+    """
+    try:
+        import faiss
+    except Exception:
+        print("ОШИБКА: Установите faiss: pip install faiss-cpu")
+        raise
+    return faiss
+
+
+@dataclass
+class IndexParams:
+    index_type: str = 'flat'
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    nlist: int = 0  # 0 — подобрать по размеру данных
+    nprobe: int = 16
+    pq_m: int = 64
+    pq_bits: int = 8
+    pooling: str = 'none'
+    medoids: int = 3
+
+    def as_meta(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_meta(cls, meta: Dict[str, Any]) -> 'IndexParams':
+        known = {k: v for k, v in meta.items() if k in cls.__dataclass_fields__}
+        return cls(**known)
+
+
+def index_meta_path(index_path: Path) -> Path:
+    return index_path.with_name(index_path.name + '.meta.json')
+
+
+def load_index_meta(index_path: Path) -> Dict[str, Any]:
+    """Метаданные сборки (модель, тип, параметры); пустой словарь для старых индексов."""
+    meta_path = index_meta_path(index_path)
+    if not meta_path.exists():
+        return {}
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def default_nlist(n: int) -> int:
+    # Эвристика FAISS: ~4·sqrt(n) списков, но не больше, чем позволяет обучающая выборка
+    return max(1, min(int(4 * math.sqrt(n)), n // MIN_POINTS_PER_CENTROID))
+
+
+def make_index(embeddings: np.ndarray, params: IndexParams):
+    """Создаёт (и при необходимости обучает) индекс нужного типа и добавляет векторы."""
+    faiss = import_faiss()
+    n, dim = embeddings.shape
+    kind = params.index_type
+    if kind == 'flat':
+        index = faiss.IndexFlatIP(dim)
+    elif kind == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, params.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = params.ef_construction
+    elif kind in ('ivf-flat', 'ivf-pq'):
+        nlist = params.nlist or default_nlist(n)
+        quantizer = faiss.IndexFlatIP(dim)
+        if kind == 'ivf-flat':
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            if dim % params.pq_m:
+                raise ValueError(f"pq_m={params.pq_m} должен делить размерность {dim}.")
+            if n < (1 << params.pq_bits):
+                raise ValueError(f"Для pq_bits={params.pq_bits} нужно не меньше {1 << params.pq_bits} векторов, есть {n}.")
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, params.pq_m, params.pq_bits, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)  # type: ignore[call-arg]
+    else:
+        raise ValueError(f"Неизвестный тип индекса: {kind}. Доступны: {', '.join(INDEX_TYPES)}")
+    index.add(embeddings)  # type: ignore[call-arg]
+    apply_search_params(index, params)
+    return index
+
+
+def pool_embeddings(embeddings: np.ndarray, groups: Sequence[Hashable],
+                    params: IndexParams) -> Tuple[np.ndarray, List[int]]:
+    """
+    Сводит векторы вариантов к нескольким векторам на группу (original_id).
+    Возвращает (векторы, номер строки-представителя для каждого вектора):
+    текст и ответ представителя попадают в карту данных.
+    """
+    if params.pooling not in POOLING_MODES:
+        raise ValueError(f"Неизвестный режим пулинга: {params.pooling}. Доступны: {', '.join(POOLING_MODES)}")
+    if params.pooling == 'none':
+        return embeddings, list(range(len(embeddings)))
+
+    by_group: Dict[Hashable, List[int]] = {}
+    for row, group in enumerate(groups):
+        by_group.setdefault(group, []).append(row)
+
+    vectors: List[np.ndarray] = []
+    representatives: List[int] = []
+    for rows in by_group.values():
+        block = embeddings[rows]
+        if params.pooling == 'centroid':
+            centroid = block.mean(axis=0)
+            centroid /= np.linalg.norm(centroid) or 1.0
+            vectors.append(centroid)
+            # Представитель — вариант, ближайший к центроиду
+            representatives.append(rows[int(np.argmax(block @ centroid))])
+        else:
+            for local in _medoids(block, params.medoids):
+                vectors.append(block[local])
+                representatives.append(rows[local])
+    return np.vstack(vectors).astype(np.float32), representatives
+
+
+def _medoids(block: np.ndarray, k: int) -> List[int]:
+    """Простой k-medoids по косинусному сходству: farthest-first старт + уточнение."""
+    n = len(block)
+    if n <= k:
+        return list(range(n))
+    sim = block @ block.T
+    medoids = [int(np.argmax(sim.sum(axis=1)))]
+    while len(medoids) < k:
+        medoids.append(int(np.argmin(sim[:, medoids].max(axis=1))))
+    for _ in range(MEDOID_ITERATIONS):
+        assign = np.argmax(sim[:, medoids], axis=1)
+        updated = []
+        for cluster, medoid in enumerate(medoids):
+            members = np.flatnonzero(assign == cluster)
+            if len(members) == 0:
+                updated.append(medoid)
+                continue
+            updated.append(int(members[np.argmax(sim[np.ix_(members, members)].sum(axis=1))]))
+        if updated == medoids:
+            break
+        medoids = updated
+    return sorted(set(medoids))
+
+
+def index_type_of(index) -> str:
+    """Определяет тип загруженного индекса по его классу."""
+    faiss = import_faiss()
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return 'ivf-pq' if isinstance(ivf, faiss.IndexIVFPQ) else 'ivf-flat'
+    return 'flat'
+
+
+def apply_search_params(index, params: Optional[IndexParams] = None) -> str:
+    """Выставляет nprobe / efSearch в соответствии с типом индекса. Возвращает тип."""
+    params = params or IndexParams()
+    kind = index_type_of(index)
+    if kind == 'hnsw':
+        index.hnsw.efSearch = params.ef_search
+    elif kind in ('ivf-flat', 'ivf-pq'):
+        ivf = import_faiss().extract_index_ivf(index)
+        ivf.nprobe = min(params.nprobe, ivf.nlist)
+    return kind
+
+
+def index_size_bytes(index) -> int:
+    return int(import_faiss().serialize_index(index).size)
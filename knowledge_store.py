@@ -0,0 +1,185 @@
+# coding: utf-8
+"""
+Компактное нормализованное хранилище базы знаний (замена data_mapping.json).
+
+В data_mapping.json каждый из ~25 вариантов вопроса несёт полную копию ответа,
+а RAGChatBot держит всё это в памяти как список словарей. Здесь данные
+разложены по столбцам в каталоге knowledge_store/:
+
+ - variant_answer.npy          int32: вариант (строка FAISS) -> номер ответа
+ - variant.offsets.npy / .bin  тексты вариантов вопросов
+ - answer.offsets.npy / .bin   тексты ответов, по одному на original_id
+ - original_id.offsets.npy / .bin  сами original_id
+
+Строки хранятся в UTF-8 блобах, которые открываются через np.memmap, поэтому
+загрузка почти мгновенная, а память занимают только реально прочитанные страницы.
+
+JsonKnowledgeMap даёт тот же интерфейс поверх старого data_mapping.json.
+
+Конвертация существующей карты:
+    python knowledge_store.py data_mapping.json knowledge_store
+"""
+import argparse
+import json
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+VARIANT_ANSWER_FILE = 'variant_answer.npy'
+
+
+class StringColumn:
+    """Столбец строк: смещения (int64, n+1) и общий UTF-8 блоб."""
+
+    def __init__(self, directory: Path, name: str):
+        self.offsets = np.load(directory / f'{name}.offsets.npy', mmap_mode='r')
+        blob_path = directory / f'{name}.bin'
+        # memmap не умеет открывать пустые файлы
+        self.blob = np.memmap(blob_path, dtype=np.uint8, mode='r') if blob_path.stat().st_size else np.empty(0, np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return bytes(self.blob[start:end]).decode('utf-8')
+
+    @staticmethod
+    def write(directory: Path, name: str, values: Sequence[str]):
+        encoded = [v.encode('utf-8') for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        np.save(directory / f'{name}.offsets.npy', offsets)
+        with open(directory / f'{name}.bin', 'wb') as f:
+            f.write(b''.join(encoded))
+
+
+class KnowledgeStore:
+    """Только для чтения; строки декодируются по требованию."""
+
+    def __init__(self, directory: Path):
+        directory = Path(directory)
+        self.directory = directory
+        self.variant_answer = np.load(directory / VARIANT_ANSWER_FILE, mmap_mode='r')
+        self.variants = StringColumn(directory, 'variant')
+        self.answers = StringColumn(directory, 'answer')
+        self.original_ids = StringColumn(directory, 'original_id')
+        if len(self.variants) != len(self.variant_answer):
+            raise ValueError(f"Хранилище {directory} повреждено: {len(self.variants)} вариантов, "
+                             f"{len(self.variant_answer)} ссылок на ответы.")
+
+    def __len__(self) -> int:
+        return len(self.variant_answer)
+
+    def answer_slot(self, i: int) -> int:
+        """Номер ответа (один на original_id) — ключ дедупликации выдачи."""
+        return int(self.variant_answer[i])
+
+    def question(self, i: int) -> str:
+        return self.variants[i]
+
+    def answer(self, i: int) -> str:
+        return self.answers[self.answer_slot(i)]
+
+    def original_id(self, i: int) -> str:
+        return self.original_ids[self.answer_slot(i)]
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        # Совместимость со старыми вызовами data_map[idx]; в горячем пути не используется
+        return {"question_variant": self.question(i), "original_id": self.original_id(i), "answer": self.answer(i)}
+
+    @staticmethod
+    def write(directory: Path, entries: Sequence[Dict[str, Any]]):
+        """
+        Сохраняет записи формата data_mapping.json в нормализованном виде.
+        Пишет во временный каталог и подменяет целиком: работающий бот
+        (горячая перезагрузка) никогда не видит наполовину записанное хранилище.
+        """
+        target = Path(directory)
+        directory = target.with_name(target.name + '.tmp')
+        shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir(parents=True)
+        slots: Dict[str, int] = {}
+        answers: List[str] = []
+        original_ids: List[str] = []
+        variant_answer = np.zeros(len(entries), dtype=np.int32)
+        for i, entry in enumerate(entries):
+            oid = str(entry.get('original_id'))
+            if oid not in slots:
+                slots[oid] = len(answers)
+                answers.append(entry.get('answer', "") or "")
+                original_ids.append(oid)
+            variant_answer[i] = slots[oid]
+        np.save(directory / VARIANT_ANSWER_FILE, variant_answer)
+        StringColumn.write(directory, 'variant', [e.get('question_variant', "") or "" for e in entries])
+        StringColumn.write(directory, 'answer', answers)
+        StringColumn.write(directory, 'original_id', original_ids)
+
+        # Открытые memmap старой версии продолжают читать удалённые файлы — это безопасно
+        old = target.with_name(target.name + '.old')
+        shutil.rmtree(old, ignore_errors=True)
+        if target.exists():
+            target.rename(old)
+        directory.rename(target)
+        shutil.rmtree(old, ignore_errors=True)
+
+
+class JsonKnowledgeMap:
+    """Тот же интерфейс поверх списка словарей из data_mapping.json."""
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.entries = entries
+        slots: Dict[Any, int] = {}
+        self._slots = [slots.setdefault(e.get('original_id'), len(slots)) for e in entries]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def answer_slot(self, i: int) -> int:
+        return self._slots[i]
+
+    def question(self, i: int) -> str:
+        return self.entries[i].get('question_variant', "")
+
+    def answer(self, i: int) -> str:
+        return self.entries[i].get('answer', "")
+
+    def original_id(self, i: int):
+        return self.entries[i].get('original_id')
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        return self.entries[i]
+
+
+KnowledgeMap = Union[KnowledgeStore, JsonKnowledgeMap]
+
+
+def store_exists(store_dir: Path) -> bool:
+    return (Path(store_dir) / VARIANT_ANSWER_FILE).exists()
+
+
+def load_knowledge_map(store_dir: Path, map_path: Optional[Path] = None) -> KnowledgeMap:
+    """Предпочитает бинарное хранилище; data_mapping.json — запасной вариант для старых сборок."""
+    if store_exists(store_dir):
+        return KnowledgeStore(store_dir)
+    if map_path is not None and Path(map_path).exists():
+        with open(map_path, 'r', encoding='utf-8') as f:
+            return JsonKnowledgeMap(json.load(f))
+    raise FileNotFoundError(f'Хранилище знаний не найдено: {store_dir}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Конвертация data_mapping.json в knowledge_store/")
+    parser.add_argument('map_path', type=Path)
+    parser.add_argument('store_dir', type=Path)
+    args = parser.parse_args()
+    with open(args.map_path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    KnowledgeStore.write(args.store_dir, entries)
+    print(f"✅ {len(entries)} записей сохранено в {args.store_dir}")
+
+
+if __name__ == '__main__':
+    main()
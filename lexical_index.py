@@ -0,0 +1,60 @@
+# coding: utf-8
+"""
+Лексический «быстрый путь» для вопросов, которые дословно есть в базе:
+хэш-таблица нормализованный текст -> строка базы (регистр, ё/е, пунктуация
+и лишние пробелы не учитываются).
+
+Нечёткого совпадения здесь нет: по символьным триграммам опечатка и смена
+смысла неотличимы («сдавать» / «не сдавать» — 0.93 по Дайсу, «1 курса» /
+«2 курса» — 0.90, а опечатка «записатся» — 0.89). Такие вопросы идут по
+полному пути через энкодер и LLM; доля ложных совпадений нечёткого поиска
+на вариантах датасета — python benchmark.py lexical.
+
+Всё считается на чистом Python за микросекунды и не требует ни энкодера,
+ни FAISS, ни LLM. char_ngrams и dice нужны нечёткому поиску по ФИО
+(schedule_search).
+"""
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+NGRAM = 3
+
+_PUNCT_RE = re.compile(r'[^\w\s]+')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    text = (text or '').lower().replace('ё', 'е')
+    text = _PUNCT_RE.sub(' ', text).replace('_', ' ')
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+def char_ngrams(normalized: str, n: int = NGRAM) -> List[str]:
+    padded = f' {normalized} '
+    return [padded[i:i + n] for i in range(max(1, len(padded) - n + 1))]
+
+
+def dice(a: Counter, b: Counter) -> float:
+    overlap = sum((a & b).values())
+    total = sum(a.values()) + sum(b.values())
+    return 2.0 * overlap / total if total else 0.0
+
+
+class LexicalIndex:
+    def __init__(self, questions: List[str]):
+        self.exact: Dict[str, int] = {}
+        for row, question in enumerate(questions):
+            # При дубликатах побеждает первая запись — так же ведёт себя FAISS при равных оценках
+            self.exact.setdefault(normalize_text(question), row)
+        self.size = len(questions)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def lookup(self, question: str) -> Optional[int]:
+        """Строка базы с тем же нормализованным текстом вопроса или None."""
+        norm = normalize_text(question)
+        if not norm:
+            return None
+        return self.exact.get(norm)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Нагрузочный прогон обработчиков telegram_bot без Telegram и без модели.
+
+N симулированных студентов отправляют сообщения с заданной суммарной
+частотой. Синтетические Update-объекты попадают в очередь и разбираются
+обработчиками handle_message, show_menu_and_log и button_callback_handler
+так же, как это делает Application (concurrent_updates воркеров).
+Ответы уходят в фейковый транспорт FakeBot, а LLM — в ollama_stub.py.
+
+Отчёт (JSON): пропускная способность, перцентили задержки по типам
+обработчиков, глубина очереди и лаг event loop.
+
+Пример:
+    python load_test.py --users 200 --rate 20 --duration 120 --concurrent_updates 8
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+
+import benchmark
+import ollama_stub
+import rag_chatbot
+
+MENU_SHARE = 0.05
+CALLBACK_SHARE = 0.05
+CALLBACK_DATA = ('show_menu_info', 'show_examples')
+
+
+class FakeBot:
+    """
+    Транспорт вместо Telegram Bot API. Принимает те же вызовы, что делают
+    обработчики, выдерживает заданную задержку и считает отправки.
+    """
+
+    def __init__(self, api_latency: float):
+        self.api_latency = api_latency
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._message_ids = itertools.count(1_000_000)
+        self.username = 'load_test_bot'
+
+    async def _call(self, method: str):
+        self.calls[method] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._call('send_message')
+        msg = Message(next(self._message_ids), datetime.now(timezone.utc), Chat(chat_id, Chat.PRIVATE), text=text)
+        msg.set_bot(self)
+        return msg
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self._call('delete_message')
+        return True
+
+    async def send_chat_action(self, chat_id, action, **kwargs):
+        await self._call('send_chat_action')
+        return True
+
+    async def answer_callback_query(self, callback_query_id, **kwargs):
+        await self._call('answer_callback_query')
+        return True
+
+
+class FakeContext:
+    """Минимальный аналог CallbackContext: bot, общий bot_data и user_data на пользователя."""
+
+    def __init__(self, bot: FakeBot, bot_data: dict, user_data: dict):
+        self.bot = bot
+        self.bot_data = bot_data
+        self.user_data = user_data
+
+
+class UpdateFactory:
+    def __init__(self, bot: FakeBot, questions: List[str], rng: random.Random):
+        self.bot = bot
+        self.questions = questions
+        self.rng = rng
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _message(self, user: User, text: Optional[str]) -> Message:
+        msg = Message(next(self._message_ids), datetime.now(timezone.utc), Chat(user.id, Chat.PRIVATE),
+                      from_user=user, text=text)
+        msg.set_bot(self.bot)
+        return msg
+
+    def make(self, user_id: int):
+        """Возвращает (тип обработчика, Update)."""
+        user = User(user_id, f"Студент{user_id}", is_bot=False, username=f"student{user_id}")
+        roll = self.rng.random()
+        if roll < MENU_SHARE:
+            return 'menu', Update(next(self._update_ids), message=self._message(user, 'меню'))
+        if roll < MENU_SHARE + CALLBACK_SHARE:
+            query = CallbackQuery(str(next(self._update_ids)), user, chat_instance=str(user_id),
+                                  message=self._message(user, 'Выберите опцию:'),
+                                  data=self.rng.choice(CALLBACK_DATA))
+            query.set_bot(self.bot)
+            return 'callback', Update(next(self._update_ids), callback_query=query)
+        text = self.rng.choice(self.questions)
+        return 'question', Update(next(self._update_ids), message=self._message(user, text))
+
+
+async def run_load(args, tg, backend) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    bot = FakeBot(args.api_latency)
+    questions = [q['question'] for q in benchmark.load_log_questions(args.log_path)]
+    questions += [q['question'] for q in benchmark.load_dataset_questions(args.dataset_path)]
+    if not questions:
+        raise SystemExit("❌ Нет вопросов для нагрузки.")
+    factory = UpdateFactory(bot, questions, rng)
+
+    handlers = {
+        'question': tg.handle_message,
+        'menu': tg.show_menu_and_log,
+        'callback': tg.button_callback_handler,
+    }
+    bot_data: Dict[str, Any] = {'backend': backend}
+    user_data: Dict[int, dict] = defaultdict(dict)
+    queue: asyncio.Queue = asyncio.Queue()
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors = 0
+    queue_depths: List[int] = []
+    loop_lags: List[float] = []
+    stop = asyncio.Event()
+
+    async def worker():
+        nonlocal errors
+        while True:
+            item = await queue.get()
+            if item is None:
+                queue.task_done()
+                return
+            kind, update, enqueued = item
+            user_id = update.effective_user.id
+            try:
+                await handlers[kind](update, FakeContext(bot, bot_data, user_data[user_id]))
+            except Exception:
+                errors += 1
+            latencies[kind].append(time.perf_counter() - enqueued)
+            queue.task_done()
+
+    async def producer():
+        # Пуассоновский поток сообщений с суммарной частотой rate
+        deadline = time.perf_counter() + args.duration
+        sent = 0
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(rng.expovariate(args.rate))
+            kind, update = factory.make(rng.randint(1, args.users))
+            await queue.put((kind, update, time.perf_counter()))
+            sent += 1
+        return sent
+
+    async def monitor():
+        interval = 0.1
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(interval)
+            loop_lags.append(max(0.0, time.perf_counter() - t0 - interval))
+            queue_depths.append(queue.qsize())
+
+    workers = [asyncio.create_task(worker()) for _ in range(args.concurrent_updates)]
+    monitor_task = asyncio.create_task(monitor())
+    started = time.perf_counter()
+    sent = await producer()
+    for _ in workers:
+        await queue.put(None)
+    await asyncio.gather(*workers)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor_task
+
+    completed = sum(len(v) for v in latencies.values())
+    return {
+        "config": {
+            "users": args.users,
+            "target_rate": args.rate,
+            "duration": args.duration,
+            "concurrent_updates": args.concurrent_updates,
+            "api_latency": args.api_latency,
+            "llm_latency": args.llm_latency,
+            "llm_tps": args.llm_tps,
+            "seed": args.seed,
+        },
+        "sent": sent,
+        "completed": completed,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_per_second": round(completed / elapsed, 3) if elapsed else None,
+        "latency": {kind: benchmark.latency_stats(values) for kind, values in sorted(latencies.items())},
+        "queue_depth": {
+            "max": max(queue_depths, default=0),
+            "mean": round(sum(queue_depths) / len(queue_depths), 3) if queue_depths else 0,
+        },
+        "event_loop_lag": benchmark.latency_stats(loop_lags),
+        "bot_api_calls": dict(bot.calls),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон обработчиков Telegram-бота")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=10.0, help='Сообщений в секунду от всех пользователей')
+    parser.add_argument('--duration', type=float, default=60.0, help='Длительность подачи нагрузки, сек')
+    parser.add_argument('--concurrent_updates', type=int, default=1,
+                        help='Одновременно обрабатываемых апдейтов (1 — как Application по умолчанию)')
+    parser.add_argument('--api_latency', type=float, default=0.05, help='Задержка фейкового Bot API, сек')
+    parser.add_argument('--llm_latency', default='lognormal:-1.2,0.5', help='Распределение задержки ollama_stub')
+    parser.add_argument('--llm_tps', type=float, default=40.0)
+    parser.add_argument('--llm_failure_rate', type=float, default=0.0)
+    parser.add_argument('--log_path', type=Path, default=benchmark.LOG_PATH)
+    parser.add_argument('--dataset_path', type=Path, default=benchmark.DATASET_PATH)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', type=Path, default=Path('load_test_results.json'))
+    args = parser.parse_args(argv)
+
+    stub = ollama_stub.start_in_background(ollama_stub.StubConfig(
+        latency=args.llm_latency, tokens_per_second=args.llm_tps,
+        failure_rate=args.llm_failure_rate, seed=args.seed,
+    ))
+    rag_chatbot.OLLAMA_HOST = f"http://127.0.0.1:{stub.server_address[1]}"
+
+    import telegram_bot as tg
+    # Лимиты и флаги прогона не должны попадать в боевую базу состояния
+    tg.init_state(Path(tempfile.mkdtemp(prefix='load_test_state_')) / 'state.sqlite3')
+    backend = tg.init_backend()
+
+    # Q/A-лог прогона не должен смешиваться с боевым chat_qa_log.txt
+    qa_log = Path(tempfile.gettempdir()) / 'load_test_qa_log.txt'
+    tg.log_question_answer = partial(tg.log_question_answer, path=str(qa_log))
+
+    report = asyncio.run(run_load(args, tg, backend))
+    report["llm_stub"] = stub.RequestHandlerClass.stub.stats
+    stub.shutdown()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True))
+    print(f"✅ Результаты сохранены: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# coding: utf-8
+"""
+Отдельный процесс с моделью эмбеддингов для всех рабочих процессов бота.
+
+bge-m3 занимает гигабайты памяти (и видеопамяти), поэтому рабочие процессы
+не загружают её сами: RemoteEncoder отправляет тексты сюда по Unix-сокету
+(multiprocessing.connection). Запросы, пришедшие почти одновременно от
+разных воркеров, кодируются одним батчем — на GPU это почти бесплатно.
+"""
+import queue
+import threading
+import time
+from multiprocessing.connection import AuthenticationError, Client, Listener
+from typing import List, Optional
+
+import numpy as np
+
+# Сколько текстов собирать в батч и сколько ждать попутчиков первого запроса (сек)
+ENCODER_MAX_BATCH = 32
+ENCODER_BATCH_WAIT = 0.003
+
+
+class _EncodeRequest:
+    __slots__ = ('texts', 'normalize', 'done', 'result', 'error')
+
+    def __init__(self, texts: List[str], normalize: bool):
+        self.texts = texts
+        self.normalize = normalize
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[str] = None
+
+
+def _batch_loop(model, requests: 'queue.Queue[_EncodeRequest]'):
+    while True:
+        batch = [requests.get()]
+        size = len(batch[0].texts)
+        deadline = time.monotonic() + ENCODER_BATCH_WAIT
+        while size < ENCODER_MAX_BATCH:
+            try:
+                request = requests.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+        for normalize in {r.normalize for r in batch}:
+            group = [r for r in batch if r.normalize == normalize]
+            texts = [text for r in group for text in r.texts]
+            try:
+                vectors = model.encode(texts, normalize_embeddings=normalize, batch_size=len(texts))
+            except Exception as e:
+                for request in group:
+                    request.error = f"{type(e).__name__}: {e}"
+                    request.done.set()
+                continue
+            start = 0
+            for request in group:
+                request.result = np.asarray(vectors[start:start + len(request.texts)], dtype=np.float32)
+                start += len(request.texts)
+                request.done.set()
+
+
+def _serve_connection(conn, requests: 'queue.Queue[_EncodeRequest]', dim: int):
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            if message[0] == 'dim':
+                conn.send(('ok', dim))
+                continue
+            _, texts, normalize = message
+            request = _EncodeRequest(texts, normalize)
+            requests.put(request)
+            request.done.wait()
+            conn.send(('error', request.error) if request.error else ('ok', request.result))
+
+
+def serve_encoder(address: str, authkey: bytes, model_name: str, device: str, ready=None):
+    """Точка входа процесса модели. ready — конец Pipe, в который отправляется размерность после загрузки."""
+    from sentence_transformers import SentenceTransformer
+
+    print(f'🧠 Процесс модели: загрузка {model_name} ({device})...')
+    model = SentenceTransformer(model_name, device=device)
+    dim = model.get_sentence_embedding_dimension()
+    requests: 'queue.Queue[_EncodeRequest]' = queue.Queue()
+    threading.Thread(target=_batch_loop, args=(model, requests), name='encoder-batch', daemon=True).start()
+    with Listener(address, family='AF_UNIX', authkey=authkey) as listener:
+        if ready is not None:
+            ready.send(dim)
+            ready.close()
+        print(f'✅ Процесс модели слушает {address}')
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError) as e:
+                print(f'⚠️ Отклонено подключение к процессу модели: {e}')
+                continue
+            threading.Thread(target=_serve_connection, args=(conn, requests, dim), daemon=True).start()
+
+
+def start_encoder_process(ctx, address: str, authkey: bytes, model_name: str, device: str):
+    """Запускает процесс модели и ждёт, пока он загрузит модель и откроет сокет."""
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=serve_encoder, args=(address, authkey, model_name, device, child),
+                          name='encoder', daemon=True)
+    process.start()
+    child.close()
+    try:
+        parent.recv()
+    except EOFError:
+        raise RuntimeError('Процесс модели завершился при запуске') from None
+    return process
+
+
+class RemoteEncoder:
+    """
+    Замена SentenceTransformer для RAGChatBot: encode() и размерность
+    запрашиваются у процесса модели. Своё соединение на каждый поток.
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+        self._dim: Optional[int] = None
+
+    def _call(self, message: tuple):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+        try:
+            conn.send(message)
+            status, result = conn.recv()
+        except (EOFError, OSError):
+            self._local.conn = None
+            raise
+        if status != 'ok':
+            raise RuntimeError(f'Процесс модели вернул ошибку: {result}')
+        return result
+
+    def encode(self, texts, normalize_embeddings: bool = False, **kwargs):
+        single = isinstance(texts, str)
+        vectors = self._call(('encode', [texts] if single else list(texts), normalize_embeddings))
+        return vectors[0] if single else vectors
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dim is None:
+            self._dim = self._call(('dim',))
+        return self._dim
@@ -0,0 +1,95 @@
+# coding: utf-8
+"""
+Потоковый вызов Ollama /api/generate, который можно прервать из другого потока.
+
+requests не даёт добраться до сокета, пока не пришли заголовки ответа, а
+Ollama присылает их только после prefill. Поэтому здесь используется
+http.client: сокет известен сразу после connect(), и отмена делает ему
+shutdown — заблокированное чтение тут же завершается, а Ollama, увидев
+разрыв, останавливает генерацию и освобождает слот.
+"""
+import http.client
+import json
+import socket
+from typing import Optional, Tuple
+from urllib.parse import urlsplit
+
+from cancellation import CancelToken, GenerationCancelled
+
+
+class OllamaError(Exception):
+    """Ollama недоступна или ответила ошибкой."""
+
+
+def _connection(host: str, timeout: float) -> http.client.HTTPConnection:
+    parts = urlsplit(host)
+    cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return cls(parts.hostname or 'localhost', parts.port, timeout=timeout)
+
+
+def _shutdown(conn: http.client.HTTPConnection):
+    sock = conn.sock
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def ping(host: str, timeout: float):
+    """Лёгкая проверка живости: GET /api/version. Бросает OllamaError, если сервер не ответил 200."""
+    conn = _connection(host, timeout)
+    try:
+        conn.request('GET', '/api/version')
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise OllamaError(f"HTTP {response.status}")
+    except (OSError, http.client.HTTPException) as e:
+        raise OllamaError(str(e)) from e
+    finally:
+        conn.close()
+
+
+def stream_generate(host: str, payload: dict, timeout: float,
+                    token: Optional[CancelToken] = None) -> Tuple[str, dict, int]:
+    """
+    Отправляет payload со stream=True и собирает ответ по кускам.
+    Возвращает (текст, финальный кусок со статистикой, число полученных кусков).
+    timeout — предельная пауза между кусками, а не длительность всей генерации.
+    """
+    if token is not None:
+        token.raise_if_cancelled()
+    conn = _connection(host, timeout)
+    unregister = lambda: None
+    parts = []
+    try:
+        conn.connect()
+        if token is not None:
+            unregister = token.on_cancel(lambda: _shutdown(conn))
+        body = json.dumps({**payload, 'stream': True}, ensure_ascii=False).encode('utf-8')
+        conn.request('POST', '/api/generate', body, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        if response.status != 200:
+            raise OllamaError(f"HTTP {response.status}: {response.read(500).decode('utf-8', 'replace')}")
+        for line in response:
+            if token is not None and token.cancelled:
+                break
+            if not line.strip():
+                continue
+            chunk = json.loads(line)
+            if chunk.get('error'):
+                raise OllamaError(chunk['error'])
+            parts.append(chunk.get('response', ''))
+            if chunk.get('done'):
+                return ''.join(parts), chunk, len(parts)
+        if token is not None and token.cancelled:
+            raise GenerationCancelled(token.reason)
+        raise OllamaError("Ollama закрыла соединение до завершения генерации")
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        if token is not None and token.cancelled:
+            raise GenerationCancelled(token.reason) from e
+        raise OllamaError(str(e)) from e
+    finally:
+        unregister()
+        conn.close()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Локальная замена Ollama для нагрузочных и регрессионных прогонов без модели.
+
+Реализует контракт POST /api/generate (обычный и потоковый NDJSON-ответ),
+а также GET /api/tags и /api/version, которых достаточно клиентам бота.
+
+Возможности:
+ - распределение задержки до первого токена (fixed / uniform / normal / lognormal);
+ - скорость генерации в токенах в секунду;
+ - инъекция сбоев: HTTP-ошибки и «зависшие» запросы;
+ - заготовленные ответы по типу промпта: классификатор намерений получает
+   метку, промпт аугментации — JSON-массив, остальные — текст.
+
+Пример:
+    python ollama_stub.py --port 11435 --latency lognormal:-1.5,0.5 --tps 40 --failure_rate 0.02
+    # затем OLLAMA_HOST = 'http://localhost:11435' (или benchmark.py replay --llm_url ...)
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Маркеры, по которым распознаётся шаблон промпта (см. rag_chatbot.py и 1_augment_dataset.py)
+PROMPT_KINDS = (
+    ('intent', 'ИИ-классификатор'),
+    ('augment', 'перефразировать вопрос'),
+    ('security_joke', 'ИИ-саркастик'),
+    ('team_name', 'генератор ярких и креативных названий'),
+    ('creative', 'креативный наставник'),
+    ('smalltalk', 'дружелюбный ассистент'),
+    ('rag', 'ОПД-бот ВУЗа'),
+)
+
+DEFAULT_RESPONSES: Dict[str, List[str]] = {
+    'security_joke': ["Это была попытка взлома? Даже мой стаб-сервер смеётся."],
+    'team_name': ["Квантовый Скачок — потому что тестовый прогон.\nСинергия — потому что стаб тоже умеет шутить."],
+    'creative': ["Название проекта: Тестовый проект\nСуть: ответ заглушки Ollama."],
+    'smalltalk': ["Привет! Чем могу помочь по Основам проектной деятельности?"],
+    'rag': ["Это тестовый ответ локальной заглушки Ollama на основе контекста из базы знаний."],
+    'generate': ["Тестовый ответ локальной заглушки Ollama."],
+}
+
+# Простые эвристики для классификатора: порядок важен
+INTENT_RULES = (
+    ('creative_team_name', re.compile(r'назван\w*.*команд|команд\w*.*назван')),
+    ('creative_idea', re.compile(r'придумай|иде[яюи]')),
+    ('schedule_lookup', re.compile(r'\b(мо[яйеё]|мне)\b.*(пар|расписан|аудитор|преподавател)|расписани')),
+    ('smalltalk', re.compile(r'^\s*(привет|здравствуй|добрый|как дела|пока|спасибо)')),
+)
+
+
+@dataclass
+class StubConfig:
+    latency: str = 'fixed:0.05'
+    tokens_per_second: float = 50.0
+    failure_rate: float = 0.0
+    failure_status: int = 500
+    hang_rate: float = 0.0
+    hang_seconds: float = 400.0
+    augment_variants: int = 25
+    responses: Dict[str, List[str]] = field(default_factory=lambda: dict(DEFAULT_RESPONSES))
+    seed: Optional[int] = None
+
+
+def parse_latency(spec: str):
+    """'fixed:0.2', 'uniform:0.1,0.5', 'normal:0.3,0.1', 'lognormal:mu,sigma' -> функция без аргументов."""
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',') if v]
+    if kind == 'fixed':
+        return lambda rng: values[0]
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+
+def detect_prompt_kind(text: str) -> str:
+    for kind, marker in PROMPT_KINDS:
+        if marker in text:
+            return kind
+    return 'generate'
+
+
+def classify_question(prompt: str) -> str:
+    """Метка намерения для промпта классификатора (по тексту вопроса студента)."""
+    match = re.search(r'ВОПРОС СТУДЕНТА:\s*(.*?)\s*ТВОЙ ОТВЕТ', prompt, re.DOTALL)
+    question = (match.group(1) if match else prompt).lower()
+    for label, pattern in INTENT_RULES:
+        if pattern.search(question):
+            return label
+    return 'rag_faq'
+
+
+def count_tokens(text: str) -> int:
+    # Грубая оценка, как у токенизаторов на русском тексте: ~4 символа на токен
+    return max(1, len(text) // 4)
+
+
+class OllamaStub:
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.rng_lock = threading.Lock()
+        self.latency = parse_latency(config.latency)
+        self.stats = {'requests': 0, 'failures': 0, 'hangs': 0}
+
+    def count(self, key: str):
+        with self.rng_lock:
+            self.stats[key] += 1
+
+    def _random(self) -> float:
+        with self.rng_lock:
+            return self.rng.random()
+
+    def sample_latency(self) -> float:
+        with self.rng_lock:
+            return self.latency(self.rng)
+
+    def build_response(self, payload: dict) -> str:
+        prompt = payload.get('prompt', '')
+        kind = detect_prompt_kind(payload.get('system', '') + prompt)
+        if kind == 'intent':
+            return classify_question(prompt)
+        if kind == 'augment':
+            match = re.search(r'ОРИГИНАЛЬНЫЙ ВОПРОС:\s*"([^"]*)"\s*ТВОЙ ОТВЕТ:\s*$', prompt)
+            question = match.group(1) if match else 'вопрос'
+            variants = [f"{question} (вариант {i + 1})" for i in range(self.config.augment_variants)]
+            return json.dumps(variants, ensure_ascii=False)
+        with self.rng_lock:
+            return self.rng.choice(self.config.responses.get(kind) or self.config.responses['generate'])
+
+
+def _tokenize_for_stream(text: str) -> List[str]:
+    return re.findall(r'\S+\s*|\s+', text) or ['']
+
+
+class _GenerateHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    stub: OllamaStub  # задаётся в make_server
+
+    def _send_json(self, status: int, data: dict):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/api/version':
+            self._send_json(200, {'version': 'stub'})
+        elif self.path == '/api/tags':
+            self._send_json(200, {'models': [{'name': 'stub'}]})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/api/generate':
+            self._send_json(404, {'error': 'not found'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': 'invalid json'})
+            return
+
+        stub, config = self.stub, self.stub.config
+        stub.count('requests')
+        started = time.perf_counter()
+
+        if stub._random() < config.hang_rate:
+            stub.count('hangs')
+            time.sleep(config.hang_seconds)
+        if stub._random() < config.failure_rate:
+            stub.count('failures')
+            self._send_json(config.failure_status, {'error': 'injected failure'})
+            return
+
+        prefill = stub.sample_latency()
+        time.sleep(prefill)
+        text = stub.build_response(payload)
+        chunks = _tokenize_for_stream(text)
+        num_predict = (payload.get('options') or {}).get('num_predict')
+        if num_predict is not None and num_predict >= 0:
+            chunks = chunks[:max(1, num_predict)]
+            text = ''.join(chunks)
+        per_token = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+        def final_fields() -> dict:
+            total = time.perf_counter() - started
+            prompt_text = payload.get('system', '') + payload.get('prompt', '')
+            return {
+                'done': True,
+                'done_reason': 'stop',
+                'total_duration': int(total * 1e9),
+                'load_duration': 0,
+                'prompt_eval_count': count_tokens(prompt_text),
+                'prompt_eval_duration': int(prefill * 1e9),
+                'eval_count': len(chunks),
+                'eval_duration': int(len(chunks) * per_token * 1e9),
+            }
+
+        model = payload.get('model', 'stub')
+        created = datetime.now(timezone.utc).isoformat()
+        if payload.get('stream', True):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                for chunk in chunks:
+                    time.sleep(per_token)
+                    self._write_chunk({'model': model, 'created_at': created, 'response': chunk, 'done': False})
+                self._write_chunk({'model': model, 'created_at': created, 'response': '', **final_fields()})
+                self.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                # Клиент отменил генерацию — это штатный сценарий
+                logger.debug("Клиент закрыл потоковое соединение")
+            return
+
+        time.sleep(per_token * len(chunks))
+        self._send_json(200, {'model': model, 'created_at': created, 'response': text, **final_fields()})
+
+    def _write_chunk(self, data: dict):
+        line = json.dumps(data, ensure_ascii=False).encode('utf-8') + b'\n'
+        self.wfile.write(f'{len(line):x}\r\n'.encode('ascii') + line + b'\r\n')
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        logger.debug("ollama-stub: " + format, *args)
+
+
+def make_server(config: StubConfig, host: str = '127.0.0.1', port: int = 11435) -> ThreadingHTTPServer:
+    handler = type('GenerateHandler', (_GenerateHandler,), {'stub': OllamaStub(config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_background(config: StubConfig, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """Запускает заглушку в фоновом потоке (port=0 — любой свободный порт)."""
+    server = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, name='ollama-stub', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка Ollama /api/generate")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--latency', default='fixed:0.05', help='fixed:S | uniform:A,B | normal:M,SD | lognormal:MU,SIGMA')
+    parser.add_argument('--tps', type=float, default=50.0, help='Токенов в секунду (0 — мгновенно)')
+    parser.add_argument('--failure_rate', type=float, default=0.0)
+    parser.add_argument('--failure_status', type=int, default=500)
+    parser.add_argument('--hang_rate', type=float, default=0.0)
+    parser.add_argument('--hang_seconds', type=float, default=400.0)
+    parser.add_argument('--augment_variants', type=int, default=25)
+    parser.add_argument('--responses', type=Path, help='JSON {тип_промпта: [ответы]} поверх встроенных')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    responses = dict(DEFAULT_RESPONSES)
+    if args.responses:
+        with open(args.responses, 'r', encoding='utf-8') as f:
+            responses.update(json.load(f))
+    config = StubConfig(
+        latency=args.latency, tokens_per_second=args.tps, failure_rate=args.failure_rate,
+        failure_status=args.failure_status, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+        augment_variants=args.augment_variants, responses=responses, seed=args.seed,
+    )
+    server = make_server(config, args.host, args.port)
+    print(f"🧪 Заглушка Ollama слушает http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Статистика: {server.RequestHandlerClass.stub.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Параллельный рендер кадров для GIF-аналитики (analyze_video_genius.py,
+analyze_god_mode.py, analyze_cyberpunk.py).
+
+FuncAnimation + PillowWriter рисуют кадры по одному в одном процессе, и
+360° вращения 3D-куба рендерится минутами. Здесь кадры раскладываются по
+пулу процессов: каждый процесс один раз строит свою фигуру на собственном
+Agg-холсте (setup) и рисует доставшиеся ему кадры (update), а главный
+процесс получает готовые RGB-буферы строго по порядку и сразу отдаёт их
+кодировщику.
+
+Сцена — функция уровня модуля setup(*args) -> (fig, update), где update(frame)
+перерисовывает фигуру для значения кадра и не зависит от предыдущих кадров.
+
+Кодировщики:
+ - ffmpeg (если есть в PATH) — кадры идут в stdin потоком; .gif кодируется
+   с палитрой по всему ролику, .mp4 — libx264;
+ - pillow — как PillowWriter: кадры копятся в памяти и пишутся в GIF в конце.
+
+Бенчмарк (кадров в секунду от числа процессов на синтетическом 3D-вращении):
+    python render_parallel.py --workers 1 2 4 8 --frames 180
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Процессов по умолчанию и сколько кусков диапазона кадров приходится на процесс
+RENDER_WORKERS = os.cpu_count() or 4
+CHUNKS_PER_WORKER = 4
+ENCODERS = ('auto', 'ffmpeg', 'pillow')
+FFMPEG_CODEC_ARGS = {
+    # Палитра строится по всему ролику, а не по первому кадру, как у Pillow
+    '.gif': ['-filter_complex', 'split[a][b];[a]palettegen[p];[b][p]paletteuse'],
+    # yuv420p требует чётных размеров кадра
+    '.mp4': ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p'],
+}
+
+Scene = Tuple[Any, Callable[[Any], Any]]
+
+# --- Рендер кадра (в рабочем процессе или в главном при workers=1) ---
+
+_scene: Optional[Scene] = None
+
+
+def _build_scene(setup: Callable[..., Scene], setup_args: tuple) -> Scene:
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig, update = setup(*setup_args)
+    # Собственный Agg-холст: фигура не зависит от интерактивного бэкенда pyplot
+    FigureCanvasAgg(fig)
+    return fig, update
+
+
+def _init_worker(setup: Callable[..., Scene], setup_args: tuple):
+    global _scene
+    _scene = _build_scene(setup, setup_args)
+
+
+def draw_frame(scene: Scene, frame) -> Tuple[Tuple[int, int], bytes]:
+    """Рисует кадр и возвращает ((ширина, высота), RGB-байты)."""
+    fig, update = scene
+    update(frame)
+    fig.canvas.draw()
+    rgba = np.asarray(fig.canvas.buffer_rgba())
+    height, width = rgba.shape[:2]
+    return (width, height), np.ascontiguousarray(rgba[:, :, :3]).tobytes()
+
+
+def _render_in_worker(frame) -> Tuple[Tuple[int, int], bytes]:
+    return draw_frame(_scene, frame)
+
+
+# --- Кодировщики ---
+
+class FfmpegSink:
+    """Кадры уходят в stdin ffmpeg по мере готовности, в памяти не копятся."""
+
+    def __init__(self, path: Path, size: Tuple[int, int], fps: float):
+        suffix = Path(path).suffix.lower()
+        if suffix not in FFMPEG_CODEC_ARGS:
+            raise ValueError(f"ffmpeg: неподдерживаемый формат {suffix}. Доступны: {', '.join(FFMPEG_CODEC_ARGS)}")
+        width, height = size
+        command = [shutil.which('ffmpeg'), '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+                   *FFMPEG_CODEC_ARGS[suffix], str(path)]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def add(self, rgb: bytes):
+        try:
+            self.process.stdin.write(rgb)
+        except BrokenPipeError:
+            # ffmpeg уже завершился — причина в его stderr, а не в закрытом канале
+            self.process.wait()
+            stderr = self.process.stderr.read().decode('utf-8', 'replace')
+            raise RuntimeError(f"ffmpeg завершился с ошибкой: {stderr.strip()}") from None
+
+    def close(self):
+        self.process.stdin.close()
+        stderr = self.process.stderr.read().decode('utf-8', 'replace')
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg завершился с ошибкой: {stderr.strip()}")
+
+    def abort(self):
+        """Рендер прервался: останавливаем ffmpeg и забираем код возврата, чтобы не оставить зомби."""
+        if self.process.poll() is None:
+            self.process.kill()
+        for stream in (self.process.stdin, self.process.stderr):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self.process.wait()
+
+
+class PillowSink:
+    """GIF через Pillow, как matplotlib PillowWriter: все кадры в памяти до конца."""
+
+    def __init__(self, path: Path, size: Tuple[int, int], fps: float):
+        if Path(path).suffix.lower() != '.gif':
+            raise ValueError(f"Pillow пишет только GIF, для {path} нужен ffmpeg")
+        self.path = path
+        self.size = size
+        self.fps = fps
+        self.frames: List[Any] = []
+
+    def add(self, rgb: bytes):
+        from PIL import Image
+        self.frames.append(Image.frombuffer('RGB', self.size, rgb, 'raw', 'RGB', 0, 1))
+
+    def close(self):
+        if self.frames:
+            self.frames[0].save(self.path, save_all=True, append_images=self.frames[1:],
+                                duration=int(1000 / self.fps), loop=0)
+
+    def abort(self):
+        self.frames.clear()
+
+
+def resolve_encoder(encoder: str, path: Path) -> str:
+    if encoder == 'auto':
+        return 'ffmpeg' if shutil.which('ffmpeg') and Path(path).suffix.lower() in FFMPEG_CODEC_ARGS else 'pillow'
+    if encoder == 'ffmpeg' and not shutil.which('ffmpeg'):
+        raise RuntimeError("ffmpeg не найден в PATH")
+    return encoder
+
+
+# --- API ---
+
+def render_animation(setup: Callable[..., Scene], setup_args: tuple, frames: Iterable, output: Path,
+                     fps: float, workers: Optional[int] = None, encoder: str = 'auto') -> Dict[str, Any]:
+    """
+    Рендерит кадры сцены в файл (GIF или MP4). workers=1 — без пула, в этом процессе.
+    Возвращает статистику: число кадров, время, кадров в секунду, кодировщик.
+    """
+    frames = list(frames)
+    workers = max(1, min(workers or RENDER_WORKERS, len(frames) or 1))
+    encoder = resolve_encoder(encoder, output)
+    sink_class = FfmpegSink if encoder == 'ffmpeg' else PillowSink
+    sink = None
+    t0 = time.perf_counter()
+
+    def consume(rendered: Iterable[Tuple[Tuple[int, int], bytes]]):
+        nonlocal sink
+        for size, rgb in rendered:
+            if sink is None:
+                sink = sink_class(output, size, fps)
+            sink.add(rgb)
+
+    try:
+        if workers == 1:
+            scene = _build_scene(setup, setup_args)
+            try:
+                consume(draw_frame(scene, frame) for frame in frames)
+            finally:
+                _close_figure(scene[0])
+        else:
+            # spawn: рабочим не достаются чужие фигуры и потоки главного процесса
+            ctx = multiprocessing.get_context('spawn')
+            chunksize = max(1, -(-len(frames) // (workers * CHUNKS_PER_WORKER)))
+            with ctx.Pool(workers, initializer=_init_worker, initargs=(setup, setup_args)) as pool:
+                # imap отдаёт кадры в исходном порядке, даже если соседние куски готовы раньше
+                consume(pool.imap(_render_in_worker, frames, chunksize=chunksize))
+    except BaseException:
+        if sink is not None:
+            sink.abort()
+        raise
+    if sink is not None:
+        sink.close()
+    seconds = time.perf_counter() - t0
+    return {"frames": len(frames), "workers": workers, "encoder": encoder, "seconds": round(seconds, 3),
+            "fps": round(len(frames) / seconds, 2) if seconds else None}
+
+
+def _close_figure(fig):
+    import matplotlib.pyplot as plt
+    plt.close(fig)
+
+
+# --- Бенчмарк ---
+
+def benchmark_scene(points: int, seed: int) -> Scene:
+    """Синтетическая сцена наподобие 3D-куба analyze_cyberpunk.py."""
+    import matplotlib.pyplot as plt
+
+    plt.style.use('dark_background')
+    rng = np.random.default_rng(seed)
+    x, y, z = rng.uniform(0, 6, points), rng.uniform(0, 23, points), rng.gamma(2.0, 40.0, points)
+    fig = plt.figure(figsize=(10, 10))
+    ax = fig.add_subplot(111, projection='3d')
+    ax.scatter(x, y, z, c=y, cmap='plasma', s=40, alpha=0.8, edgecolors='w', linewidth=0.2)
+    ax.set_title('RENDER BENCHMARK', color='white', fontsize=15)
+
+    def update(frame):
+        ax.view_init(elev=20, azim=frame)
+
+    return fig, update
+
+
+def run_benchmark(args) -> Dict[str, Any]:
+    frames = np.arange(0, 360, 360 / args.frames)
+    report: Dict[str, Any] = {"frames": len(frames), "points": args.points, "runs": []}
+    with tempfile.TemporaryDirectory(prefix='render_bench_') as tmp:
+        for workers in args.workers:
+            output = Path(tmp) / f'bench_{workers}{args.suffix}'
+            stats = render_animation(benchmark_scene, (args.points, args.seed), frames, output, args.fps,
+                                     workers=workers, encoder=args.encoder)
+            stats["file_mb"] = round(output.stat().st_size / 2**20, 3) if output.exists() else None
+            report["runs"].append(stats)
+            print(f"  workers={workers}: {stats['fps']} кадр/с ({stats['seconds']} с, {stats['encoder']})")
+    baseline = next((run for run in report["runs"] if run["workers"] == 1), None)
+    if baseline and baseline["fps"]:
+        for run in report["runs"]:
+            run["speedup"] = round(run["fps"] / baseline["fps"], 2)
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description="Бенчмарк параллельного рендера кадров: кадров/с от числа процессов")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, RENDER_WORKERS])
+    parser.add_argument('--frames', type=int, default=180)
+    parser.add_argument('--points', type=int, default=2000)
+    parser.add_argument('--fps', type=float, default=20)
+    parser.add_argument('--encoder', choices=ENCODERS, default='auto')
+    parser.add_argument('--suffix', choices=sorted(FFMPEG_CODEC_ARGS), default='.gif')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', type=Path, default=Path('bench_render.json'))
+    args = parser.parse_args(argv)
+    args.workers = sorted(set(args.workers))
+
+    report = run_benchmark(args)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True))
+    print(f"✅ Результаты сохранены: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# coding: utf-8
+"""
+Пулы заранее сгенерированных ответов для промптов без переменной части
+(шутка на попытку взлома, ответ на приветствие).
+
+Фоновый поток пополняет пул, только пока LLM простаивает, так что живым
+вопросам студентов он не мешает. Выдача — popleft из deque, O(1), и каждый
+ответ отдаётся один раз. Живая генерация нужна, только если пул пуст.
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from tracing import metrics
+
+metrics.describe('response_pool_served_total', 'Ответы из пулов: из запаса (pool) или сгенерированные на лету (live)')
+metrics.describe('response_pool_size', 'Текущий размер пула заготовленных ответов')
+
+
+class ResponsePool:
+    def __init__(self, name: str, generate: Callable[[], str], size: int,
+                 is_idle: Callable[[], bool] = lambda: True,
+                 accept: Callable[[str], bool] = bool,
+                 check_interval: float = 2.0, refill_lock=None):
+        """
+        generate — вызов LLM, возвращающий один ответ;
+        is_idle — можно ли сейчас занимать LLM фоновой генерацией;
+        accept — отсеивает пустые ответы и ошибки;
+        refill_lock — общий для пулов (и процессов) замок с acquire(blocking=False)/release:
+                      фоновая генерация идёт одна на всех.
+        """
+        self.name = name
+        self.generate = generate
+        self.size = size
+        self.is_idle = is_idle
+        self.accept = accept
+        self.check_interval = check_interval
+        self.refill_lock = refill_lock if refill_lock is not None else threading.Lock()
+        self._items: deque = deque()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def take(self) -> Optional[str]:
+        try:
+            item = self._items.popleft()
+        except IndexError:
+            return None
+        metrics.set_gauge('response_pool_size', len(self._items), {'pool': self.name})
+        return item
+
+    def get(self) -> str:
+        """Ответ из пула; если пул пуст — генерируется сразу."""
+        item = self.take()
+        if item is not None:
+            metrics.inc('response_pool_served_total', labels={'pool': self.name, 'source': 'pool'})
+            return item
+        print(f"...пул «{self.name}» пуст, генерирую на лету...")
+        metrics.inc('response_pool_served_total', labels={'pool': self.name, 'source': 'live'})
+        return self.generate()
+
+    def start(self):
+        if self._thread is not None or self.size <= 0:
+            return
+        self._thread = threading.Thread(target=self._refill, name=f'response-pool-{self.name}', daemon=True)
+        self._thread.start()
+
+    def _refill(self):
+        while True:
+            if len(self._items) >= self.size or not self.is_idle():
+                time.sleep(self.check_interval)
+                continue
+            # Другой пул уже генерирует — ждём, а не добавляем LLM второй фоновый запрос
+            if not self.refill_lock.acquire(blocking=False):
+                time.sleep(self.check_interval)
+                continue
+            try:
+                item = self.generate()
+            except Exception as e:
+                print(f"⚠️ Не удалось пополнить пул «{self.name}»: {e}")
+                item = None
+            finally:
+                self.refill_lock.release()
+            if item is not None and self.accept(item):
+                self._items.append(item)
+                metrics.set_gauge('response_pool_size', len(self._items), {'pool': self.name})
+            else:
+                # LLM вернула ошибку — не долбим её, ждём следующего окна простоя
+                time.sleep(self.check_interval)
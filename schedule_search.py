@@ -0,0 +1,87 @@
+# coding: utf-8
+"""
+Нечёткий поиск студента в расписании по ФИО.
+
+Раньше каждое введённое слово должно было дословно встретиться в ФИО:
+одна опечатка или «ё» вместо «е» — и студент снова получал «попробуйте
+ещё раз», а бот тратил на это лишние сообщения и классификации.
+
+Здесь ФИО нормализуются так же, как вопросы в lexical_index (регистр, ё/е,
+пунктуация, лишние пробелы — при сборке снимка расписания), и индексируются
+по символьным триграммам:
+ 1. кандидаты — записи с наибольшим числом общих с запросом триграмм;
+ 2. оценка кандидата — среднее по словам запроса лучшего коэффициента Дайса
+    с одним из слов ФИО. Порядок слов не важен, можно ввести не все слова.
+
+На десятках тысяч записей поиск укладывается в единицы миллисекунд.
+"""
+import heapq
+from array import array
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+from lexical_index import char_ngrams, dice, normalize_text
+
+# Сколько записей с наибольшим числом общих триграмм оценивать точно
+FIO_CANDIDATES = 50
+# Минимальная оценка совпадения и насколько можно отстать от лучшей записи, чтобы попасть в уточнение
+FIO_MATCH_THRESHOLD = 0.75
+FIO_CONFIRM_MARGIN = 0.05
+# Слишком частые триграммы (« ив», «ова») не сужают выбор, а списки у них длинные
+MAX_POSTING_SHARE = 0.2
+
+
+def word_similarity(query_words: List[Counter], fio_words: List[Counter]) -> float:
+    if not query_words or not fio_words:
+        return 0.0
+    return sum(max(dice(q, w) for w in fio_words) for q in query_words) / len(query_words)
+
+
+class FioIndex:
+    """
+    normalized — ФИО после normalize_text, например столбец fio_normalized
+    снимка расписания. Индекс хранит ссылку на него, а не копию строк.
+    """
+
+    def __init__(self, normalized: Sequence[str]):
+        self.normalized = normalized
+        postings: Dict[str, array] = defaultdict(lambda: array('I'))
+        for row in range(len(normalized)):
+            for gram in set(char_ngrams(normalized[row])):
+                postings[gram].append(row)
+        self.postings = dict(postings)
+
+    def __len__(self) -> int:
+        return len(self.normalized)
+
+    def _candidates(self, query_grams: set) -> List[int]:
+        counts: Counter = Counter()
+        max_postings = max(1, int(len(self) * MAX_POSTING_SHARE))
+        lists = [self.postings[g] for g in query_grams if g in self.postings]
+        rare = [p for p in lists if len(p) <= max_postings]
+        # Если в запросе одни частые триграммы, без них кандидатов не найти
+        for postings in (rare or lists):
+            counts.update(postings)
+        return [row for row, _ in heapq.nlargest(FIO_CANDIDATES, counts.items(), key=lambda item: item[1])]
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        """
+        Близкие к лучшей записи совпадения: [(строка, оценка 0..1)], по убыванию
+        оценки, не больше limit. Если есть точные совпадения всех слов — только они.
+        """
+        norm = normalize_text(query)
+        if not norm:
+            return []
+        query_words = [Counter(char_ngrams(word)) for word in norm.split()]
+        scored = []
+        for row in self._candidates(set(char_ngrams(norm))):
+            fio_words = [Counter(char_ngrams(word)) for word in self.normalized[row].split()]
+            score = word_similarity(query_words, fio_words)
+            if score >= FIO_MATCH_THRESHOLD:
+                scored.append((score, row))
+        if not scored:
+            return []
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        best = scored[0][0]
+        floor = best if best >= 1.0 else best - FIO_CONFIRM_MARGIN
+        return [(row, score) for score, row in scored if score >= floor][:limit]
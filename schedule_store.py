@@ -0,0 +1,148 @@
+# coding: utf-8
+"""
+Снимок расписания интенсивов в виде столбцов на диске (по образцу knowledge_store/).
+
+Excel читается через pandas только при сборке снимка. Бот и рабочие
+процессы открывают столбцы через np.memmap: несколько процессов делят одни
+и те же страницы page cache вместо собственных копий DataFrame.
+
+Каталог schedule_store/:
+ - FIO (.offsets.npy / .bin) — ФИО как в Excel;
+ - AUD, PERSONS, STUDY_GROUP — словарное кодирование: у тысяч студентов
+   десятки аудиторий, преподавателей и групп, поэтому на диске лежат
+   <поле>.codes.npy (uint16/int32, номер значения) и <поле>.values (.offsets.npy /
+   .bin) — сами различные значения. В памяти они держатся один раз, интернированными;
+ - fio_normalized (.offsets.npy / .bin) — ФИО после normalize_text для поиска (schedule_search.py);
+ - stream_day.npy  int8: день месяца даты потока (0 — дата не указана).
+
+Сборка вручную (бот пересобирает снимок сам, если Excel новее):
+    python schedule_store.py output_with_weeks.xlsx schedule_store
+"""
+import argparse
+import shutil
+from pathlib import Path
+import sys
+from typing import Any, Dict, Sequence, Tuple
+
+import numpy as np
+
+from knowledge_store import StringColumn
+from lexical_index import normalize_text
+
+SCHEDULE_FIELDS = ('FIO', 'AUD', 'PERSONS', 'STUDY_GROUP')
+# Поля с немногими различными значениями — хранятся кодами
+CATEGORY_FIELDS = ('AUD', 'PERSONS', 'STUDY_GROUP')
+STREAM_DAY_FILE = 'stream_day.npy'
+
+
+class ScheduleRecord:
+    """Запись расписания одного студента. Пустые поля — пустые строки, stream_day 0 — дата не указана."""
+    __slots__ = ('fio', 'aud', 'persons', 'study_group', 'stream_day')
+
+    def __init__(self, fio: str, aud: str, persons: str, study_group: str, stream_day: int):
+        self.fio = fio
+        self.aud = aud
+        self.persons = persons
+        self.study_group = study_group
+        self.stream_day = stream_day
+
+    def __repr__(self) -> str:
+        return f"ScheduleRecord({self.fio!r}, группа {self.study_group!r})"
+
+
+class CategoryColumn:
+    """Столбец со словарным кодированием: коды через memmap, различные значения — один раз в памяти."""
+
+    def __init__(self, directory: Path, name: str):
+        self.codes = np.load(directory / f'{name}.codes.npy', mmap_mode='r')
+        values = StringColumn(directory, f'{name}.values')
+        self.values: Tuple[str, ...] = tuple(sys.intern(values[i]) for i in range(len(values)))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, i: int) -> str:
+        return self.values[int(self.codes[i])]
+
+    @staticmethod
+    def write(directory: Path, name: str, values: Sequence[str]):
+        vocabulary: Dict[str, int] = {}
+        codes = [vocabulary.setdefault(value, len(vocabulary)) for value in values]
+        dtype = np.uint16 if len(vocabulary) <= np.iinfo(np.uint16).max else np.int32
+        np.save(directory / f'{name}.codes.npy', np.array(codes, dtype=dtype))
+        StringColumn.write(directory, f'{name}.values', list(vocabulary))
+
+
+class ScheduleStore:
+    """Только для чтения; ФИО декодируются по требованию."""
+
+    def __init__(self, directory: Path):
+        directory = Path(directory)
+        self.directory = directory
+        self.fio = StringColumn(directory, 'FIO')
+        self.categories = {name: CategoryColumn(directory, name) for name in CATEGORY_FIELDS}
+        self.fio_normalized = StringColumn(directory, 'fio_normalized')
+        self.stream_day = np.load(directory / STREAM_DAY_FILE, mmap_mode='r')
+
+    def __len__(self) -> int:
+        return len(self.stream_day)
+
+    def row(self, i: int) -> ScheduleRecord:
+        categories = self.categories
+        return ScheduleRecord(self.fio[i], categories['AUD'][i], categories['PERSONS'][i],
+                              categories['STUDY_GROUP'][i], int(self.stream_day[i]))
+
+    @staticmethod
+    def write(directory: Path, rows: Sequence[Dict[str, Any]]):
+        """Пишет во временный каталог и подменяет целиком, как KnowledgeStore.write."""
+        target = Path(directory)
+        directory = target.with_name(target.name + '.tmp')
+        shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir(parents=True)
+        StringColumn.write(directory, 'FIO', [row.get('FIO') or "" for row in rows])
+        for name in CATEGORY_FIELDS:
+            CategoryColumn.write(directory, name, [row.get(name) or "" for row in rows])
+        StringColumn.write(directory, 'fio_normalized', [normalize_text(row.get('FIO') or "") for row in rows])
+        np.save(directory / STREAM_DAY_FILE, np.array([row.get('STREAM_DAY') or 0 for row in rows], dtype=np.int8))
+
+        old = target.with_name(target.name + '.old')
+        shutil.rmtree(old, ignore_errors=True)
+        if target.exists():
+            target.rename(old)
+        directory.rename(target)
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def schedule_store_is_fresh(excel_path: Path, directory: Path) -> bool:
+    stream_day = Path(directory) / STREAM_DAY_FILE
+    # Снимки до словарного кодирования пересобираются
+    codes_exist = all((Path(directory) / f'{name}.codes.npy').exists() for name in CATEGORY_FIELDS)
+    return codes_exist and stream_day.exists() and stream_day.stat().st_mtime_ns >= Path(excel_path).stat().st_mtime_ns
+
+
+def build_schedule_store(excel_path: Path, directory: Path) -> int:
+    """Читает Excel расписания и сохраняет снимок. Возвращает число записей."""
+    import pandas as pd
+
+    df = pd.read_excel(excel_path)
+    stream_dates = pd.to_datetime(df['STREAM_DATE'], errors='coerce')
+    rows = []
+    for i, record in enumerate(df.to_dict('records')):
+        row = {name: '' if pd.isna(record.get(name)) else str(record.get(name)) for name in SCHEDULE_FIELDS}
+        row['STREAM_DAY'] = int(stream_dates.iloc[i].day) if pd.notna(stream_dates.iloc[i]) else 0
+        rows.append(row)
+    ScheduleStore.write(directory, rows)
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка снимка расписания из Excel")
+    parser.add_argument('excel_path', type=Path)
+    parser.add_argument('store_dir', type=Path)
+    args = parser.parse_args()
+    count = build_schedule_store(args.excel_path, args.store_dir)
+    print(f"✅ {count} записей расписания сохранено в {args.store_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# coding: utf-8
+"""
+Профиль холодного старта бота: во что обходится импорт каждого пакета и
+каждый этап инициализации.
+
+    python telegram_bot.py --profile_startup [--processes N]
+
+Бот собирается как при обычном запуске (бэкенд, Application), но к Telegram
+не подключается: печатается разбивка и процесс завершается. Замер импортов
+включается до первого тяжёлого import в telegram_bot, поэтому в отчёт
+попадают и telegram, и numpy, и то, что подтянет RAGChatBot (faiss, torch).
+"""
+import builtins
+import sys
+import threading
+import time
+from collections import defaultdict
+from importlib.util import resolve_name
+from typing import Dict, List, Tuple
+
+PROFILE_FLAG = '--profile_startup'
+# Сколько строк печатать в таблицах отчёта
+PROFILE_TOP = 15
+
+
+class ImportTimer:
+    """
+    Обёртка над builtins.__import__: для каждого впервые импортируемого модуля
+    замеряет полное время и собственное (без вложенных импортов).
+    """
+
+    def __init__(self):
+        self.records: List[Tuple[str, float, float]] = []  # (модуль, полное, собственное), сек
+        self.installed_at = None
+        self._original = None
+        self._local = threading.local()
+
+    def install(self):
+        if self._original is not None:
+            return
+        self._original = builtins.__import__
+        self.installed_at = time.perf_counter()
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original
+        try:
+            module = resolve_name('.' * level + name, (globals or {}).get('__package__')) if level else name
+        except (ImportError, ValueError):
+            module = name
+        if module in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+        t0 = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            total = time.perf_counter() - t0
+            nested = stack.pop()
+            if stack:
+                stack[-1] += total
+            self.records.append((module, total, total - nested))
+
+    def by_package(self) -> Dict[str, float]:
+        """Собственное время импорта, сложенное по пакетам верхнего уровня."""
+        totals: Dict[str, float] = defaultdict(float)
+        for module, _, own in self.records:
+            totals[module.partition('.')[0]] += own
+        return dict(totals)
+
+
+import_timer = ImportTimer()
+
+
+def print_report(stages: Dict[str, float], timer: ImportTimer = import_timer):
+    """stages — этапы инициализации (имя -> сек) в порядке выполнения, например Trace.stages."""
+    import_total = sum(own for _, _, own in timer.records)
+    print('\n⏱️ Профиль холодного старта')
+    print(f'  Импорт модулей: {import_total * 1000:9.1f} мс ({len(timer.records)} модулей)')
+    for package, seconds in sorted(timer.by_package().items(), key=lambda item: -item[1])[:PROFILE_TOP]:
+        print(f'    {package:<32} {seconds * 1000:9.1f} мс')
+
+    print('  Этапы инициализации:')
+    for name, seconds in stages.items():
+        print(f'    {name:<32} {seconds * 1000:9.1f} мс')
+
+    print('  Самые дорогие импорты (с вложенными):')
+    # Вложенные модули пакета повторяют время родителя — показываем только верхние записи пакетов
+    shown = set()
+    for module, total, _ in sorted(timer.records, key=lambda record: -record[1]):
+        package = module.partition('.')[0]
+        if package in shown:
+            continue
+        shown.add(package)
+        print(f'    {module:<32} {total * 1000:9.1f} мс')
+        if len(shown) >= PROFILE_TOP:
+            break
+    if timer.installed_at is not None:
+        print(f'  Всего с начала замера: {(time.perf_counter() - timer.installed_at) * 1000:.1f} мс')
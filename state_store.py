@@ -0,0 +1,147 @@
+# coding: utf-8
+"""
+Состояние диалогов, которое переживает перезапуск и видно всем процессам бота.
+
+Раньше флаг поиска по ФИО (user_data['awaiting_fio']) и отметки антифлуда
+(bot_data['user_requests']) жили в памяти процесса: после перезапуска
+студент, начавший поиск расписания, попадал в классификатор, а несколько
+фронт-процессов считали лимиты каждый по-своему.
+
+StateStore — ключ-значение с TTL поверх SQLite в режиме WAL (читатели не
+блокируют писателя, запись — десятки микросекунд с synchronous=NORMAL).
+Значения — JSON. Чтения идут через кэш в памяти с коротким сроком жизни:
+горячие ключи не трогают диск, а изменения из других процессов видны
+не позже чем через cache_ttl секунд.
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+from tracing import metrics
+
+# Сколько секунд доверять значению из кэша и сколько ключей в нём держать
+STATE_CACHE_TTL = 2.0
+STATE_CACHE_SIZE = 10000
+# Как часто вычищать просроченные записи из базы (сек)
+STATE_PURGE_INTERVAL = 600.0
+# Ключи user_data, которые живут между сообщениями (и передаются рабочим процессам worker_pool)
+STATE_KEYS = ('awaiting_fio', 'fio_candidates')
+
+metrics.describe('state_store_cache_total', 'Чтения состояния: из кэша в памяти (hit) или из SQLite (miss)')
+
+_MISSING = object()
+
+
+class StateStore:
+    """Потокобезопасно: у каждого потока своё соединение с базой."""
+
+    def __init__(self, path: Path, cache_ttl: float = STATE_CACHE_TTL, cache_size: int = STATE_CACHE_SIZE):
+        self.path = Path(path)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._local = threading.local()
+        self._cache: 'OrderedDict[Tuple[str, str], tuple]' = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._last_purge = time.time()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: транзакции открываются явно, иначе sqlite3 держит их дольше нужного
+            conn = sqlite3.connect(str(self.path), timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS state ('
+                         'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL, '
+                         'PRIMARY KEY (namespace, key))')
+            self._local.conn = conn
+        return conn
+
+    # --- Кэш ---
+
+    def _cached(self, cache_key: Tuple[str, str], now: float):
+        with self._cache_lock:
+            item = self._cache.get(cache_key)
+            if item is None:
+                return _MISSING
+            value, expires_at, loaded_at = item
+            if now - loaded_at > self.cache_ttl or (expires_at is not None and expires_at <= now):
+                del self._cache[cache_key]
+                return _MISSING
+            self._cache.move_to_end(cache_key)
+            return value
+
+    def _remember(self, cache_key: Tuple[str, str], value, expires_at: Optional[float], now: float):
+        with self._cache_lock:
+            self._cache[cache_key] = (value, expires_at, now)
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # --- API ---
+
+    def get(self, namespace: str, key, default=None) -> Any:
+        cache_key = (namespace, str(key))
+        now = time.time()
+        value = self._cached(cache_key, now)
+        if value is not _MISSING:
+            metrics.inc('state_store_cache_total', labels={'result': 'hit'})
+            return default if value is None else value
+        metrics.inc('state_store_cache_total', labels={'result': 'miss'})
+        row = self._conn().execute('SELECT value, expires_at FROM state WHERE namespace = ? AND key = ?',
+                                   cache_key).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            # Отсутствие ключа тоже кэшируется: большинство студентов не в поиске по ФИО
+            self._remember(cache_key, None, None, now)
+            return default
+        value = json.loads(row[0])
+        self._remember(cache_key, value, row[1], now)
+        return value
+
+    def set(self, namespace: str, key, value, ttl: Optional[float] = None):
+        cache_key = (namespace, str(key))
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        self._conn().execute('INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                             cache_key + (json.dumps(value, ensure_ascii=False), expires_at))
+        self._remember(cache_key, value, expires_at, now)
+        self._maybe_purge(now)
+
+    def delete(self, namespace: str, key):
+        cache_key = (namespace, str(key))
+        self._conn().execute('DELETE FROM state WHERE namespace = ? AND key = ?', cache_key)
+        self._remember(cache_key, None, None, time.time())
+
+    def hit_rate_limit(self, namespace: str, key, limit: int, window: float) -> bool:
+        """
+        Скользящее окно: True, если за последние window секунд уже было limit
+        запросов (новый не засчитывается). Проверка и запись — одна транзакция,
+        поэтому лимит общий для всех процессов.
+        """
+        cache_key = (namespace, str(key))
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value FROM state WHERE namespace = ? AND key = ?', cache_key).fetchone()
+            stamps = [ts for ts in (json.loads(row[0]) if row else []) if now - ts < window]
+            limited = len(stamps) >= limit
+            if not limited:
+                stamps.append(now)
+                conn.execute('INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                             cache_key + (json.dumps(stamps), now + window))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return limited
+
+    def _maybe_purge(self, now: float):
+        if now - self._last_purge < STATE_PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        self._conn().execute('DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?', (now,))
@@ -7,26 +7,48 @@ Telegram-бот интерфейс (v25 - FULL RESTORED + UX).
 - Безопасность (SQL/Code injection filter)
 - Умная разбивка сообщений
 - Обработка отложенных обновлений
-- UX: Статус "Думаю..." и защита от спама
+- UX: Статус "Думаю..." и отмена устаревшей генерации ("стоп" или новый вопрос)
 """
+import argparse
 import logging
 import asyncio
+import json
 import re
-from datetime import datetime, timezone, timedelta
-from typing import cast, Set
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import cast, Dict
 import functools
+import sys
+
+import startup_profile
+if startup_profile.PROFILE_FLAG in sys.argv[1:]:
+    # Замер импортов включается до тяжёлых import ниже: telegram, а затем то, что подтянет бэкенд
+    startup_profile.import_timer.install()
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, error, Message
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 
-from rag_chatbot import RAGChatBot
+from state_store import STATE_KEYS, StateStore
 from config import TELEGRAM_BOT_TOKEN, ADMIN_USER_IDS
+from tracing import span, start_trace, metrics, start_metrics_server, Trace
+from cancellation import STOP_WORDS, CancelToken, GenerationCancelled, cancel_scope
+from executors import LOG_STAGE, STATE_STAGE, configure_handler_workers, get_executor
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# --- UX: Глобальный список для блокировки спама ---
-PROCESSING_USERS: Set[int] = set()
+# --- UX: Текущие генерации пользователей. Новое сообщение или "стоп" отменяет прежнюю ---
+# Токены держат сокеты к Ollama, поэтому живут в процессе, а не в state; сообщения
+# одного пользователя должны приходить в один процесс (sticky-маршрутизация на прокси)
+ACTIVE_GENERATIONS: Dict[int, CancelToken] = {}
+# Сколько апдейтов обрабатывается одновременно: иначе "стоп" дождётся конца генерации
+CONCURRENT_UPDATES = 16
+
+# --- Режим webhook: бот слушает локально, снаружи — reverse proxy с TLS ---
+WEBHOOK_LISTEN = '127.0.0.1'
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = 'telegram'
 
 # Максимальная длина одного сообщения в Telegram
 MAX_MESSAGE_LENGTH = 4096
@@ -87,26 +109,71 @@ def is_input_suspicious(text: str) -> bool:
 RATE_LIMIT_SECONDS = 10
 RATE_LIMIT_REQUESTS = 5
 
-def is_rate_limited(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
+# --- Состояние диалогов: переживает перезапуск и общее для всех процессов бота ---
+STATE_DB_PATH = Path(__file__).parent / 'bot_state.sqlite3'
+# Сколько ждать ФИО после вопроса о расписании, прежде чем забыть о поиске (сек)
+AWAITING_FIO_TTL = 3600
+USER_STATE_TTL = {'awaiting_fio': AWAITING_FIO_TTL, 'fio_candidates': AWAITING_FIO_TTL}
+# Открывается в init_state(), а не при импорте: импорт telegram_bot не трогает базу
+state: StateStore = None
+
+
+def init_state(path: Path = STATE_DB_PATH) -> StateStore:
+    """Открывает (или создаёт) хранилище состояния диалогов, с которым работают обработчики."""
+    global state
+    state = StateStore(path)
+    return state
+
+
+def load_user_state(user_id: int) -> dict:
+    """Ключи STATE_KEYS пользователя из хранилища — то, что раньше лежало в context.user_data."""
+    user_data = {}
+    for key in STATE_KEYS:
+        value = state.get(key, user_id)
+        if value is not None:
+            user_data[key] = value
+    return user_data
+
+
+def save_user_state(user_id: int, user_data: dict):
+    for key in STATE_KEYS:
+        if key in user_data:
+            state.set(key, user_id, user_data[key], ttl=USER_STATE_TTL.get(key))
+        elif state.get(key, user_id) is not None:
+            state.delete(key, user_id)
+
+
+async def read_user_state(user_id: int) -> dict:
+    """load_user_state в пуле state. Заблокированная или битая база не роняет обработчик — пустое состояние."""
+    try:
+        return await get_executor(STATE_STAGE).run_async(load_user_state, user_id)
+    except Exception:
+        logger.exception("Не удалось прочитать состояние UserID: %s, продолжаю без него.", user_id)
+        return {}
+
+
+async def write_user_state(user_id: int, user_data: dict):
+    """save_user_state в пуле state. Ответ уже готов — ошибка базы не должна его потерять."""
+    try:
+        await get_executor(STATE_STAGE).run_async(save_user_state, user_id, user_data)
+    except Exception:
+        logger.exception("Не удалось сохранить состояние UserID: %s.", user_id)
+
+
+def is_rate_limited(user_id: int) -> bool:
     """
     Проверяет, не превысил ли пользователь лимит запросов.
     """
-    now = datetime.now(timezone.utc)
-    if 'user_requests' not in context.bot_data:
-        context.bot_data['user_requests'] = {}
-
-    user_timestamps = context.bot_data['user_requests'].get(user_id, [])
-    
-    # Удаляем старые временные метки
-    user_timestamps = [ts for ts in user_timestamps if now - ts < timedelta(seconds=RATE_LIMIT_SECONDS)]
-    
-    if len(user_timestamps) >= RATE_LIMIT_REQUESTS:
+    try:
+        limited = state.hit_rate_limit('rate_limit', user_id, RATE_LIMIT_REQUESTS, RATE_LIMIT_SECONDS)
+    except Exception:
+        # Без базы лимит не проверить — пропускаем сообщение, а не роняем обработчик
+        logger.exception("Не удалось проверить лимит запросов UserID: %s.", user_id)
+        return False
+    if limited:
         logger.warning(f"Превышен лимит запросов для UserID: {user_id}. Блокировка.")
-        return True 
-
-    user_timestamps.append(now)
-    context.bot_data['user_requests'][user_id] = user_timestamps
-    return False 
+        return True
+    return False
 
 async def send_smart_split_message(bot, chat_id: int, text: str, reply_to_message_id: int | None = None):
     """
@@ -239,12 +306,35 @@ async def log_question_answer(question, answer, user, user_message_time, bot_res
                 )
         except Exception as e:
             logger.exception("Ошибка при записи в лог Q/A: %s", e)
-    await asyncio.to_thread(_write)
+    # Один поток записи: строки лога не перемешиваются и не ждут освободившихся воркеров LLM
+    await get_executor(LOG_STAGE).run_async(_write)
+
+def finish_trace(trace: Trace, outcome: str):
+    """Пишет трассу сообщения структурированной строкой лога и в метрики."""
+    trace.fields['outcome'] = outcome
+    data = trace.as_dict()
+    metrics.observe('message_duration_seconds', data['total_ms'] / 1000, {'outcome': outcome})
+    logger.info("Трассировка: %s", json.dumps(data, ensure_ascii=False), extra={'trace': data})
 
 # --- Основная логика бота ---
-print("Загрузка RAG-модели...")
-rag_bot = RAGChatBot(debug=False)
-print("RAG-модель успешно загружена.")
+# Обработка вопросов: RAGChatBot в этом процессе или пул рабочих процессов (см. worker_pool.py).
+# Бэкенд создаётся в main() и лежит в application.bot_data['backend']
+
+def init_backend(processes: int = 0):
+    """
+    Создаёт бэкенд (не запуская его). rag_chatbot и worker_pool импортируются
+    только здесь: импорт telegram_bot не тянет numpy, faiss и torch.
+    """
+    if processes > 0:
+        from worker_pool import WorkerPool
+        print(f"Запуск {processes} рабочих процессов...")
+        return WorkerPool(processes)
+    from rag_chatbot import RAGChatBot
+    from worker_pool import LocalBackend
+    print("Загрузка RAG-модели...")
+    backend = LocalBackend(RAGChatBot(debug=False))
+    print("RAG-модель успешно загружена.")
+    return backend
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -330,6 +420,20 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
     except Exception as e:
         logger.exception(f"Не удалось отправить сообщение в ответ на callback '{query.data}' в чат {chat_id}: {e}")
 
+@admin_only
+async def reload_knowledge_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перезагружает индекс и базу знаний без перезапуска бота."""
+    try:
+        info = await context.bot_data['backend'].reload()
+    except Exception as e:
+        logger.exception("Ошибка перезагрузки базы знаний")
+        await update.message.reply_text(f"❌ Перезагрузка не удалась, бот работает на прежней версии: {e}")
+        return
+    await update.message.reply_text(
+        f"✅ База знаний обновлена: версия {info['version']}, записей {info['records']}, "
+        f"векторов {info['vectors']}."
+    )
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message
     if not message or not message.text or not update.effective_user:
@@ -339,75 +443,89 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     chat_id = message.chat.id
     user_question = message.text.strip()
+    received = time.monotonic()
+    trace = start_trace(user_id=user_id, chat_id=chat_id)
 
     # 1. Проверка на флуд
-    if is_rate_limited(user_id, context): return
+    # Запросы к SQLite идут в однопоточный пул state: блокировка базы не останавливает
+    # цикл событий, а очередь пула сохраняет порядок сообщений до отправки в бэкенд
+    with span('rate_limit'):
+        limited = await get_executor(STATE_STAGE).run_async(is_rate_limited, user_id)
+    if limited:
+        finish_trace(trace, 'rate_limited')
+        return
     
     # 2. Проверка на подозрительный ввод
-    if is_input_suspicious(user_question):
+    with span('suspicion_check'):
+        suspicious = is_input_suspicious(user_question)
+    if suspicious:
         logger.critical(f"!!! ОБНАРУЖЕНА ПОПЫТКА АТАКИ от UserID: {user_id}. Сообщение: '{user_question}'")
-        joke_response = await asyncio.to_thread(rag_bot.generate_security_joke)
-        await log_question_answer(question=user_question, answer=f"[ОТВЕТ НА АТАКУ]: {joke_response}", user=update.effective_user, user_message_time=message.date if message.date else datetime.now(timezone.utc), bot_response_time=datetime.now(timezone.utc))
-        await message.reply_text(joke_response)
+        joke_response = await context.bot_data['backend'].security_joke(user_id)
+        with span('log_qa'):
+            await log_question_answer(question=user_question, answer=f"[ОТВЕТ НА АТАКУ]: {joke_response}", user=update.effective_user, user_message_time=message.date if message.date else datetime.now(timezone.utc), bot_response_time=datetime.now(timezone.utc))
+        with span('send'):
+            await message.reply_text(joke_response)
+        finish_trace(trace, 'suspicious')
         return
 
-    # --- UX: БЛОКИРОВКА СПАМА ---
-    if user_id in PROCESSING_USERS:
-        await message.reply_text("⏳ Не спеши! Я еще отвечаю на твой прошлый вопрос.")
-        return
-    
-    # Добавляем юзера в список занятых и шлем "Думаю..."
-    PROCESSING_USERS.add(user_id)
-    try:
-        status_msg = await message.reply_text("⏳ Думаю...")
-    except:
-        status_msg = None # Если вдруг не удалось отправить
+    # --- UX: ОТМЕНА УСТАРЕВШЕЙ ГЕНЕРАЦИИ ---
+    previous = ACTIVE_GENERATIONS.get(user_id)
+    if previous is not None:
+        if user_question.lower() in STOP_WORDS:
+            previous.cancel('stop')
+            await message.reply_text("🛑 Остановил. Задайте новый вопрос, когда будете готовы.")
+            finish_trace(trace, 'stopped')
+            return
+        # Ответ на прошлый вопрос больше не нужен — освобождаем модель под новый
+        previous.cancel('superseded')
+
+    # Регистрируем генерацию пользователя и шлем "Думаю..."
+    token = CancelToken()
+    ACTIVE_GENERATIONS[user_id] = token
+    status_msg = None
 
     # Оборачиваем всю логику в try...finally, чтобы ГАРАНТИРОВАННО разблокировать юзера
     try:
-        user_data = context.user_data if context.user_data is not None else {}
+        user_data = await read_user_state(user_id)
+        # Вопрос уходит в обработку до следующего await: сообщения одного пользователя
+        # попадают в бэкенд в порядке поступления. Токен виден call_ollama_api через contextvars
+        with cancel_scope(token):
+            answer_future = context.bot_data['backend'].submit_question(user_id, user_question, user_data, received)
+        try:
+            status_msg = await message.reply_text("⏳ Думаю...")
+        except:
+            status_msg = None # Если вдруг не удалось отправить
+
         user_msg_time = message.date if message.date else datetime.now(timezone.utc)
         
         logger.info(f"Получен вопрос от [user_id: {user_id}, chat_id: {chat_id}]: '{user_question}'")
         await context.bot.send_chat_action(chat_id=chat_id, action='typing')
-        
-        def process_question_in_background():
-            try:
-                if user_data.get('awaiting_fio'):
-                    if user_question.lower() == 'стоп':
-                        user_data.pop('awaiting_fio', None)
-                        return "Хорошо, поиск по расписанию отменен. Чем еще могу помочь?"
-                    else:
-                        logger.info(f"Обработка сообщения как ФИО: '{user_question}'")
-                        schedule_info_list = rag_bot.find_schedule_by_fio(user_question)
-                        if schedule_info_list:
-                            user_data.pop('awaiting_fio', None)
-                            return rag_bot.format_schedule_response(schedule_info_list)
-                        else:
-                            return ("К сожалению, не удалось найти вас в списках.\n\n"
-                                    "Пожалуйста, попробуйте ввести Фамилию, Имя и Отчество еще раз, проверив правильность написания.\n"
-                                    "Если хотите отменить поиск, напишите \"стоп\".")
-                else:
-                    intent = rag_bot.classify_intent(user_question)
-                    logger.info(f"Классифицированное намерение: '{intent}'")
-                    
-                    if intent == 'schedule_lookup':
-                        if context.user_data is not None:
-                             context.user_data['awaiting_fio'] = True
-                        return "Пожалуйста, напишите ваши Фамилию, Имя и Отчество для поиска в расписании."
-                    elif intent == 'creative_idea':
-                        return rag_bot.answer_creatively(user_question)
-                    elif intent == 'creative_team_name':
-                        return rag_bot.answer_team_name_creatively(user_question)
-                    elif intent == 'smalltalk':
-                        return rag_bot.answer_smalltalk(user_question)
-                    else: # 'rag_faq' or 'unclear'
-                        return rag_bot.answer_by_rag(user_question)
-            except Exception as e:
-                logger.error(f"Ошибка при обработке вопроса в фоне: {e}", exc_info=True)
-                return "Произошла внутренняя ошибка. Попробуйте задать вопрос иначе."
-
-        bot_response = await asyncio.to_thread(process_question_in_background)
+
+        try:
+            bot_response, intent = await answer_future
+            if intent:
+                trace.fields['intent'] = intent
+                logger.info(f"Намерение: '{intent}'")
+        except GenerationCancelled:
+            bot_response = None
+        except Exception as e:
+            logger.error(f"Ошибка при обработке вопроса в фоне: {e}", exc_info=True)
+            bot_response = "Произошла внутренняя ошибка. Попробуйте задать вопрос иначе."
+
+        if token.cancelled:
+            # Пользователь уже написал "стоп" или новый вопрос — устаревший ответ не отправляем
+            if status_msg:
+                try:
+                    await status_msg.delete()
+                except:
+                    pass
+            logger.info(f"Генерация для [chat_id: {chat_id}] отменена ({token.reason}), ответ отброшен.")
+            finish_trace(trace, 'cancelled')
+            return
+
+        # Состояние диалога сохраняем только для доставленного ответа: отмененный
+        # вопрос о расписании не должен оставлять ожидание ФИО
+        await write_user_state(user_id, user_data)
 
         # --- UX: УДАЛЯЕМ СТАТУС "ДУМАЮ" ПЕРЕД ОТВЕТОМ ---
         if status_msg:
@@ -417,21 +535,31 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 pass
 
         bot_resp_time = datetime.now(timezone.utc)
-        await log_question_answer(
-            question=user_question, answer=bot_response, user=update.effective_user,
-            user_message_time=user_msg_time, bot_response_time=bot_resp_time
-        )
+        with span('log_qa'):
+            await log_question_answer(
+                question=user_question, answer=bot_response, user=update.effective_user,
+                user_message_time=user_msg_time, bot_response_time=bot_resp_time
+            )
         
-        await send_smart_split_message(
-            bot=context.bot, chat_id=chat_id, text=bot_response, reply_to_message_id=message.message_id
-        )
+        with span('send'):
+            await send_smart_split_message(
+                bot=context.bot, chat_id=chat_id, text=bot_response, reply_to_message_id=message.message_id
+            )
         logger.info(f"Отправлен ответ для [chat_id: {chat_id}]: '{(bot_response[:200].strip())}'")
+        finish_trace(trace, 'answered')
 
     except Exception as e:
         logger.exception("Критическая ошибка в handle_message")
+        finish_trace(trace, 'error')
+        if not token.cancelled:
+            try:
+                await message.reply_text("Произошла внутренняя ошибка. Попробуйте задать вопрос иначе.")
+            except Exception:
+                logger.exception("Не удалось отправить сообщение об ошибке в чат %s.", chat_id)
     finally:
-        # --- UX: РАЗБЛОКИРОВКА ЮЗЕРА (ВСЕГДА) ---
-        PROCESSING_USERS.discard(user_id)
+        # --- UX: СНИМАЕМ РЕГИСТРАЦИЮ (ВСЕГДА), если её не заняло более новое сообщение ---
+        if ACTIVE_GENERATIONS.get(user_id) is token:
+            del ACTIVE_GENERATIONS[user_id]
 
 async def _process_pending_updates(application):
     try:
@@ -477,15 +605,11 @@ async def _process_pending_updates(application):
 
             response = None
             try:
-                intent = rag_bot.classify_intent(text)
-                if intent == 'schedule_lookup':
-                    response = "Я вижу, вы спрашивали про расписание. Напишите ФИО."
-                elif intent in ['creative_idea', 'creative_team_name']:
-                    response = "Я вижу ваш запрос на креатив. Повторите его, я готов!"
-                elif intent == 'smalltalk':
-                    response = rag_bot.answer_smalltalk(text)
-                else:
-                    response = rag_bot.answer_by_rag(text)
+                user_id = msg.from_user.id if msg.from_user else chat_id
+                # Состояние то же, что у handle_message: ФИО, которое ждали до перезапуска, не теряется
+                user_data = await read_user_state(user_id)
+                response = await application.bot_data['backend'].answer_pending(user_id, text, user_data)
+                await write_user_state(user_id, user_data)
             except Exception:
                 response = "К сожалению, при попытке ответить произошла ошибка. Задайте вопрос снова."
 
@@ -500,22 +624,120 @@ async def _process_pending_updates(application):
             logger.info("Очередь очищена.")
         except Exception: pass
 
-def main():
-    if not TELEGRAM_BOT_TOKEN:
-        print("❌ ОШИБКА: Токен Telegram не найден.")
-        return
-    print("Запуск Telegram-бота...")
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(_process_pending_updates).build()
+CIRCUIT_STATE_MESSAGES = {
+    'open': "🔴 Ollama недоступна, предохранитель разомкнут ({reason}). Отвечаю только из базы знаний.",
+    'half_open': "🟡 Ollama снова отвечает на проверки ({reason}). Пропускаю пробный запрос.",
+    'closed': "🟢 Ollama снова в строю ({reason}). Генерация ответов восстановлена.",
+}
+
+
+async def _notify_admins(bot, text: str):
+    for admin_id in ADMIN_USER_IDS:
+        try:
+            await bot.send_message(chat_id=admin_id, text=text)
+        except Exception as e:
+            logger.warning("Не удалось уведомить администратора %s: %s", admin_id, e)
+
+
+async def _post_init(application):
+    # Предохранитель переключается в рабочих потоках — уведомление отправляем через цикл событий бота
+    loop = asyncio.get_running_loop()
+
+    def on_circuit_change(previous: str, state: str, reason: str):
+        text = CIRCUIT_STATE_MESSAGES[state].format(reason=reason)
+        asyncio.run_coroutine_threadsafe(_notify_admins(application.bot, text), loop)
+
+    application.bot_data['backend'].set_circuit_listener(on_circuit_change)
+    # С webhook getUpdates недоступен, а накопившиеся апдейты Telegram сам доставит на webhook
+    if application.bot_data.get('mode') != 'webhook':
+        await _process_pending_updates(application)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Telegram-бот ОПД НГТУ")
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default='polling')
+    parser.add_argument('--listen', default=WEBHOOK_LISTEN, help='Адрес встроенного webhook-сервера')
+    parser.add_argument('--port', type=int, default=WEBHOOK_PORT)
+    parser.add_argument('--url_path', default=WEBHOOK_PATH)
+    parser.add_argument('--webhook_url', help='Публичный адрес за reverse proxy (по умолчанию http://listen:port/url_path)')
+    parser.add_argument('--secret_token', help='Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token')
+    parser.add_argument('--workers', type=int, default=CONCURRENT_UPDATES, help='Одновременно обрабатываемых апдейтов')
+    parser.add_argument('--state_db', type=Path, default=STATE_DB_PATH, help='SQLite-файл состояния диалогов')
+    parser.add_argument('--bot_api_url', help='Bot API вместо api.telegram.org, например заглушка webhook_replay.py')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Рабочих процессов с RAG (0 — всё в процессе бота, см. worker_pool.py)')
+    parser.add_argument(startup_profile.PROFILE_FLAG, action='store_true',
+                        help='Собрать бота без подключения к Telegram и напечатать время импортов и инициализации')
+    return parser.parse_args(argv)
+
+
+def create_application(args, backend) -> Application:
+    """Фабрика приложения: Application с обработчиками поверх созданного бэкенда."""
+    init_state(args.state_db)
+    builder = (Application.builder().token(TELEGRAM_BOT_TOKEN).concurrent_updates(args.workers)
+               .post_init(_post_init))
+    if args.bot_api_url:
+        builder = builder.base_url(args.bot_api_url)
+    application = builder.build()
+    application.bot_data['mode'] = args.mode
+    application.bot_data['backend'] = backend
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("menu", show_menu_and_log))
+    application.add_handler(CommandHandler("reload", reload_knowledge_command))
     application.add_handler(CallbackQueryHandler(button_callback_handler))
 
     menu_triggers = ['меню', 'помощь', 'что ты умеешь', 'что ты можешь', 'команды']
     application.add_handler(MessageHandler(filters.Regex(r'(?i)^\s*(' + r'|'.join(menu_triggers) + r')\s*$'), show_menu_and_log))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return application
+
+
+def profile_startup(args):
+    """
+    Собирает бота как main(), но без подключения к Telegram и фоновых задач
+    LocalBackend, и печатает разбивку импортов и этапов инициализации.
+    """
+    trace = start_trace()
+    with span('startup_backend'):
+        backend = init_backend(args.processes)
+    try:
+        if args.processes > 0:
+            with span('startup_workers'):
+                backend.start()
+        with span('startup_application'):
+            create_application(args, backend)
+    finally:
+        backend.close()
+    startup_profile.import_timer.uninstall()
+    startup_profile.print_report(trace.stages)
+
 
-    application.run_polling()
+def main(argv=None):
+    args = parse_args(argv)
+    if not TELEGRAM_BOT_TOKEN:
+        print("❌ ОШИБКА: Токен Telegram не найден.")
+        return
+    # Каждый апдейт занимает поток handler и ждёт классификацию и генерацию в пуле llm
+    configure_handler_workers(args.workers)
+    if args.profile_startup:
+        profile_startup(args)
+        return
+    print(f"Запуск Telegram-бота ({args.mode})...")
+    start_metrics_server()
+    backend = init_backend(args.processes)
+    backend.start()
+    application = create_application(args, backend)
+
+    if args.mode == 'webhook':
+        # Встроенный асинхронный сервер PTB (нужен python-telegram-bot[webhooks]) в том же event loop
+        webhook_url = args.webhook_url or f"http://{args.listen}:{args.port}/{args.url_path}"
+        application.run_webhook(listen=args.listen, port=args.port, url_path=args.url_path,
+                                webhook_url=webhook_url, secret_token=args.secret_token,
+                                allowed_updates=Update.ALL_TYPES)
+    else:
+        application.run_polling()
+    backend.close()
     print("Бот остановлен.")
 
 if __name__ == '__main__':
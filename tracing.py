@@ -0,0 +1,222 @@
+# coding: utf-8
+"""
+Лёгкая трассировка этапов обработки сообщения.
+
+- span(name) — контекстный менеджер, замеряющий этап. Длительность попадает
+  в гистограмму stage_duration_seconds и в трассу текущего запроса.
+- start_trace() / current_trace() — трасса одного сообщения. Хранится в
+  contextvars, поэтому видна и в потоках пулов этапов (executors.py).
+- start_metrics_server() — локальный HTTP-эндпоинт /metrics в текстовом
+  формате Prometheus.
+"""
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9464
+
+# Границы корзин гистограмм (сек): от быстрых этапов (лимиты, поиск) до генерации LLM
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 350.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+
+class MetricsRegistry:
+    """Потокобезопасное хранилище счётчиков, гауджей и гистограмм."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._help: Dict[str, str] = {}
+
+    @staticmethod
+    def _key(labels: Optional[Dict[str, str]]) -> LabelKey:
+        return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def inc(self, name: str, value: float = 1.0, labels: Optional[Dict[str, str]] = None):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = self._key(labels)
+            series[key] = series.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
+        with self._lock:
+            self._gauges.setdefault(name, {})[self._key(labels)] = value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None,
+                buckets: Iterable[float] = DEFAULT_BUCKETS):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = self._key(labels)
+            if key not in series:
+                series[key] = _Histogram(buckets)
+            series[key].observe(value)
+
+    def histogram_summary(self, name: str, labels: Optional[Dict[str, str]] = None) -> Tuple[int, float]:
+        """Возвращает (count, sum) гистограммы — удобно для средних значений."""
+        with self._lock:
+            hist = self._histograms.get(name, {}).get(self._key(labels))
+            return (hist.count, hist.sum) if hist else (0, 0.0)
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus."""
+        def fmt_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            pairs = key + extra
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+        lines = []
+        with self._lock:
+            for kind, store in (('counter', self._counters), ('gauge', self._gauges)):
+                for name, series in sorted(store.items()):
+                    if name in self._help:
+                        lines.append(f'# HELP {name} {self._help[name]}')
+                    lines.append(f'# TYPE {name} {kind}')
+                    for key, value in series.items():
+                        lines.append(f'{name}{fmt_labels(key)} {value}')
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} histogram')
+                for key, hist in series.items():
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{fmt_labels(key, (("le", str(bound)),))} {cumulative}')
+                    lines.append(f'{name}_bucket{fmt_labels(key, (("le", "+Inf"),))} {hist.count}')
+                    lines.append(f'{name}_sum{fmt_labels(key)} {hist.sum}')
+                    lines.append(f'{name}_count{fmt_labels(key)} {hist.count}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metrics.describe('stage_duration_seconds', 'Длительность этапов обработки сообщения')
+metrics.describe('ollama_tokens', 'Количество токенов, о котором сообщила Ollama')
+metrics.describe('ollama_tokens_total', 'Суммарное количество токенов Ollama')
+
+
+class Trace:
+    """Трасса одного сообщения: длительности этапов и произвольные поля."""
+
+    def __init__(self, **fields):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.fields: Dict[str, object] = dict(fields)
+
+    def add_stage(self, name: str, duration: float):
+        # Этап может выполняться несколько раз (например, два поиска в answer_by_rag)
+        self.stages[name] = self.stages.get(name, 0.0) + duration
+
+    def as_dict(self) -> Dict[str, object]:
+        data = dict(self.fields)
+        data['stages_ms'] = {k: round(v * 1000, 2) for k, v in self.stages.items()}
+        data['total_ms'] = round((time.perf_counter() - self.started) * 1000, 2)
+        return data
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('current_trace', default=None)
+
+
+def start_trace(**fields) -> Trace:
+    trace = Trace(**fields)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str):
+    """Замеряет этап: пишет в гистограмму и, если есть, в текущую трассу."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - t0
+        metrics.observe('stage_duration_seconds', duration, {'stage': name})
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage(name, duration)
+
+
+def record_ollama_stats(kind: str, response: dict):
+    """
+    Сохраняет счётчики токенов и внутренние тайминги из ответа /api/generate.
+    kind — тип промпта (intent, rag, creative...), чтобы различать нагрузку.
+    """
+    prompt_tokens = response.get('prompt_eval_count')
+    output_tokens = response.get('eval_count')
+    labels = {'kind': kind}
+    if prompt_tokens is not None:
+        metrics.observe('ollama_tokens', prompt_tokens, {**labels, 'type': 'prompt'}, TOKEN_BUCKETS)
+        metrics.inc('ollama_tokens_total', prompt_tokens, {**labels, 'type': 'prompt'})
+    if output_tokens is not None:
+        metrics.observe('ollama_tokens', output_tokens, {**labels, 'type': 'output'}, TOKEN_BUCKETS)
+        metrics.inc('ollama_tokens_total', output_tokens, {**labels, 'type': 'output'})
+    # Ollama отдаёт длительности в наносекундах
+    for field in ('load_duration', 'prompt_eval_duration', 'eval_duration'):
+        if response.get(field) is not None:
+            metrics.observe(f'ollama_{field}_seconds', response[field] / 1e9, labels)
+
+    trace = _current_trace.get()
+    if trace is not None:
+        tokens = trace.fields.setdefault('ollama_tokens', {})
+        tokens[f'{kind}_prompt'] = tokens.get(f'{kind}_prompt', 0) + (prompt_tokens or 0)
+        tokens[f'{kind}_output'] = tokens.get(f'{kind}_output', 0) + (output_tokens or 0)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics: " + format, *args)
+
+
+def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> ThreadingHTTPServer:
+    """Запускает эндпоинт /metrics в фоновом потоке."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Замер задержки «апдейт → ответ» для бота в режиме webhook без Telegram.
+
+Скрипт поднимает локальную заглушку Bot API (getMe, setWebhook, sendMessage,
+deleteMessage, ...), бот запускается против неё с --bot_api_url и сам
+регистрирует webhook. После этого записанные апдейты (JSONL в формате
+Telegram, например снятые на reverse proxy) или сгенерированные из Q/A-лога
+и датасета вопросы POST-ятся на webhook с заданной частотой.
+
+Для каждого апдейта считаются:
+ - first_reply — до первого sendMessage в чат (обычно «⏳ Думаю...»);
+ - answer      — до первого сообщения, которое бот потом не удалил.
+
+Пример:
+    python webhook_replay.py --spawn --rate 5 --limit 300 --workers 16
+    # или вручную, в другом терминале:
+    python telegram_bot.py --mode webhook --bot_api_url http://127.0.0.1:8081/bot --secret_token replay
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+import benchmark
+
+PROJECT_ROOT = Path(__file__).parent
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'OPD NSTU Bot', 'username': 'opd_replay_bot'}
+API_PATH_RE = re.compile(r'^/bot[^/]+/(\w+)$')
+FIRST_USER_ID = 100_000
+
+
+class BotApiStub:
+    """Состояние заглушки Bot API: зарегистрированный webhook и журнал вызовов бота."""
+
+    def __init__(self):
+        self.webhook: Dict[str, Any] = {}
+        self.webhook_set = threading.Event()
+        self.calls: Dict[str, int] = defaultdict(int)
+        # (время, метод, chat_id, message_id, текст) в порядке поступления
+        self.events: List[tuple] = []
+        self._message_ids = itertools.count(1_000_000)
+        self._lock = threading.Lock()
+
+    def handle(self, method: str, params: Dict[str, Any]):
+        now = time.monotonic()
+        with self._lock:
+            self.calls[method] += 1
+            if method == 'getMe':
+                return BOT_USER
+            if method == 'setWebhook':
+                self.webhook = {'url': params.get('url'), 'secret_token': params.get('secret_token')}
+                self.webhook_set.set()
+                return True
+            if method == 'getWebhookInfo':
+                return {'url': self.webhook.get('url', ''), 'has_custom_certificate': False, 'pending_update_count': 0}
+            if method == 'getUpdates':
+                return []
+            if method in ('sendMessage', 'editMessageText'):
+                chat_id = int(params['chat_id'])
+                message_id = next(self._message_ids) if method == 'sendMessage' else int(params['message_id'])
+                self.events.append((now, method, chat_id, message_id, str(params.get('text', ''))))
+                return {'message_id': message_id, 'date': int(time.time()), 'from': BOT_USER,
+                        'chat': {'id': chat_id, 'type': 'private'}, 'text': str(params.get('text', ''))}
+            if method == 'deleteMessage':
+                self.events.append((now, method, int(params['chat_id']), int(params['message_id']), ''))
+            return True
+
+
+class _BotApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    api: BotApiStub  # задаётся в make_server
+
+    def _send_json(self, status: int, data: dict):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _params(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length).decode('utf-8') if length else ''
+        if 'application/json' in (self.headers.get('Content-Type') or ''):
+            return json.loads(raw or '{}')
+        # PTB шлёт параметры формой, сложные значения — строками JSON
+        params = {}
+        for key, values in parse_qs(raw).items():
+            try:
+                params[key] = json.loads(values[0])
+            except ValueError:
+                params[key] = values[0]
+        return params
+
+    def do_POST(self):
+        match = API_PATH_RE.match(self.path)
+        if not match:
+            self._send_json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+        try:
+            result = self.api.handle(match.group(1), self._params())
+        except (KeyError, ValueError) as e:
+            self._send_json(400, {'ok': False, 'error_code': 400, 'description': f'Bad Request: {e}'})
+            return
+        self._send_json(200, {'ok': True, 'result': result})
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host: str = '127.0.0.1', port: int = 8081) -> ThreadingHTTPServer:
+    handler = type('BotApiHandler', (_BotApiHandler,), {'api': BotApiStub()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def load_updates(args, rng: random.Random) -> List[dict]:
+    """Записанные апдейты из JSONL или сообщения от отдельных студентов с вопросами из лога и датасета."""
+    if args.updates:
+        with open(args.updates, 'r', encoding='utf-8') as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+        updates = [u for u in updates if (u.get('message') or {}).get('text')]
+    else:
+        questions = [q['question'] for q in benchmark.load_log_questions(args.log_path)]
+        questions += [q['question'] for q in benchmark.load_dataset_questions(args.dataset_path)]
+        updates = []
+        for i, text in enumerate(questions):
+            # У каждого апдейта свой пользователь: не срабатывают антифлуд и отмена прежнего вопроса
+            user = {'id': FIRST_USER_ID + i, 'is_bot': False, 'first_name': f'Студент{i}', 'username': f'student{i}'}
+            updates.append({'message': {'message_id': i + 1, 'from': user,
+                                        'chat': {'id': user['id'], 'type': 'private'}, 'text': text}})
+    if args.limit and len(updates) > args.limit:
+        updates = rng.sample(updates, args.limit)
+    if not updates:
+        raise SystemExit("❌ Нет апдейтов для прогона.")
+    return updates
+
+
+def post_update(url: str, secret_token: Optional[str], update: dict, timeout: float):
+    """Доставляет апдейт на webhook. Возвращает (статус HTTP или None, время ответа webhook)."""
+    headers = {'Content-Type': 'application/json'}
+    if secret_token:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret_token
+    body = json.dumps(update, ensure_ascii=False).encode('utf-8')
+    started = time.monotonic()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, body, headers), timeout=timeout) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = None
+    return status, time.monotonic() - started
+
+
+def match_responses(api: BotApiStub, sent: List[tuple]) -> Dict[str, List[float]]:
+    """
+    Сопоставляет апдейты с ответами бота по chat_id: ответ достаётся самому
+    раннему ещё не отвеченному апдейту этого чата.
+    """
+    deleted = {(chat_id, message_id) for _, method, chat_id, message_id, _ in api.events if method == 'deleteMessage'}
+    first_reply_waiting: Dict[int, deque] = defaultdict(deque)
+    answer_waiting: Dict[int, deque] = defaultdict(deque)
+    for sent_at, chat_id in sorted(sent):
+        first_reply_waiting[chat_id].append(sent_at)
+        answer_waiting[chat_id].append(sent_at)
+    latencies: Dict[str, List[float]] = {'first_reply': [], 'answer': []}
+    for at, method, chat_id, message_id, _ in api.events:
+        if method != 'sendMessage':
+            continue
+        if first_reply_waiting[chat_id] and first_reply_waiting[chat_id][0] <= at:
+            latencies['first_reply'].append(at - first_reply_waiting[chat_id].popleft())
+        if (chat_id, message_id) not in deleted and answer_waiting[chat_id] and answer_waiting[chat_id][0] <= at:
+            latencies['answer'].append(at - answer_waiting[chat_id].popleft())
+    return latencies
+
+
+def run_replay(args, api: BotApiStub) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    updates = load_updates(args, rng)
+    url, secret_token = api.webhook['url'], api.webhook.get('secret_token')
+    print(f"▶️ {len(updates)} апдейтов на {url} с частотой {args.rate}/с...")
+
+    sent: List[tuple] = []
+    webhook_latencies: List[float] = []
+    statuses: Dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+    update_ids = itertools.count(1)
+
+    def deliver(update: dict):
+        chat_id = update['message']['chat']['id']
+        sent_at = time.monotonic()
+        status, elapsed = post_update(url, secret_token, update, args.timeout)
+        with lock:
+            statuses[str(status)] += 1
+            webhook_latencies.append(elapsed)
+            if status == 200:
+                sent.append((sent_at, chat_id))
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.senders) as senders:
+        for update in updates:
+            # Свежие update_id и дата: у записанных апдейтов они из прошлого
+            update = {**update, 'update_id': next(update_ids),
+                      'message': {**update['message'], 'date': int(time.time())}}
+            senders.submit(deliver, update)
+            time.sleep(rng.expovariate(args.rate))
+
+    # Ждём ответов, пока бот не отвечает drain_timeout секунд подряд
+    last_count, quiet_since = -1, time.monotonic()
+    while time.monotonic() - quiet_since < args.drain_timeout:
+        count = len(api.events)
+        if count != last_count:
+            last_count, quiet_since = count, time.monotonic()
+        if len(match_responses(api, sent)['answer']) >= len(sent):
+            break
+        time.sleep(0.5)
+    elapsed = time.monotonic() - started
+
+    latencies = match_responses(api, sent)
+    return {
+        "config": {
+            "rate": args.rate,
+            "limit": args.limit,
+            "updates": str(args.updates) if args.updates else None,
+            "workers": args.workers if args.spawn else None,
+            "seed": args.seed,
+        },
+        "sent": len(updates),
+        "accepted": len(sent),
+        "answered": len(latencies['answer']),
+        "webhook_status": dict(statuses),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_per_second": round(len(latencies['answer']) / elapsed, 3) if elapsed else None,
+        "latency": {
+            "webhook_ack": benchmark.latency_stats(webhook_latencies),
+            "first_reply": benchmark.latency_stats(latencies['first_reply']),
+            "answer": benchmark.latency_stats(latencies['answer']),
+        },
+        "bot_api_calls": dict(api.calls),
+    }
+
+
+def spawn_bot(args, api_url: str) -> subprocess.Popen:
+    command = [sys.executable, str(PROJECT_ROOT / 'telegram_bot.py'), '--mode', 'webhook',
+               '--port', str(args.bot_port), '--workers', str(args.workers),
+               '--bot_api_url', api_url, '--secret_token', args.secret_token]
+    print(f"🚀 Запускаю бота: {' '.join(command)}")
+    return subprocess.Popen(command, cwd=PROJECT_ROOT)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Задержка апдейт → ответ для бота в режиме webhook")
+    parser.add_argument('--api_host', default='127.0.0.1')
+    parser.add_argument('--api_port', type=int, default=8081, help='Порт заглушки Bot API')
+    parser.add_argument('--spawn', action='store_true', help='Запустить telegram_bot.py --mode webhook самому')
+    parser.add_argument('--bot_port', type=int, default=8443)
+    parser.add_argument('--workers', type=int, default=16, help='--workers для запускаемого бота')
+    parser.add_argument('--secret_token', default='replay')
+    parser.add_argument('--updates', type=Path, help='JSONL с записанными апдейтами Telegram')
+    parser.add_argument('--log_path', type=Path, default=benchmark.LOG_PATH)
+    parser.add_argument('--dataset_path', type=Path, default=benchmark.DATASET_PATH)
+    parser.add_argument('--limit', type=int, default=200, help='Случайная выборка апдейтов (0 — все)')
+    parser.add_argument('--rate', type=float, default=5.0, help='Апдейтов в секунду')
+    parser.add_argument('--senders', type=int, default=32, help='Одновременных POST на webhook')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Таймаут POST на webhook, сек')
+    parser.add_argument('--startup_timeout', type=float, default=600.0, help='Ожидание setWebhook от бота, сек')
+    parser.add_argument('--drain_timeout', type=float, default=60.0,
+                        help='Сколько ждать ответов после тишины со стороны бота, сек')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', type=Path, default=Path('webhook_replay_results.json'))
+    args = parser.parse_args(argv)
+
+    server = make_server(args.api_host, args.api_port)
+    threading.Thread(target=server.serve_forever, name='bot-api-stub', daemon=True).start()
+    api = server.RequestHandlerClass.api
+    api_url = f"http://{args.api_host}:{server.server_address[1]}/bot"
+    print(f"🧪 Заглушка Bot API: {api_url}")
+
+    bot = spawn_bot(args, api_url) if args.spawn else None
+    try:
+        if not bot:
+            print(f"Ожидаю бота: python telegram_bot.py --mode webhook --bot_api_url {api_url} "
+                  f"--secret_token {args.secret_token}")
+        if not api.webhook_set.wait(args.startup_timeout):
+            raise SystemExit("❌ Бот не зарегистрировал webhook.")
+        report = run_replay(args, api)
+    finally:
+        if bot is not None:
+            bot.terminate()
+            bot.wait(timeout=30)
+        server.shutdown()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True))
+    print(f"✅ Результаты сохранены: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,516 @@
+# coding: utf-8
+"""
+Бэкенды обработки вопросов для telegram_bot.
+
+ - LocalBackend — RAGChatBot в процессе бота (как раньше), тяжёлые вызовы
+   идут в пулы этапов executors.py;
+ - WorkerPool — фронт-процесс с Telegram раздаёт задачи N рабочим
+   процессам. Модель эмбеддингов живёт в одном процессе (model_server.py),
+   а индекс FAISS, knowledge_store/ и schedule_store/ каждый воркер
+   открывает через mmap — копий в памяти нет, страницы общие.
+
+Задачи пользователя всегда уходят одному воркеру (user_id % N) по одному
+соединению и там выполняются строго по очереди, поэтому порядок сообщений
+пользователя сохраняется. Отмена («стоп», новое сообщение) передаётся
+воркеру отдельным сообщением и рвёт его запрос к Ollama.
+
+Общее для Ollama держит фронт: он один проверяет её здоровье и рассылает
+результат предохранителям воркеров, выдаёт разрешение на пополнение пулов
+заготовленных ответов (одному воркеру за раз) и заводит массив активности
+LLM со слотом на воркер — фоновая генерация идёт одна на всех и только пока
+никто из воркеров не ждёт LLM. Упавший воркер фронт перезапускает, его
+задачи завершаются обычной ошибкой, а разрешение и слоты освобождаются.
+"""
+import asyncio
+import itertools
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Callable, Dict, Optional
+
+import rag_chatbot
+from cancellation import CancelToken, GenerationCancelled, cancel_scope, current_cancel_token
+from circuit_breaker import CLOSED, STATE_CODES, HealthProber
+from executors import CPU_STAGE, HANDLER_STAGE, LLM_STAGE, STAGE_WORKERS, configure_executors, get_executor
+from model_server import RemoteEncoder, start_encoder_process
+from ollama_client import ping
+from state_store import STATE_KEYS
+from tracing import METRICS_PORT, current_trace, start_metrics_server, start_trace
+
+# Пауза перед перезапуском упавшего рабочего процесса (и между неудачными попытками), сек
+WORKER_RESTART_DELAY = 1.0
+# Сколько воркер ждёт ответа фронта на запрос пополнения пулов, сек
+REFILL_PERMIT_TIMEOUT = 5.0
+
+
+class LocalBackend:
+    """RAGChatBot в этом же процессе."""
+
+    def __init__(self, bot: 'rag_chatbot.RAGChatBot'):
+        self.bot = bot
+
+    def start(self):
+        self.bot.start_knowledge_watcher()
+        self.bot.start_response_pools()
+        rag_chatbot.start_ollama_health_monitor()
+
+    def set_circuit_listener(self, callback: Callable[[str, str, str], None]):
+        rag_chatbot.ollama_breaker.on_state_change = callback
+
+    def submit_question(self, user_id: int, question: str, user_data: dict, received: float) -> asyncio.Future:
+        """Задача ставится сразу, без await: вызывающий сохраняет порядок сообщений. Результат — (ответ, намерение)."""
+        return asyncio.wrap_future(get_executor(HANDLER_STAGE).submit(self.bot.handle_question, question, user_data, received))
+
+    async def answer_pending(self, user_id: int, question: str, user_data: dict) -> str:
+        """Ответ на сообщение, накопившееся за время простоя (см. RAGChatBot.answer_pending)."""
+        return await get_executor(HANDLER_STAGE).run_async(self.bot.answer_pending, question, user_data)
+
+    async def security_joke(self, user_id: int) -> str:
+        return await get_executor(LLM_STAGE).run_async(self.bot.generate_security_joke)
+
+    async def reload(self) -> dict:
+        await get_executor(CPU_STAGE).run_async(self.bot.reload_knowledge)
+        return self.bot.knowledge_info()
+
+    def close(self):
+        pass
+
+
+# --- Рабочий процесс ---
+
+class _RefillPermit:
+    """
+    Замок пополнения пулов для ResponsePool: разрешение выдаёт фронт. Межпроцессного
+    замка нет — упавший посреди генерации воркер не унесёт его с собой.
+    """
+
+    def __init__(self):
+        self.send: Optional[Callable[[tuple], None]] = None
+        self._replies: 'queue.Queue[tuple]' = queue.Queue()
+        self._requests = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking: bool = False) -> bool:
+        # Пулы процесса спрашивают по очереди; ответ узнаём по номеру запроса
+        with self._lock:
+            request_id = next(self._requests)
+            self.send(('refill', True, request_id))
+            deadline = time.monotonic() + REFILL_PERMIT_TIMEOUT
+            while True:
+                try:
+                    granted, replied_to = self._replies.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    # Опоздавшее разрешение вернётся фронту этим же release
+                    self.release()
+                    return False
+                if replied_to == request_id:
+                    return granted
+
+    def release(self):
+        self.send(('refill', False, None))
+
+    def reply(self, granted: bool, request_id: int):
+        self._replies.put((granted, request_id))
+
+
+class _Worker:
+    """Принимает задачи от фронта и выполняет задачи одного пользователя по очереди."""
+
+    def __init__(self, bot: 'rag_chatbot.RAGChatBot', conn, refill_permit: Optional[_RefillPermit] = None):
+        self.bot = bot
+        self.conn = conn
+        self.refill_permit = refill_permit
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._queues: Dict[int, deque] = {}
+        self._tokens: Dict[int, CancelToken] = {}
+
+    def send(self, message: tuple):
+        with self._send_lock:
+            self.conn.send(message)
+
+    def serve(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                return  # фронт завершился
+            if message[0] == 'cancel':
+                _, job_id, reason = message
+                with self._lock:
+                    token = self._tokens.get(job_id)
+                if token is not None:
+                    token.cancel(reason)
+            elif message[0] == 'job':
+                self._enqueue(*message[1:])
+            elif message[0] == 'probe':
+                # Ollama проверяет фронт — один раз на всех, а не каждый воркер отдельно
+                error = message[1]
+                if error is None:
+                    rag_chatbot.ollama_breaker.record_probe_success()
+                else:
+                    rag_chatbot.ollama_breaker.record_failure(error)
+            elif message[0] == 'refill':
+                self.refill_permit.reply(*message[1:])
+
+    def _enqueue(self, job_id: int, user_id: int, kind: str, args: tuple):
+        job = (job_id, kind, args)
+        with self._lock:
+            self._tokens[job_id] = CancelToken()
+            if kind == 'reload':
+                get_executor(CPU_STAGE).submit(self._run, *job)
+                return
+            pending = self._queues.get(user_id)
+            if pending is not None:
+                pending.append(job)
+                return
+            self._queues[user_id] = deque()
+        get_executor(HANDLER_STAGE).submit(self._drain, user_id, job)
+
+    def _drain(self, user_id: int, job: Optional[tuple]):
+        while job is not None:
+            self._run(*job)
+            with self._lock:
+                pending = self._queues[user_id]
+                if pending:
+                    job = pending.popleft()
+                else:
+                    del self._queues[user_id]
+                    job = None
+
+    def _run(self, job_id: int, kind: str, args: tuple):
+        with self._lock:
+            token = self._tokens[job_id]
+        trace = start_trace()
+        try:
+            with cancel_scope(token):
+                token.raise_if_cancelled()
+                if kind == 'question':
+                    question, user_data, received = args
+                    answer, intent = self.bot.handle_question(question, user_data, received)
+                    result = ('ok', (answer, intent, user_data, trace.stages))
+                elif kind == 'pending':
+                    question, user_data = args
+                    result = ('ok', (self.bot.answer_pending(question, user_data), None, user_data, trace.stages))
+                elif kind == 'joke':
+                    result = ('ok', (self.bot.generate_security_joke(), None, {}, trace.stages))
+                else:
+                    self.bot.reload_knowledge()
+                    result = ('ok', self.bot.knowledge_info())
+        except GenerationCancelled as e:
+            result = ('cancelled', str(e))
+        except Exception as e:
+            traceback.print_exc()
+            result = ('error', f"{type(e).__name__}: {e}")
+        finally:
+            with self._lock:
+                self._tokens.pop(job_id, None)
+        self.send(('result', job_id) + result)
+
+
+def _worker_main(worker_id: int, conn, encoder_address: str, authkey: bytes, pool_size: int,
+                 stage_workers: Dict[str, int], ollama_activity):
+    # Заготовленные ответы делятся между воркерами, чтобы фоновая генерация не росла в N раз
+    rag_chatbot.RESPONSE_POOL_SIZE = pool_size
+    refill_permit = rag_chatbot.response_pool_refill_lock = _RefillPermit()
+    rag_chatbot.ollama_activity = rag_chatbot.OllamaActivity(ollama_activity, worker_id)
+    configure_executors(**stage_workers)
+    bot = rag_chatbot.RAGChatBot(debug=False, encoder=RemoteEncoder(encoder_address, authkey))
+    worker = _Worker(bot, conn, refill_permit)
+    refill_permit.send = worker.send
+    rag_chatbot.ollama_breaker.on_state_change = lambda *change: worker.send(('circuit',) + change)
+    start_metrics_server(port=METRICS_PORT + 1 + worker_id)
+    bot.start_knowledge_watcher()
+    worker.send(('ready', worker_id, os.getpid()))
+    # Пулы — после ready: до него фронт не читает соединение и не ответит на запрос пополнения
+    bot.start_response_pools()
+    worker.serve()
+
+
+# --- Фронт ---
+
+class _PendingJob:
+    __slots__ = ('worker', 'loop', 'future', 'user_data', 'trace', 'unregister')
+
+    def __init__(self, worker, loop, future, user_data, trace, unregister):
+        self.worker = worker
+        self.loop = loop
+        self.future = future
+        self.user_data = user_data
+        self.trace = trace
+        self.unregister = unregister
+
+
+class _ProbeBroadcast:
+    """Предохранитель для HealthProber фронта: результаты проверок уходят предохранителям всех воркеров."""
+
+    def __init__(self, pool: 'WorkerPool'):
+        self.pool = pool
+        self.name = rag_chatbot.ollama_breaker.name
+
+    def record_probe_success(self):
+        self.pool._broadcast(('probe', None))
+
+    def record_failure(self, error: str):
+        self.pool._broadcast(('probe', error))
+
+
+class WorkerPool:
+    """Фронт-часть: раздаёт задачи рабочим процессам и собирает ответы."""
+
+    def __init__(self, processes: int):
+        self.processes = processes
+        self._conns = []
+        self._procs = []
+        self._send_locks = [threading.Lock() for _ in range(processes)]
+        self._pending: Dict[int, _PendingJob] = {}
+        self._pending_lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        self._ctx = None
+        self._spawn_args: Optional[tuple] = None
+        self._activity = None
+        # Воркер, которому сейчас разрешено пополнять пулы заготовленных ответов
+        self._refill_owner: Optional[int] = None
+        self._refill_lock = threading.Lock()
+        self._closing = False
+        self._encoder = None
+        self._socket_dir: Optional[str] = None
+        self._circuit_listener: Optional[Callable[[str, str, str], None]] = None
+        # У каждого воркера свой предохранитель; слушатель узнаёт только о смене худшего из состояний
+        self._circuit_states = [CLOSED] * processes
+        self._circuit_notified = CLOSED
+        self._circuit_lock = threading.Lock()
+
+    def start(self):
+        # Снимок расписания собирается один раз здесь, воркеры только открывают его
+        rag_chatbot.ensure_schedule_store()
+        ctx = self._ctx = multiprocessing.get_context('spawn')
+        authkey = os.urandom(32)
+        self._socket_dir = tempfile.mkdtemp(prefix='opd-bot-')
+        encoder_address = os.path.join(self._socket_dir, 'encoder.sock')
+        self._encoder = start_encoder_process(ctx, encoder_address, authkey,
+                                              rag_chatbot.EMBEDDER_MODEL, rag_chatbot.EMBEDDER_DEVICE)
+        pool_size = -(-rag_chatbot.RESPONSE_POOL_SIZE // self.processes)
+        stage_workers = {stage: STAGE_WORKERS[stage] for stage in (HANDLER_STAGE, LLM_STAGE)}
+        # Активность LLM: по слоту «запросов в работе» и «время последнего» на воркер, без общего замка
+        self._activity = ctx.Array('d', 2 * self.processes, lock=False)
+        self._spawn_args = (encoder_address, authkey, pool_size, stage_workers, self._activity)
+        for worker_id in range(self.processes):
+            conn, process = self._spawn(worker_id)
+            self._conns.append(conn)
+            self._procs.append(process)
+        for worker_id, conn in enumerate(self._conns):
+            self._wait_ready(worker_id, conn)
+            threading.Thread(target=self._read, args=(worker_id,), name=f'worker-reader-{worker_id}',
+                             daemon=True).start()
+        HealthProber(_ProbeBroadcast(self),
+                     lambda: ping(rag_chatbot.OLLAMA_HOST, rag_chatbot.OLLAMA_HEALTH_TIMEOUT),
+                     rag_chatbot.OLLAMA_HEALTH_INTERVAL).start()
+
+    def _spawn(self, worker_id: int):
+        parent, child = self._ctx.Pipe()
+        args = (worker_id, child) + self._spawn_args
+        process = self._ctx.Process(target=_worker_main, args=args, name=f'rag-worker-{worker_id}', daemon=True)
+        process.start()
+        child.close()
+        return parent, process
+
+    @staticmethod
+    def _wait_ready(worker_id: int, conn):
+        try:
+            _, _, pid = conn.recv()
+        except EOFError:
+            raise RuntimeError(f'Рабочий процесс {worker_id} завершился при запуске') from None
+        print(f'✅ Рабочий процесс {worker_id} готов (pid {pid})')
+
+    def set_circuit_listener(self, callback: Callable[[str, str, str], None]):
+        self._circuit_listener = callback
+
+    def _send(self, worker: int, message: tuple):
+        with self._send_locks[worker]:
+            self._conns[worker].send(message)
+
+    def _send_quietly(self, worker: int, message: tuple):
+        """Для служебных сообщений: упавшему воркеру они уже не нужны."""
+        try:
+            self._send(worker, message)
+        except OSError:
+            pass
+
+    def _broadcast(self, message: tuple):
+        for worker in range(self.processes):
+            self._send_quietly(worker, message)
+
+    def _submit(self, worker: int, user_id: int, kind: str, args: tuple, user_data: Optional[dict] = None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job_id = next(self._job_ids)
+        job = _PendingJob(worker, loop, future, user_data, current_trace(), lambda: None)
+        with self._pending_lock:
+            self._pending[job_id] = job
+        try:
+            self._send(worker, ('job', job_id, user_id, kind, args))
+        except OSError as e:
+            # Воркер упал или перезапускается — задача завершается обычной ошибкой, а не исключением в обработчике
+            with self._pending_lock:
+                self._pending.pop(job_id, None)
+            if not future.done():
+                future.set_exception(RuntimeError(f'рабочий процесс {worker} недоступен: {e}'))
+            return future
+        # Подписка после отправки: уже отменённый токен шлёт отмену вслед за задачей, а не до неё
+        token = current_cancel_token()
+        if token is not None:
+            job.unregister = token.on_cancel(lambda: self._send_quietly(worker, ('cancel', job_id, token.reason)))
+        return future
+
+    def submit_question(self, user_id: int, question: str, user_data: dict, received: float) -> asyncio.Future:
+        """Отправляет задачу сразу, без await: вызывающий сохраняет порядок сообщений. Результат — (ответ, намерение)."""
+        state = {key: user_data[key] for key in STATE_KEYS if key in user_data}
+        return self._submit(user_id % self.processes, user_id, 'question', (question, state, received), user_data)
+
+    async def answer_pending(self, user_id: int, question: str, user_data: dict) -> str:
+        state = {key: user_data[key] for key in STATE_KEYS if key in user_data}
+        answer, _ = await self._submit(user_id % self.processes, user_id, 'pending', (question, state), user_data)
+        return answer
+
+    async def security_joke(self, user_id: int) -> str:
+        try:
+            answer, _ = await self._submit(user_id % self.processes, user_id, 'joke', ())
+        except RuntimeError:
+            return rag_chatbot.SECURITY_JOKE_FALLBACK
+        return answer
+
+    async def reload(self) -> dict:
+        infos = await asyncio.gather(*(self._submit(worker, 0, 'reload', ()) for worker in range(self.processes)))
+        return {**infos[0], 'workers': len(infos)}
+
+    def _read(self, worker: int):
+        while True:
+            self._read_results(worker)
+            print(f'❌ Рабочий процесс {worker} отключился')
+            with self._send_locks[worker]:
+                self._conns[worker].close()
+            self._fail_pending(worker)
+            if self._closing or not self._restart(worker):
+                return
+
+    def _read_results(self, worker: int):
+        conn = self._conns[worker]
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            if message[0] == 'circuit':
+                self._on_circuit_change(worker, *message[2:])
+                continue
+            if message[0] == 'refill':
+                self._on_refill(worker, *message[1:])
+                continue
+            _, job_id, status, payload = message
+            with self._pending_lock:
+                job = self._pending.pop(job_id, None)
+            if job is not None:
+                job.unregister()
+                job.loop.call_soon_threadsafe(self._resolve, job, status, payload)
+
+    def _fail_pending(self, worker: int):
+        with self._pending_lock:
+            lost = [(job_id, job) for job_id, job in self._pending.items() if job.worker == worker]
+            for job_id, _ in lost:
+                del self._pending[job_id]
+        for _, job in lost:
+            job.unregister()
+            job.loop.call_soon_threadsafe(self._resolve, job, 'error', f'рабочий процесс {worker} недоступен')
+
+    def _on_refill(self, worker: int, acquire: bool, request_id: Optional[int]):
+        """Разрешение на пополнение пулов: одно на все процессы, ответ — только на запрос."""
+        with self._refill_lock:
+            if not acquire:
+                if self._refill_owner == worker:
+                    self._refill_owner = None
+                return
+            granted = self._refill_owner is None
+            if granted:
+                self._refill_owner = worker
+        self._send_quietly(worker, ('refill', granted, request_id))
+
+    def _restart(self, worker: int) -> bool:
+        """Запускает воркер заново, пока не получится или пул не закроют. False — пул закрывается."""
+        self._procs[worker].join(timeout=10)
+        # Запросы упавшего воркера к LLM уже не завершатся, а разрешение на пополнение он не вернёт
+        self._activity[worker] = 0
+        with self._refill_lock:
+            if self._refill_owner == worker:
+                self._refill_owner = None
+        while not self._closing:
+            time.sleep(WORKER_RESTART_DELAY)
+            print(f'🔄 Перезапуск рабочего процесса {worker}...')
+            conn, process = self._spawn(worker)
+            try:
+                self._wait_ready(worker, conn)
+            except RuntimeError as e:
+                print(f'⚠️ {e}')
+                conn.close()
+                process.join(timeout=10)
+                continue
+            with self._send_locks[worker]:
+                self._conns[worker] = conn
+                self._procs[worker] = process
+            # Новый процесс начинает с замкнутым предохранителем
+            self._on_circuit_change(worker, CLOSED, f'рабочий процесс {worker} перезапущен')
+            return True
+        return False
+
+    def _on_circuit_change(self, worker: int, state: str, reason: str):
+        """Ollama общая: без свёртки N воркеров прислали бы администраторам N одинаковых сообщений."""
+        with self._circuit_lock:
+            self._circuit_states[worker] = state
+            worst = max(self._circuit_states, key=STATE_CODES.__getitem__)
+            if worst == self._circuit_notified:
+                return
+            previous, self._circuit_notified = self._circuit_notified, worst
+            # Под блокировкой: читатели разных воркеров не переставят уведомления местами
+            if self._circuit_listener is not None:
+                self._circuit_listener(previous, worst, reason)
+
+    @staticmethod
+    def _resolve(job: _PendingJob, status: str, payload):
+        if job.future.done():
+            return
+        if status == 'cancelled':
+            job.future.set_exception(GenerationCancelled(payload))
+        elif status == 'error':
+            job.future.set_exception(RuntimeError(payload))
+        elif isinstance(payload, dict):
+            job.future.set_result(payload)
+        else:
+            answer, intent, state, stages = payload
+            if job.user_data is not None:
+                for key in STATE_KEYS:
+                    if key in state:
+                        job.user_data[key] = state[key]
+                    else:
+                        job.user_data.pop(key, None)
+            if job.trace is not None:
+                for name, duration in stages.items():
+                    job.trace.add_stage(name, duration)
+            job.future.set_result((answer, intent))
+
+    def close(self):
+        self._closing = True
+        for worker, conn in enumerate(self._conns):
+            with self._send_locks[worker]:
+                conn.close()
+        for process in self._procs + [self._encoder]:
+            if process is not None:
+                process.terminate()
+                process.join(timeout=10)
+        if self._socket_dir:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)